@@ -0,0 +1,218 @@
+import asyncio
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Overloaded(Exception):
+    """Raised when a call is shed: the wait queue is full or its deadline passed."""
+
+
+def is_rate_limited(error):
+    """True for quota errors (HTTP 429 / google.api_core ResourceExhausted)."""
+    for attr in ("code", "status_code", "status"):
+        if getattr(error, attr, None) == 429:
+            return True
+    return type(error).__name__ == "ResourceExhausted"
+
+
+class _AdmissionBase:
+    def __init__(self, max_concurrency=8, max_queue=32, max_wait=10.0,
+                 retries=2, backoff=1.0, max_backoff=30.0, name="admission"):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.name = name
+
+        self.in_flight = 0
+        self.waiting = 0
+        # After a 429 nobody is admitted until paused_until
+        self.paused_until = 0.0
+        self._rate_limit_streak = 0
+
+        self.admitted = 0
+        self.shed = 0
+        self.rate_limited = 0
+        self.wait_count = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def stats(self):
+        return {
+            "name": self.name,
+            "in_flight": self.in_flight,
+            "queue_depth": self.waiting,
+            "admitted": self.admitted,
+            "shed": self.shed,
+            "rate_limited": self.rate_limited,
+            "wait_avg": self.wait_total / self.wait_count if self.wait_count else 0.0,
+            "wait_max": self.wait_max,
+            "paused_for": max(0.0, self.paused_until - time.monotonic()),
+        }
+
+    def _can_enter(self, now):
+        return self.in_flight < self.max_concurrency and now >= self.paused_until
+
+    def _admit(self, started):
+        waited = time.monotonic() - started
+        self.in_flight += 1
+        self.admitted += 1
+        self.wait_count += 1
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+
+    def _shed(self, reason):
+        self.shed += 1
+        logger.warning(
+            "Shedding call", extra={"component": self.name, "reason": reason,
+                                    "in_flight": self.in_flight, "queued": self.waiting}
+        )
+        raise Overloaded(reason)
+
+    def _note_rate_limit(self):
+        delay = min(self.max_backoff, self.backoff * (2 ** self._rate_limit_streak))
+        self._rate_limit_streak += 1
+        self.rate_limited += 1
+        self.paused_until = max(self.paused_until, time.monotonic() + delay)
+        logger.warning("Rate limited, pausing admissions", extra={"component": self.name, "pause_s": round(delay, 2)})
+
+    def _wait_timeout(self, now, deadline):
+        if now < self.paused_until:
+            return min(deadline, self.paused_until) - now
+        return deadline - now
+
+
+class AdmissionController(_AdmissionBase):
+    """
+    Bounds concurrent calls to a rate-limited dependency (Gemini).
+
+    At most `max_concurrency` calls run at once; up to `max_queue` more wait
+    (each for at most `max_wait` seconds in total) and anything beyond is
+    shed immediately with Overloaded, so callers can answer "we're busy"
+    instead of piling up. A 429 pauses all admissions with exponential
+    backoff and the call is retried (up to `retries` times) within its
+    original deadline.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._cond = threading.Condition()
+
+    def call(self, fn, *args, **kwargs):
+        deadline = time.monotonic() + self.max_wait
+        attempt = 0
+        while True:
+            self.acquire(deadline)
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                if not is_rate_limited(e) or attempt >= self.retries:
+                    raise
+                with self._cond:
+                    self._note_rate_limit()
+                attempt += 1
+                continue
+            finally:
+                self.release()
+            with self._cond:
+                self._rate_limit_streak = 0
+            return result
+
+    def acquire(self, deadline=None):
+        started = time.monotonic()
+        deadline = started + self.max_wait if deadline is None else deadline
+        with self._cond:
+            if self.waiting == 0 and self._can_enter(started):
+                self._admit(started)
+                return
+            if self.waiting >= self.max_queue:
+                self._shed("queue full")
+            self.waiting += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    if self._can_enter(now):
+                        self._admit(started)
+                        return
+                    if now >= deadline:
+                        self._shed("wait deadline passed")
+                    self._cond.wait(self._wait_timeout(now, deadline))
+            finally:
+                self.waiting -= 1
+
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            return super().stats()
+
+
+class AsyncAdmissionController(_AdmissionBase):
+    """asyncio version of AdmissionController; `fn` is a coroutine function."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._cond = None
+
+    async def call(self, fn, *args, **kwargs):
+        deadline = time.monotonic() + self.max_wait
+        attempt = 0
+        while True:
+            await self.acquire(deadline)
+            try:
+                result = await fn(*args, **kwargs)
+            except Exception as e:
+                if not is_rate_limited(e) or attempt >= self.retries:
+                    raise
+                self._note_rate_limit()
+                attempt += 1
+                continue
+            finally:
+                await self.release()
+            self._rate_limit_streak = 0
+            return result
+
+    async def acquire(self, deadline=None):
+        started = time.monotonic()
+        deadline = started + self.max_wait if deadline is None else deadline
+        cond = self._condition()
+        async with cond:
+            if self.waiting == 0 and self._can_enter(started):
+                self._admit(started)
+                return
+            if self.waiting >= self.max_queue:
+                self._shed("queue full")
+            self.waiting += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    if self._can_enter(now):
+                        self._admit(started)
+                        return
+                    if now >= deadline:
+                        self._shed("wait deadline passed")
+                    try:
+                        await asyncio.wait_for(cond.wait(), self._wait_timeout(now, deadline))
+                    except asyncio.TimeoutError:
+                        pass
+            finally:
+                self.waiting -= 1
+
+    async def release(self):
+        async with self._condition():
+            self.in_flight -= 1
+            self._condition().notify()
+
+    def _condition(self):
+        # Created on first use so it binds to the server's running loop
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        return self._cond
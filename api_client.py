@@ -0,0 +1,220 @@
+import asyncio
+import json
+import os
+import threading
+
+from singleflight import AsyncSingleFlight, SingleFlight
+
+# Config
+API_BASE_URL = os.getenv("API_BASE_URL", "https://bi.siissoft.com/secureappointment/api/v1")
+API_POOL_SIZE = int(os.getenv("API_POOL_SIZE", "20"))
+API_CONNECT_TIMEOUT = float(os.getenv("API_CONNECT_TIMEOUT", "3.05"))
+API_READ_TIMEOUT = float(os.getenv("API_READ_TIMEOUT", "15"))
+API_VERIFY_SSL = os.getenv("API_VERIFY_SSL", "true").lower() in ("1", "true", "yes")
+
+
+class ApiClient:
+    """
+    Shared client for the secureappointment backend.
+    Keeps one keep-alive connection pool to the API host so consecutive calls
+    reuse the same TCP+TLS connection instead of handshaking every time.
+    The session (and the requests import) is created on first use.
+    """
+
+    def __init__(self, base_url=API_BASE_URL, pool_size=API_POOL_SIZE,
+                 timeout=(API_CONNECT_TIMEOUT, API_READ_TIMEOUT), verify=API_VERIFY_SSL):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.verify = verify
+        self.pool_size = pool_size
+        self._session = None
+        self._session_lock = threading.Lock()
+
+        # Identical in-flight GETs share a single network call
+        self.inflight = SingleFlight()
+
+        # Optional TokenManager used to renew the token and retry once on 401
+        self.token_manager = None
+
+        # Optional CircuitBreaker; connection errors, timeouts and 5xx count as failures
+        self.breaker = None
+
+    @property
+    def session(self):
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    import requests
+                    from requests.adapters import HTTPAdapter
+
+                    session = requests.Session()
+                    # pool_block keeps the pool bounded: extra threads wait for a free
+                    # connection instead of opening throwaway ones.
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, pool_block=True)
+                    session.mount("https://", adapter)
+                    session.mount("http://", adapter)
+                    session.headers.update({"Accept": "application/json"})
+                    self._session = session
+        return self._session
+
+    def url(self, path):
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    def request(self, method, path, access_token=None, headers=None, timeout=None, **kwargs):
+        """
+        Send a request to `path` (relative to the base URL).
+        `timeout` overrides the client default for this call only.
+        If the token is rejected with a 401 and a token manager is set, the
+        token is renewed and the request is retried once.
+        """
+        response = self._send(method, path, access_token, headers, timeout, kwargs)
+
+        if response.status_code == 401 and access_token and self.token_manager is not None:
+            new_token = self.token_manager.invalidate(access_token)
+            if new_token and new_token != access_token:
+                response = self._send(method, path, new_token, headers, timeout, kwargs)
+
+        return response
+
+    def _send(self, method, path, access_token, headers, timeout, kwargs):
+        request_headers = {}
+        if access_token:
+            request_headers["Authorization"] = f"Bearer {access_token}"
+        if headers:
+            request_headers.update(headers)
+
+        if self.breaker is not None:
+            self.breaker.before_call()
+        try:
+            response = self.session.request(
+                method,
+                self.url(path),
+                headers=request_headers,
+                timeout=timeout or self.timeout,
+                verify=self.verify,
+                **kwargs
+            )
+        except Exception:
+            if self.breaker is not None:
+                self.breaker.record(False)
+            raise
+        if self.breaker is not None:
+            self.breaker.record(response.status_code < 500)
+        return response
+
+    def get(self, path, coalesce=True, **kwargs):
+        """
+        GET `path`. With `coalesce` on, concurrent GETs with the same path,
+        token, params and body are collapsed into one request and all callers
+        receive the same response object.
+        """
+        if not coalesce:
+            return self.request("GET", path, **kwargs)
+        return self.inflight.do(request_key("GET", path, kwargs), self.request, "GET", path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request("POST", path, **kwargs)
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+
+
+class AsyncApiClient:
+    """
+    asyncio counterpart of ApiClient (httpx), used by the ASGI app.
+    Same base URL, pool bounds, timeouts, GET coalescing and 401 retry.
+    The httpx client is created on first use, inside the server's event loop.
+    """
+
+    def __init__(self, base_url=API_BASE_URL, pool_size=API_POOL_SIZE,
+                 timeout=(API_CONNECT_TIMEOUT, API_READ_TIMEOUT), verify=API_VERIFY_SSL):
+        self.base_url = base_url.rstrip("/")
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.verify = verify
+        self._client = None
+        self.inflight = AsyncSingleFlight()
+        self.token_manager = None
+        self.breaker = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            import httpx
+
+            self._client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size),
+                timeout=httpx_timeout(self.timeout),
+                verify=self.verify,
+                headers={"Accept": "application/json"},
+            )
+        return self._client
+
+    def url(self, path):
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    async def request(self, method, path, access_token=None, headers=None, timeout=None, **kwargs):
+        response = await self._send(method, path, access_token, headers, timeout, kwargs)
+
+        if response.status_code == 401 and access_token and self.token_manager is not None:
+            # Token renewal is blocking (and rare); keep it off the event loop
+            new_token = await asyncio.to_thread(self.token_manager.invalidate, access_token)
+            if new_token and new_token != access_token:
+                response = await self._send(method, path, new_token, headers, timeout, kwargs)
+
+        return response
+
+    async def _send(self, method, path, access_token, headers, timeout, kwargs):
+        request_headers = {}
+        if access_token:
+            request_headers["Authorization"] = f"Bearer {access_token}"
+        if headers:
+            request_headers.update(headers)
+        if timeout is not None:
+            kwargs = dict(kwargs, timeout=httpx_timeout(timeout))
+
+        if self.breaker is not None:
+            self.breaker.before_call()
+        try:
+            response = await self.client.request(method, self.url(path), headers=request_headers, **kwargs)
+        except Exception:
+            if self.breaker is not None:
+                self.breaker.record(False)
+            raise
+        if self.breaker is not None:
+            self.breaker.record(response.status_code < 500)
+        return response
+
+    async def get(self, path, coalesce=True, **kwargs):
+        if not coalesce:
+            return await self.request("GET", path, **kwargs)
+        return await self.inflight.do(request_key("GET", path, kwargs), self.request, "GET", path, **kwargs)
+
+    async def post(self, path, **kwargs):
+        return await self.request("POST", path, **kwargs)
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+
+
+def request_key(method, path, kwargs):
+    """Identity of a request for coalescing: path, token, params and body."""
+    return (
+        method,
+        path.lstrip("/"),
+        kwargs.get("access_token"),
+        json.dumps(kwargs.get("params"), sort_keys=True, default=str),
+        json.dumps(kwargs.get("json"), sort_keys=True, default=str),
+    )
+
+
+def httpx_timeout(timeout):
+    """Convert a requests-style timeout (seconds or (connect, read)) for httpx."""
+    import httpx
+
+    if isinstance(timeout, tuple):
+        connect, read = timeout
+        return httpx.Timeout(read, connect=connect)
+    return httpx.Timeout(timeout)
@@ -1,18 +1,40 @@
-from flask import Flask, request
-from twilio.rest import Client
-import google.generativeai as genai
-import requests
+# First, so the startup profile (STARTUP_PROFILE) can time every import
+import startup
+from flask import Flask, Response, request
 import urllib.parse
 import re
 from datetime import datetime
-import json
 import os
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-load_dotenv()
-
-import urllib3
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-
+with startup.step("load_dotenv"):
+    load_dotenv()
+
+from api_client import ApiClient
+from cache import TTLCache
+from token_manager import RedisTokenStore, TokenManager
+from message_queue import QueueFull, WorkerPool, create_queue_backend
+from prompt_builder import SECTION_ORDER, STATIC_SECTIONS, build_prompt, format_report
+from gemini_models import GeminiModelCache
+from intent_router import IntentRouter, parse_info_endpoints
+from session_store import create_session_store
+from messaging import ReplySender, split_message, twiml_reply
+from slot_index import SlotIndex, create_slot_locks
+from dedup import create_deduplicator
+from recorder import WebhookRecorder
+from sender_queue import create_sender_queue
+from admission import AdmissionController, Overloaded
+from circuit_breaker import CircuitBreaker, CircuitOpen
+import metrics
+from metrics import record_error, stage_timer, timed
+import log
+import logging
+
+# Structured logs, written by a background thread (see LOG_LEVEL / LOG_FORMAT)
+log.setup_logging()
+logger = logging.getLogger("app")
 
 
 app = Flask(__name__)
@@ -21,31 +43,278 @@ TWILIO_ACCOUNT_SID = os.getenv("TWILIO_ACCOUNT_SID")
 TWILIO_AUTH_TOKEN = os.getenv("TWILIO_AUTH_TOKEN")
 TWILIO_WHATSAPP_NUMBER = os.getenv("TWILIO_WHATSAPP_NUMBER")
 
-print("SID →", TWILIO_ACCOUNT_SID)
-print("TOKEN →", TWILIO_AUTH_TOKEN)
+log.register_secret(TWILIO_AUTH_TOKEN)
+logger.info("Twilio account configured", extra={
+    "account_sid": TWILIO_ACCOUNT_SID, "auth_token_set": bool(TWILIO_AUTH_TOKEN)
+})
 
 
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
-genai.configure(api_key=GOOGLE_API_KEY)
-
-model = genai.GenerativeModel("gemini-1.5-flash")
+log.register_secret(GOOGLE_API_KEY)
+
+# google.generativeai takes about a second to import, so it is imported and
+# configured on first use (or by warm_up) instead of before gunicorn serves.
+genai = None
+genai_lock = threading.Lock()
+
+def get_genai():
+    global genai
+    if genai is None:
+        with genai_lock:
+            if genai is None:
+                with startup.step("gemini"):
+                    import google.generativeai as module
+                    module.configure(api_key=GOOGLE_API_KEY)
+                genai = module
+    return genai
+
+GEMINI_MODEL_NAME = os.getenv("GEMINI_MODEL_NAME", "gemini-1.5-flash")
+# Send group info and professionals once per model as part of the system
+# instruction instead of in every prompt.
+GEMINI_STATIC_CONTEXT = os.getenv("GEMINI_STATIC_CONTEXT", "true").lower() in ("1", "true", "yes")
+
+# One model per distinct system instruction (default or per-sender override)
+gemini_models = GeminiModelCache(
+    lambda system_instruction: get_genai().GenerativeModel(GEMINI_MODEL_NAME, system_instruction=system_instruction)
+)
 
-# Twilio client
-twilio_client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
+# Admission control for Gemini calls: bounded concurrency and wait queue,
+# pause-and-retry on 429s, and a fast busy reply when the queue is full.
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "8"))
+GEMINI_MAX_QUEUE = int(os.getenv("GEMINI_MAX_QUEUE", "32"))
+GEMINI_MAX_WAIT = float(os.getenv("GEMINI_MAX_WAIT", "10"))
+GEMINI_RATE_LIMIT_RETRIES = int(os.getenv("GEMINI_RATE_LIMIT_RETRIES", "2"))
+GEMINI_BACKOFF = float(os.getenv("GEMINI_BACKOFF", "1"))
+GEMINI_MAX_BACKOFF = float(os.getenv("GEMINI_MAX_BACKOFF", "30"))
+GEMINI_ADMISSION = dict(
+    max_concurrency=GEMINI_MAX_CONCURRENCY, max_queue=GEMINI_MAX_QUEUE, max_wait=GEMINI_MAX_WAIT,
+    retries=GEMINI_RATE_LIMIT_RETRIES, backoff=GEMINI_BACKOFF, max_backoff=GEMINI_MAX_BACKOFF, name="gemini"
+)
+gemini_limiter = AdmissionController(**GEMINI_ADMISSION)
+GEMINI_TIMEOUT = float(os.getenv("GEMINI_TIMEOUT", "30"))
+
+# Circuit breakers: once a dependency fails too often, stop calling it for
+# BREAKER_RESET_TIMEOUT seconds (then probe) and fail fast or serve cached data.
+BREAKER_FAILURE_RATE = float(os.getenv("BREAKER_FAILURE_RATE", "0.5"))
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", "10"))
+BREAKER_WINDOW = int(os.getenv("BREAKER_WINDOW", "20"))
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", "30"))
+BREAKER_SETTINGS = dict(
+    failure_threshold=BREAKER_FAILURE_RATE, min_calls=BREAKER_MIN_CALLS,
+    window=BREAKER_WINDOW, reset_timeout=BREAKER_RESET_TIMEOUT
+)
+api_breaker = CircuitBreaker("backend_api", **BREAKER_SETTINGS)
+# Shed calls never reached Gemini, so they don't count against it
+gemini_breaker = CircuitBreaker("gemini", ignore=(Overloaded,), **BREAKER_SETTINGS)
+
+# Twilio client, created on first use (or by warm_up)
+twilio_client = None
+twilio_client_lock = threading.Lock()
+
+def get_twilio_client():
+    global twilio_client
+    if twilio_client is None:
+        with twilio_client_lock:
+            if twilio_client is None:
+                with startup.step("twilio"):
+                    from twilio.rest import Client
+                    twilio_client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
+    return twilio_client
+
+# Create the clients in a background thread at startup (see warm_up); when
+# off, each one is created by the first message that needs it.
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "true").lower() in ("1", "true", "yes")
+
+# How replies reach Twilio in sync mode: "rest" sends every chunk through the
+# Messages API, "twiml" returns the whole reply as TwiML from the webhook and
+# "twiml_first" returns the first chunk as TwiML and sends the rest via REST.
+REPLY_MODE = os.getenv("REPLY_MODE", "rest").lower()
+REPLY_SENDER_WORKERS = int(os.getenv("REPLY_SENDER_WORKERS", "8"))
+REPLY_SEND_ATTEMPTS = int(os.getenv("REPLY_SEND_ATTEMPTS", "3"))
+REPLY_RETRY_BACKOFF = float(os.getenv("REPLY_RETRY_BACKOFF", "0.5"))
+# Head start for the inline TwiML message before overflow chunks follow
+REPLY_OVERFLOW_DELAY = float(os.getenv("REPLY_OVERFLOW_DELAY", "1.0"))
+reply_sender = ReplySender(
+    lambda sender_number, body: send_whatsapp_message(sender_number, body),
+    max_workers=REPLY_SENDER_WORKERS, attempts=REPLY_SEND_ATTEMPTS, backoff=REPLY_RETRY_BACKOFF
+)
 
 # Config
 group_id = "3"
-AUTH_API_URL = "https://bi.siissoft.com/secureappointment/api/v1/auth/login"
-PROFESSIONALS_API_URL = "https://bi.siissoft.com/secureappointment/api/v1/professionals"
-USER_INFO_API_TEMPLATE = "https://bi.siissoft.com/secureappointment/api/v1/users/{}"
-GROUP_INFO_API_TEMPLATE = "https://bi.siissoft.com/secureappointment/api/v1/groups/{}"
-APPOINTMENTS_API_TEMPLATE = "https://bi.siissoft.com/secureappointment/api/v1/appointments/{}"
-USER_PERSONAL_APPOINTMENTS = "https://bi.siissoft.com/secureappointment/api/v1/appointments/{}"
+AUTH_API_PATH = "auth/login"
+BOT_API_USERNAME = os.getenv("BOT_API_USERNAME", "bot@siissoft.it")
+BOT_API_PASSWORD = os.getenv("BOT_API_PASSWORD", "Dana")
+log.register_secret(BOT_API_PASSWORD)
+PROFESSIONALS_API_PATH = "professionals"
+USERS_API_PATH = "users"
+USER_INFO_API_TEMPLATE = "users/{}"
+GROUP_INFO_API_TEMPLATE = "groups/{}"
+APPOINTMENTS_API_PATH = "appointments"
+APPOINTMENTS_API_TEMPLATE = "appointments/{}"
+INFO_API_TEMPLATE = "info/{}"
+SLOTS_API_TEMPLATE = "slots/{}"
+
+# Shared state backend for sessions and the service token: "memory" keeps
+# them per process, "redis" shares them across gunicorn workers/instances.
+STATE_BACKEND = os.getenv("STATE_BACKEND", "memory").lower()
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+if STATE_BACKEND == "redis":
+    import redis
+    redis_client = redis.Redis.from_url(REDIS_URL)
+else:
+    redis_client = None
+
+# Shared keep-alive client for every secureappointment API call
+api = ApiClient()
+api.breaker = api_breaker
+
+# One service token for the whole process (or all workers with Redis),
+# renewed ahead of expiry
+token_manager = TokenManager(
+    api, BOT_API_USERNAME, BOT_API_PASSWORD, login_path=AUTH_API_PATH,
+    store=RedisTokenStore(redis_client) if redis_client is not None else None
+)
+api.token_manager = token_manager
+
+# Bounded pool used to fetch the per-message context datasets in parallel
+CONTEXT_FETCH_WORKERS = int(os.getenv("CONTEXT_FETCH_WORKERS", "16"))
+context_executor = ThreadPoolExecutor(max_workers=CONTEXT_FETCH_WORKERS, thread_name_prefix="context-fetch")
+
+# Group info and the professionals list are the same for every user of the
+# group, so they are cached process-wide and refreshed in the background.
+GROUP_INFO_CACHE_TTL = float(os.getenv("GROUP_INFO_CACHE_TTL", "300"))
+PROFESSIONALS_CACHE_TTL = float(os.getenv("PROFESSIONALS_CACHE_TTL", "300"))
+CONTEXT_CACHE_STALE_TTL = float(os.getenv("CONTEXT_CACHE_STALE_TTL", "3600"))
+CONTEXT_CACHE_MAX_ENTRIES = int(os.getenv("CONTEXT_CACHE_MAX_ENTRIES", "64"))
+group_info_cache = TTLCache(
+    maxsize=CONTEXT_CACHE_MAX_ENTRIES, ttl=GROUP_INFO_CACHE_TTL,
+    stale_ttl=CONTEXT_CACHE_STALE_TTL, name="group_info"
+)
+professionals_cache = TTLCache(
+    maxsize=CONTEXT_CACHE_MAX_ENTRIES, ttl=PROFESSIONALS_CACHE_TTL,
+    stale_ttl=CONTEXT_CACHE_STALE_TTL, name="professionals"
+)
+
+# INFO endpoint texts are mostly static help content
+INFO_CACHE_TTL = float(os.getenv("INFO_CACHE_TTL", "3600"))
+INFO_CACHE_STALE_TTL = float(os.getenv("INFO_CACHE_STALE_TTL", "86400"))
+INFO_CACHE_MAX_ENTRIES = int(os.getenv("INFO_CACHE_MAX_ENTRIES", "128"))
+INFO_CACHE_PRELOAD = os.getenv("INFO_CACHE_PRELOAD", "false").lower() in ("1", "true", "yes")
+info_cache = TTLCache(
+    maxsize=INFO_CACHE_MAX_ENTRIES, ttl=INFO_CACHE_TTL,
+    stale_ttl=INFO_CACHE_STALE_TTL, name="info"
+)
+
+# Per-professional slot index. Availability changes as people book, so it
+# is only kept briefly (never served stale) and our own bookings update it.
+SLOTS_CACHE_TTL = float(os.getenv("SLOTS_CACHE_TTL", "60"))
+SLOTS_CACHE_MAX_ENTRIES = int(os.getenv("SLOTS_CACHE_MAX_ENTRIES", "256"))
+slots_cache = TTLCache(maxsize=SLOTS_CACHE_MAX_ENTRIES, ttl=SLOTS_CACHE_TTL, name="slots")
+
+# Bookings of the same slot are serialized; a second sender waits at most
+# BOOKING_LOCK_WAIT seconds and then sees the slot as taken.
+BOOKING_LOCK_WAIT = float(os.getenv("BOOKING_LOCK_WAIT", "5"))
+BOOKING_LOCK_TTL = int(os.getenv("BOOKING_LOCK_TTL", "30"))
+slot_locks = create_slot_locks(
+    STATE_BACKEND, wait=BOOKING_LOCK_WAIT, ttl=BOOKING_LOCK_TTL, client=redis_client
+)
 
 
-# In-memory session storage
-user_sessions = {}
-user_instructions = {}
+# Webhook mode: "sync" handles the message inside the request, "queue"
+# acknowledges Twilio immediately and processes it on a worker pool.
+WEBHOOK_MODE = os.getenv("WEBHOOK_MODE", "sync").lower()
+QUEUE_BACKEND = os.getenv("QUEUE_BACKEND", "memory").lower()
+QUEUE_WORKERS = int(os.getenv("QUEUE_WORKERS", "8"))
+QUEUE_MAXSIZE = int(os.getenv("QUEUE_MAXSIZE", "1000"))
+BUSY_REPLY_TEXT = "We're receiving a lot of messages right now. Please try again in a moment."
+worker_pool = None
+worker_pool_lock = threading.Lock()
+
+# Twilio retries slow webhooks with the same MessageSid; each one is handled
+# once and retries reuse (or wait for) that result.
+DEDUP_TTL = float(os.getenv("DEDUP_TTL", "600"))
+DEDUP_MAX_ENTRIES = int(os.getenv("DEDUP_MAX_ENTRIES", "10000"))
+DEDUP_WAIT = float(os.getenv("DEDUP_WAIT", "30"))
+message_dedup = create_deduplicator(
+    STATE_BACKEND, ttl=DEDUP_TTL, maxsize=DEDUP_MAX_ENTRIES, wait=DEDUP_WAIT, client=redis_client
+)
+
+# Opt-in traffic recording for load tests: anonymized webhook payloads are
+# appended to WEBHOOK_RECORD_PATH (replay them with bench/replay.py).
+WEBHOOK_RECORD_PATH = os.getenv("WEBHOOK_RECORD_PATH")
+WEBHOOK_RECORD_SALT = os.getenv("WEBHOOK_RECORD_SALT")
+log.register_secret(WEBHOOK_RECORD_SALT)
+webhook_recorder = WebhookRecorder(WEBHOOK_RECORD_PATH, salt=WEBHOOK_RECORD_SALT) if WEBHOOK_RECORD_PATH else None
+
+# Messages of one sender are handled in order, one batch at a time. Messages
+# that arrive while the previous batch runs (or within the debounce window)
+# are merged into a single turn. With Redis the lanes are shared by every
+# worker, so a sender's messages never run in parallel on two of them.
+SENDER_DEBOUNCE_WINDOW = float(os.getenv("SENDER_DEBOUNCE_WINDOW", "0"))
+SENDER_DEBOUNCE_MAX_WAIT = float(os.getenv("SENDER_DEBOUNCE_MAX_WAIT", "5"))
+SENDER_MAX_BATCH = int(os.getenv("SENDER_MAX_BATCH", "10"))
+sender_queue = create_sender_queue(
+    STATE_BACKEND, lambda sender_number, messages: handle_burst(sender_number, messages),
+    window=SENDER_DEBOUNCE_WINDOW, max_wait=SENDER_DEBOUNCE_MAX_WAIT, max_batch=SENDER_MAX_BATCH,
+    deliver=lambda sender_number, reply_text: deliver_reply(sender_number, reply_text), client=redis_client
+)
+
+# Metrics read from the components at scrape time
+metrics.register_caches(group_info_cache, professionals_cache, info_cache, slots_cache)
+metrics.register_admission(gemini_limiter)
+metrics.registry.gauge(
+    "twolio_circuit_open", "1 while a dependency's circuit is not closed.",
+    lambda: {(b.name,): int(b.state != "closed") for b in (api_breaker, gemini_breaker)}, ("dependency",)
+)
+metrics.registry.gauge(
+    "twolio_duplicate_messages_total", "Webhook deliveries answered from the dedup window.",
+    lambda: message_dedup.stats()["duplicates"], kind="counter"
+)
+metrics.registry.gauge(
+    "twolio_merged_messages_total", "Messages merged into a burst.",
+    lambda: sender_queue.stats()["merged"], kind="counter"
+)
+metrics.registry.gauge(
+    "twolio_reply_chunks_pending", "Reply chunks waiting to be sent.", lambda: reply_sender.pending()
+)
+metrics.registry.gauge(
+    "twolio_queue_depth", "Messages waiting in the webhook queue.",
+    lambda: worker_pool.depth() if worker_pool is not None else 0
+)
+metrics.registry.gauge(
+    "twolio_log_records_dropped_total", "Log records dropped because the log queue was full.",
+    lambda: log.queue_handler.dropped if log.queue_handler is not None else 0, kind="counter"
+)
+metrics.registry.gauge(
+    "twolio_intent_router_hits_total", "Messages answered by the local intent router, per intent.",
+    lambda: {(intent,): count for intent, count in intent_router.stats()["hits"].items()}, ("intent",),
+    kind="counter"
+)
+metrics.registry.gauge(
+    "twolio_intent_router_misses_total", "Messages the intent router passed on to Gemini.",
+    lambda: intent_router.stats()["misses"], kind="counter"
+)
+
+# One stats() call per scrape; the Redis store only reports what it can count cheaply
+metrics.registry.gauge_group(lambda: session_store.stats(), (
+    ("twolio_sessions", "Sender sessions stored.", "entries", "gauge"),
+    ("twolio_session_evictions_total", "Sessions evicted to stay under SESSION_MAX_ENTRIES.", "evictions", "counter"),
+    ("twolio_session_expirations_total", "Sessions removed after their TTL.", "expirations", "counter"),
+    ("twolio_session_bytes", "Approximate memory held by sessions.", "approx_bytes", "gauge"),
+))
+
+# Per-sender session storage (instruction overrides, registration progress)
+SESSION_TTL = float(os.getenv("SESSION_TTL", str(30 * 24 * 3600)))
+SESSION_MAX_ENTRIES = int(os.getenv("SESSION_MAX_ENTRIES", "10000"))
+# Abandoned registrations are forgotten after this long
+REGISTRATION_TTL = float(os.getenv("REGISTRATION_TTL", "3600"))
+session_store = create_session_store(
+    STATE_BACKEND, maxsize=SESSION_MAX_ENTRIES, ttl=SESSION_TTL, client=redis_client
+)
+
+def set_user_instruction(sender_number, instruction):
+    """Override the Gemini instruction for one sender (None restores the default)."""
+    session_store.update(sender_number, instruction=instruction)
 
 # Instruction for Gemini
 default_instruction = (
@@ -94,20 +363,24 @@ default_instruction = (
 )
 
 
+# Local router for messages that don't need Gemini
+INFO_ENDPOINTS = parse_info_endpoints(default_instruction)
+intent_router = IntentRouter(INFO_ENDPOINTS)
+
+
 # Helper Function to Format Slots Data for Twilio Message
-def format_slots(slots_data):
+def format_slots(slot_index):
     """
     Format the slot data to reduce the size and fit within the Twilio 1600 character limit.
     This function groups slots by hour and combines consecutive time slots.
+    Accepts a SlotIndex (already sorted) or the raw {date: [times]} JSON.
     """
+    if not isinstance(slot_index, SlotIndex):
+        slot_index = SlotIndex(slot_index)
+
     formatted_slots = []
-    
-    # Sort the slots by date
-    sorted_dates = sorted(slots_data.keys())
 
-    for date in sorted_dates:
-        times = sorted(slots_data[date])  # Sort the times for the current date
-        
+    for date, times in slot_index.items():
         # Group times by hour (e.g., 10:00-10:50 -> "10:00 - 10:50 Available")
         hour_groups = {}
         for time in times:
@@ -129,45 +402,17 @@ def format_slots(slots_data):
     formatted_slots_text = "\n".join(formatted_slots)
     return formatted_slots_text[:1500]  # Trim to 1500 characters to stay within Twilio limit
 
+@timed("auth")
 def authenticate_user(sender_number):
-    if sender_number in user_sessions:
-        access_token = user_sessions[sender_number]["access_token"]
-        print(f"🔐 [CACHE] Access token for {sender_number}: {access_token}")
-        return access_token
-
-    auth_payload = {"username": "bot@siissoft.it", "password": "Dana"}
-    headers = {"Content-Type": "application/json"}
-
-    try:
-        auth_response = requests.post(AUTH_API_URL, json=auth_payload, headers=headers, verify=False )
-        auth_response.raise_for_status()
-        auth_data = auth_response.json()
-        auth_info = auth_data.get("auth", {})
-
-        access_token = auth_info.get("access_token")
-        refresh_token = auth_info.get("refreshToken")
-
-        if not access_token or not refresh_token:
-            return None
-
-
-
-        print(f"🔐 [NEW] Access token for {sender_number}: {access_token}")
-
-        user_sessions[sender_number] = {
-            "access_token": access_token,
-            "refresh_token": refresh_token
-        }
-
-        return access_token
-    except Exception as e:
-        print(f"❌ Failed to authenticate: {e}")
-        return None
-# In-memory state for registration
-registration_state = {}
-registration_data = {}
+    """
+    Return the bot's service access token.
+    Every sender shares the same service credentials, so the token comes from
+    the process-wide token manager rather than a per-sender login.
+    """
+    return token_manager.get_token()
 
 # Helper: fetch user info with "USER NOT FOUND" handling
+@timed("user_info")
 def fetch_user_info(user_number, access_token):
     """
     Fetch user info from the API.  
@@ -175,106 +420,155 @@ def fetch_user_info(user_number, access_token):
     Otherwise return the JSON or None on other failures.
     """
     encoded_number = urllib.parse.quote(user_number)
-    url = USER_INFO_API_TEMPLATE.format(encoded_number)
-    headers = {"Authorization": f"Bearer {access_token}"}
+    path = USER_INFO_API_TEMPLATE.format(encoded_number)
 
     try:
-        response = requests.get(url, headers=headers, verify=False )
+        response = api.get(path, access_token=access_token)
         # Handle explicit "USER NOT FOUND." message
         if response.status_code == 404:
             data = response.json()
             if data.get("message") == "USER NOT FOUND.":
-                print(f"⚠️ User {user_number} not found.")
+                logger.info("User not found", extra={"user": user_number})
                 return {"error": "USER_NOT_FOUND"}
 
         response.raise_for_status()
-        print(f"✅ User info fetched for {user_number}")
+        logger.debug("User info fetched", extra={"user": user_number})
         return response.json()
 
     except Exception as e:
-        print(f"❌ Failed to fetch user info for {user_number}: {e}")
+        logger.error("Failed to fetch user info: %s", e, extra={"user": user_number})
+        record_error("user_info")
         return None
 
 # Helper: register a new user via API endpoint
+@timed("register")
 def register_user(user_data, access_token):
-    url = "https://bi.siissoft.com/secureappointment/api/v1/users"
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json"
-    }
     try:
-        resp = requests.post(url, headers=headers, json=user_data)
+        resp = api.post(USERS_API_PATH, access_token=access_token, json=user_data)
         resp.raise_for_status()
-        print("✅ User registered successfully.")
+        logger.info("User registered")
         return resp.json()
     except Exception as e:
-        print(f"❌ Registration failed: {e}")
+        logger.error("Registration failed: %s", e)
+        record_error("register")
         return None
+class InfoUnavailable(Exception):
+    """The info API answered, but without a usable message."""
+
+def load_info(endpoint, access_token):
+    """Fetch the message of an info endpoint from the API, raising on failure."""
+    response = api.get(INFO_API_TEMPLATE.format(endpoint), access_token=access_token)
+    response.raise_for_status()
+    data = response.json()
+
+    if data["status"] != 200:
+        raise InfoUnavailable(f"status {data['status']}")
+    # Extract the 'message' from the response and return it
+    return data.get("message", "No message available.")
+
+@timed("info")
 def fetch_info(endpoint, access_token):
     """
     Given an endpoint (e.g., payments/security), fetch the corresponding info from the API.
+    Results are cached per endpoint (see INFO_CACHE_TTL).
     """
-    info_url = f"https://bi.siissoft.com/secureappointment/api/v1/info/{endpoint}"
-    headers = {
-        "Authorization": f"Bearer {access_token}"
-    }
-
     try:
-        response = requests.get(info_url, headers=headers, verify=False )
-        response.raise_for_status()
-        data = response.json()
-
-        if data["status"] == 200:
-            # Extract the 'message' from the response and return it
-            return data.get("message", "No message available.")
-        else:
-            return "Sorry, I couldn't retrieve the information. Please try again later."
+        return info_cache.get_or_load(endpoint, lambda: load_info(endpoint, access_token))
+    except InfoUnavailable:
+        return "Sorry, I couldn't retrieve the information. Please try again later."
     except Exception as e:
-        print(f"❌ Error fetching info from endpoint {endpoint}: {e}")
-        return "There was an issue fetching the information. Please try again later."
+        logger.error("Failed to fetch info: %s", e, extra={"endpoint": endpoint})
+        record_error("info")
+        # Backend down or circuit open: the last text we had is still good
+        return info_cache.last_good(
+            endpoint, "There was an issue fetching the information. Please try again later."
+        )
 
+def preload_info_cache(access_token=None, endpoints=None):
+    """
+    Load every known INFO endpoint into the cache in parallel.
+    Returns the number of endpoints loaded.
+    """
+    access_token = access_token or token_manager.get_token()
+    if not access_token:
+        logger.error("Info cache preload skipped: authentication failed")
+        return 0
+
+    def load(endpoint):
+        info_cache.set(endpoint, load_info(endpoint, access_token))
+
+    futures = {context_executor.submit(load, ep): ep for ep in (endpoints or INFO_ENDPOINTS)}
+    loaded = 0
+    for future, endpoint in futures.items():
+        try:
+            future.result()
+            loaded += 1
+        except Exception as e:
+            logger.warning("Info cache preload failed: %s", e, extra={"endpoint": endpoint})
+    logger.info("Info cache preloaded", extra={"loaded": loaded, "endpoints": len(futures)})
+    return loaded
+
+def invalidate_info_cache(endpoint=None):
+    """Drop one cached INFO endpoint, or all of them."""
+    if endpoint is None:
+        info_cache.invalidate()
+    else:
+        info_cache.invalidate(endpoint)
+
+def load_group_info(group_id, access_token):
+    """Fetch group info from the API, raising on failure."""
+    response = api.get(GROUP_INFO_API_TEMPLATE.format(group_id), access_token=access_token)
+    response.raise_for_status()
+    return response.json()
+
+@timed("group_info")
 def fetch_group_info(group_id, access_token):
-    url = GROUP_INFO_API_TEMPLATE.format(group_id)
-    headers = {"Authorization": f"Bearer {access_token}"}
     try:
-        response = requests.get(url, headers=headers, verify=False )
-        response.raise_for_status()
-        return response.json()
+        return group_info_cache.get_or_load(
+            str(group_id), lambda: load_group_info(group_id, access_token)
+        )
     except Exception as e:
-        print(f"❌ Failed to fetch group info: {e}")
-        return None
+        logger.error("Failed to fetch group info: %s", e)
+        record_error("group_info")
+        return group_info_cache.last_good(str(group_id))
 
-def fetch_professionals(access_token):
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json"
-    } 
+def load_professionals(access_token):
+    """Fetch the professionals of the group from the API, raising on failure."""
     payload = {
         "groupId": int(group_id),
         "format":"whatsapp"
     }
-
+    # GET with a JSON body
+    response = api.get(PROFESSIONALS_API_PATH, access_token=access_token, json=payload)
+    response.raise_for_status()
+    professionals = response.json().get("professionals", [])
+    logger.info("Professionals fetched", extra={"count": len(professionals)})
+    return professionals
+
+@timed("professionals")
+def fetch_professionals(access_token):
     try:
-        # Use requests.request() to allow GET with body
-        response = requests.request(
-            "GET",
-            PROFESSIONALS_API_URL,
-            headers=headers,
-            json=payload
-        )
-        response.raise_for_status()
-        professionals = response.json().get("professionals", [])
-        print(f"✅ Professionals fetched: {len(professionals)}")
-        return professionals
+        return professionals_cache.get_or_load(str(group_id), lambda: load_professionals(access_token))
     except Exception as e:
-        print(f"❌ Failed to fetch professionals: {e}")
-        return []
+        logger.error("Failed to fetch professionals: %s", e)
+        record_error("professionals")
+        return professionals_cache.last_good(str(group_id), [])
 
+def invalidate_context_cache(group=None):
+    """
+    Drop cached group info and professionals for one group (or all groups),
+    e.g. after they were changed in the backoffice.
+    """
+    if group is None:
+        group_info_cache.invalidate()
+        professionals_cache.invalidate()
+    else:
+        group_info_cache.invalidate(str(group))
+        professionals_cache.invalidate(str(group))
+
+@timed("appointments")
 def fetch_appointments(user_id, access_token):
-    url = APPOINTMENTS_API_TEMPLATE.format(user_id)  # The URL now contains user_id as part of the path.
-    headers = {
-        "Authorization": f"Bearer {access_token}"
-    }
+    path = APPOINTMENTS_API_TEMPLATE.format(user_id)  # The path contains user_id.
     
     # Prepare the request body to include groupId
     data = {
@@ -282,15 +576,16 @@ def fetch_appointments(user_id, access_token):
     }
 
     try:
-        # Send GET request with body (for this specific API, using requests.request() allows a GET with a body)
-        response = requests.get(url, headers=headers, json=data, verify=False )  # JSON body with groupId
+        # Send GET request with a JSON body (groupId)
+        response = api.get(path, access_token=access_token, json=data)
         response.raise_for_status()
         
         appointments = response.json().get("appointments", [])
-        print(f"📅 Appointments fetched: {len(appointments)}")
+        logger.debug("Appointments fetched", extra={"count": len(appointments)})
         return appointments
     except Exception as e:
-        print(f"❌ Failed to fetch appointments: {e}")
+        logger.error("Failed to fetch appointments: %s", e)
+        record_error("appointments")
         return []
 
 # Helper function to handle appointment booking
@@ -316,62 +611,340 @@ def format_date_time(date_str, time_str):
     return formatted_date, formatted_time
 
 # Helper function to handle appointment booking
+@timed("booking")
 def book_appointment(appointment_details, access_token):
     """Make a POST request to book the appointment with proper authorization."""
-    appointment_url = "https://bi.siissoft.com/secureappointment/api/v1/appointments"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {access_token}"  # Include the access token in the Authorization header
-    }
-
     try:
-        response = requests.post(appointment_url, data=json.dumps(appointment_details), headers=headers)
-        response.raise_for_status()
-        print(f"✅ Appointment booked successfully: {response.text}")
-        return True
-    except requests.exceptions.HTTPError as http_err:
+        response = api.post(APPOINTMENTS_API_PATH, access_token=access_token, json=appointment_details)
         # Catching 404 error specifically and responding accordingly
         if response.status_code == 404:
-            print(f"❌ Failed to book appointment: 404 Not Found")
-            return False
-        else:
-            print(f"❌ Failed to book appointment: {http_err}")
+            logger.error("Failed to book appointment: 404 Not Found")
+            record_error("booking")
             return False
+        response.raise_for_status()
+        logger.info("Appointment booked: %s", response.text)
+        return True
+    except CircuitOpen:
+        raise
     except Exception as e:
-        print(f"❌ Failed to book appointment: {e}")
+        logger.error("Failed to book appointment: %s", e)
+        record_error("booking")
         return False
-def fetch_user_personal_appointments(user_id, access_token):
+def fetch_context(user_id, access_token):
     """
-    Fetch the personal appointments of a user using their user_id and access_token.
+    Fetch group info, professionals and both appointment lists concurrently.
+    Returns (group_info, professionals_list, appointments, personal_appointments)
+    with the same None / [] fallbacks the individual helpers use.
+
+    The appointments and personal appointments endpoints are the same URL,
+    so it is requested once and the result is used for both lists.
     """
-    url = USER_PERSONAL_APPOINTMENTS.format(user_id)  # The URL now contains user_id as part of the path.
-    headers = {
-        "Authorization": f"Bearer {access_token}"
+    jobs = {
+        "group_info": (fetch_group_info, (group_id, access_token), None),
+        "professionals_list": (fetch_professionals, (access_token,), []),
     }
-    data = {
-        "groupId": 3  # Static groupId as per the current requirements
+    if user_id:
+        jobs["appointments"] = (fetch_appointments, (user_id, access_token), [])
+
+    # copy_context: keep the request's trace ID in the pool threads
+    futures = {
+        name: context_executor.submit(contextvars.copy_context().run, fn, *args)
+        for name, (fn, args, _) in jobs.items()
     }
 
+    results = {"group_info": None, "professionals_list": [], "appointments": [], "personal_appointments": []}
+    for name, future in futures.items():
+        try:
+            results[name] = future.result()
+        except Exception as e:
+            logger.error("Failed to fetch %s: %s", name, e)
+            results[name] = jobs[name][2]
+    results["personal_appointments"] = results["appointments"]
+
+    return (
+        results["group_info"],
+        results["professionals_list"],
+        results["appointments"],
+        results["personal_appointments"],
+    )
+
+BOOKING_COMMAND_PATTERN = r"APPOINTMENT BOOK PROFESSIONAL ID (\d+) DATESTART (\d{4}-\d{2}-\d{2}) TIMESTART (\d{2}:\d{2}) USERID (\d+)"
+SLOTS_COMMAND_PATTERN = r"PROFESSIONAL SLOT NEEDED (\d+)"
+
+def parse_bot_command(reply_text):
+    """
+    Recognise a bot command in a Gemini / intent-router reply.
+    Returns ("info", endpoint), ("book", pid, details), ("slots", pid) or None.
+    Raises ValueError for a booking command with an invalid date or time.
+    """
+    if reply_text.startswith("INFO:"):
+        return ("info", reply_text.split("INFO: ", 1)[1].strip())
+
+    appointment_match = re.match(BOOKING_COMMAND_PATTERN, reply_text)
+    if appointment_match:
+        pid, ds, ts, uid = appointment_match.groups()
+        formatted_date, formatted_time = format_date_time(ds, ts)
+        details = {
+            "groupId": group_id,
+            "professionalId": int(pid),
+            "userId": int(uid),
+            "dateStart": formatted_date,
+            "timeStart": formatted_time
+        }
+        return ("book", pid, details)
+
+    slot_match = re.match(SLOTS_COMMAND_PATTERN, reply_text)
+    if slot_match:
+        return ("slots", slot_match.group(1))
+
+    return None
+
+def booking_reply(pid, details, success):
+    if success:
+        return f"Your appointment has been successfully booked with Professional ID {pid} for {details['dateStart']} at {details['timeStart']}."
+    return BOOKING_OCCUPIED_REPLY
+
+BOOKING_OCCUPIED_REPLY = "The requested time slot is already occupied. Please choose another time."
+BOOKING_PAST_REPLY = "That date is in the past. Please choose a future date."
+BOOKING_BUSY_REPLY = "Someone else is booking that time slot right now. Please try again in a moment."
+BOOKING_UNAVAILABLE_REPLY = "Booking is temporarily unavailable. Please try again in a few minutes."
+
+def occupied_reply(pid, date):
+    slot_index = slots_cache.get(str(pid))
+    times = slot_index.times(date) if slot_index is not None else []
+    if not times:
+        return BOOKING_OCCUPIED_REPLY
+    return (
+        f"The requested time slot is already occupied. "
+        f"Free times with Professional ID {pid} on {date}: {', '.join(times)}."
+    )
+
+def check_booking(pid, details):
+    """
+    Validate a booking against cached data before any POST.
+    Returns an error reply when it can be rejected locally, otherwise None
+    (including when nothing is cached to check against).
+    """
+    date_start = details["dateStart"]
+    if datetime.strptime(date_start, "%Y-%m-%d").date() < datetime.now().date():
+        return BOOKING_PAST_REPLY
+
+    # Only a fresh list where every entry has an id can rule a professional out
+    professionals = professionals_cache.get(str(group_id), fresh=True)
+    ids = {str(p.get("id")) for p in professionals or [] if isinstance(p, dict) and p.get("id") is not None}
+    if ids and len(ids) == len(professionals) and str(pid) not in ids:
+        return f"Professional ID {pid} was not found. Please choose one of the listed professionals."
+
+    if slot_is_free(pid, date_start, details["timeStart"]) is False:
+        return occupied_reply(pid, date_start)
+
+    return None
+
+def booking_lock_key(pid, details):
+    return f"{group_id}:{pid}:{details['dateStart']}:{details['timeStart']}"
+
+def book_slot(pid, details, access_token):
+    """Pre-validate, lock the slot and book it. Returns the reply text."""
+    error = check_booking(pid, details)
+    if error:
+        logger.info("Booking rejected locally: %s", error)
+        return error
+
+    key = booking_lock_key(pid, details)
+    if not slot_locks.acquire(key):
+        return BOOKING_BUSY_REPLY
+    try:
+        # Another sender may have taken the slot while we waited for the lock
+        error = check_booking(pid, details)
+        if error:
+            logger.info("Booking rejected locally: %s", error)
+            return error
+        try:
+            success = book_appointment(details, access_token)
+        except CircuitOpen:
+            return BOOKING_UNAVAILABLE_REPLY
+        record_booking(pid, details, success)
+        return booking_reply(pid, details, success)
+    finally:
+        slot_locks.release(key)
+
+def slots_reply(pid, slots_data):
+    formatted = format_slots(slots_data)
+    return (
+        f"Here are the available slots for Professional ID {pid}:\n{formatted}"
+        if formatted else
+        "No available slots found for the selected professional."
+    )
+
+SLOTS_ERROR_REPLY = "Sorry, there was an error fetching available slots. Please try again later."
+
+def load_slots(pid, access_token):
+    resp = api.get(
+        SLOTS_API_TEMPLATE.format(group_id),
+        access_token=access_token,
+        params={"professionalId": pid}
+    )
+    resp.raise_for_status()
+    return SlotIndex(resp.json().get("slots", {}))
+
+@timed("slots")
+def fetch_slots(pid, access_token):
+    """Return the SlotIndex of a professional (cached), raising on failure."""
+    return slots_cache.get_or_load(str(pid), lambda: load_slots(pid, access_token))
+
+def slot_is_free(pid, date, time_str):
+    """
+    Check a slot against the cached availability without any network call.
+    Returns True/False, or None when the professional's slots aren't cached.
+    """
+    slot_index = slots_cache.get(str(pid))
+    if slot_index is None:
+        return None
+    return slot_index.is_free(date, time_str)
+
+def record_booking(pid, details, success):
+    """Keep the slot index in line with a booking attempt."""
+    if success:
+        slot_index = slots_cache.get(str(pid))
+        if slot_index is not None:
+            slot_index.remove(details["dateStart"], details["timeStart"])
+    else:
+        # The backend disagreed with what we have; refetch next time
+        slots_cache.invalidate(str(pid))
+
+def run_bot_command(reply_text, access_token):
+    """
+    Execute a bot command (INFO: <endpoint>, APPOINTMENT BOOK ..., PROFESSIONAL
+    SLOT NEEDED <id>) coming from Gemini or the local intent router and
+    return the text to send. Any other text is returned unchanged.
+    """
+    command = parse_bot_command(reply_text)
+    if command is None:
+        return reply_text
+
+    if command[0] == "info":
+        # INFO text is returned as-is, even if it happens to look like a command
+        return fetch_info(command[1], access_token)
+
+    if command[0] == "book":
+        _, pid, details = command
+        return book_slot(pid, details, access_token)
+
+    pid = command[1]
     try:
-        # Send GET request with body (for this specific API, using requests.request() allows a GET with a body)
-        response = requests.get(url, headers=headers, json=data, verify=False )  # JSON body with groupId
-        response.raise_for_status()
-        
-        appointments = response.json().get("appointments", [])
-        print(f"📅 User's personal appointments fetched: {len(appointments)}")
-        return appointments
+        return slots_reply(pid, fetch_slots(pid, access_token))
     except Exception as e:
-        print(f"❌ Failed to fetch personal appointments: {e}")
-        return []
-@app.route("/whatsapp", methods=["POST"])
-def whatsapp():
-    incoming_msg = request.values.get("Body", "").strip()
-    sender_number = request.values.get("From", "").replace("whatsapp:", "")
-    print(f"📲 Message received from: {sender_number}")
+        logger.error("Failed to fetch slots: %s", e)
+        return SLOTS_ERROR_REPLY
 
-    if not incoming_msg:
-        return "No message received", 400
+REGISTRATION_FIELDS_REPLY = "Please provide all fields: Name, Surname, Email."
+
+def registration_step(sender_number, incoming_msg, session):
+    """
+    Advance the registration conversation of an unregistered sender.
+    Returns (reply_text, payload). When payload is not None the details are
+    complete: register it and pass the result to finish_registration().
+    Returns (None, None) if the sender is in no known registration state.
+    """
+    state = session.registration_state if session else None
+
+    # First unregistered interaction: start registration
+    if state is None:
+        session_store.update(
+            sender_number, ttl=REGISTRATION_TTL, registration_state='ask_name', registration_data=None
+        )
+        return "You are not registered. What is your name?", None
+
+    # Asking for name
+    elif state == 'ask_name':
+        session_store.merge_registration_data(
+            sender_number, {"name": incoming_msg}, ttl=REGISTRATION_TTL, registration_state='ask_surname'
+        )
+        return "Thanks! Now, what is your surname?", None
+
+    # Asking for surname
+    elif state == 'ask_surname':
+        session_store.merge_registration_data(
+            sender_number, {"surname": incoming_msg}, ttl=REGISTRATION_TTL, registration_state='ask_email'
+        )
+        return "Great! Now, what is your email?", None
 
+    # Asking for email: registration details are complete
+    elif state == 'ask_email':
+        # Read the details back from the store: it has every step's answer
+        session = session_store.merge_registration_data(
+            sender_number, {"email": incoming_msg}, ttl=REGISTRATION_TTL
+        )
+        registration_data = (session.registration_data if session else None) or {}
+        name = registration_data.get('name')
+        surname = registration_data.get('surname')
+        email = registration_data.get('email')
+        phone_number = sender_number
+
+        if not all([name, surname, email, phone_number]):
+            return REGISTRATION_FIELDS_REPLY, None
+
+        payload = {
+            "groupId": 3,
+            "name": name,
+            "surname": surname,
+            "phone_number": phone_number,
+            "email": email
+        }
+        return None, payload
+
+    return None, None
+
+def finish_registration(sender_number, payload, result):
+    session_store.update(sender_number, registration_state=None, registration_data=None)
+    if result:
+        return f"Registration successful! Welcome, {payload['name']}."
+    return "Registration failed. Please try again later."
+
+def build_gemini_request(session, incoming_msg, user_info, group_info, professionals_list,
+                         appointments, personal_appointments):
+    """Pick the model for the sender's instruction and build the per-user prompt."""
+    instruction = (session.instruction if session else None) or default_instruction
+    # The instruction (and static group data) is the model's system
+    # instruction; only the per-user part goes in the prompt.
+    if GEMINI_STATIC_CONTEXT:
+        chat_model = gemini_models.get(instruction, group_info, professionals_list)
+        prompt_sections = tuple(s for s in SECTION_ORDER if s not in STATIC_SECTIONS)
+    else:
+        chat_model = gemini_models.get(instruction, include=())
+        prompt_sections = SECTION_ORDER
+    full_prompt, prompt_report = build_prompt(
+        "",
+        incoming_msg,
+        user_info=user_info,
+        group_info=group_info,
+        professionals=professionals_list,
+        appointments=appointments,
+        personal_appointments=personal_appointments,
+        include=prompt_sections,
+    )
+    logger.info("Prompt size: %s", format_report(prompt_report))
+    metrics.prompt_tokens.observe(prompt_report["total"]["tokens"])
+    return chat_model, full_prompt
+
+# While Gemini is unavailable, the structured requests the intent router
+# understands still work
+GEMINI_UNAVAILABLE_REPLY = (
+    "Our assistant is temporarily unavailable. You can still ask for available times "
+    "(e.g. \"slots for professional 13\") or book directly "
+    "(e.g. \"Professional ID: 13, Date start: 2030-01-05, Time start: 10:00\")."
+)
+
+ERROR_REPLY_TEXT = (
+    "Oops! Something went wrong. Try again in a moment. "
+    "Sorry, our system is facing trouble, but I'm here to help!"
+)
+
+def handle_message(sender_number, incoming_msg):
+    """
+    Run the full bot flow for one inbound message and return the reply text.
+    Sending the reply is left to the caller (webhook or queue worker).
+    """
     reply_text = "Sorry, I couldn't understand your request."
 
     try:
@@ -382,164 +955,251 @@ def whatsapp():
         else:
             # Fetch user info
             user_info = fetch_user_info(sender_number, access_token)
+            session = session_store.get(sender_number)
 
             # Registration flow for unregistered users
             if isinstance(user_info, dict) and user_info.get("error") == "USER_NOT_FOUND":
-                state = registration_state.get(sender_number)
-
-                # First unregistered interaction: forward to Gemini
-                if state is None:
-                    registration_state[sender_number] = 'ask_name'
-                    reply_text = "You are not registered. What is your name?"
-                    send_reply(sender_number, reply_text)
-                    return "Message sent", 200
-
-                # Asking for name
-                elif state == 'ask_name':
-                    registration_data[sender_number] = {"name": incoming_msg}
-                    registration_state[sender_number] = 'ask_surname'
-                    reply_text = "Thanks! Now, what is your surname?"
-                    send_reply(sender_number, reply_text)
-                    return "Message sent", 200
-
-                # Asking for surname
-                elif state == 'ask_surname':
-                    registration_data[sender_number]["surname"] = incoming_msg
-                    registration_state[sender_number] = 'ask_email'
-                    reply_text = "Great! Now, what is your email?"
-                    send_reply(sender_number, reply_text)
-                    return "Message sent", 200
-
-                # Asking for email and completing registration
-                elif state == 'ask_email':
-                    registration_data[sender_number]["email"] = incoming_msg
-                    name = registration_data[sender_number].get('name')
-                    surname = registration_data[sender_number].get('surname')
-                    email = registration_data[sender_number].get('email')
-                    phone_number = sender_number
-
-                    if not all([name, surname, email, phone_number]):
-                        send_reply(sender_number, "Please provide all fields: Name, Surname, Email.")
-                        return "Message sent", 200
-
-                    payload = {
-                        "groupId": 3,
-                        "name": name,
-                        "surname": surname,
-                        "phone_number": phone_number,
-                        "email": email
-                    }
-                    result = register_user(payload, access_token)
-                    if result:
-                        send_reply(sender_number, f"Registration successful! Welcome, {name}.")
-                    else:
-                        send_reply(sender_number, "Registration failed. Please try again later.")
-                    registration_state.pop(sender_number, None)
-                    registration_data.pop(sender_number, None)
-                    return "Message sent", 200
-
-
-            # Registered-user flow (unchanged)
-            group_info = fetch_group_info(group_id, access_token)
-            professionals_list = fetch_professionals(access_token)
-
-            appointments = []
-            personal_appointments = []
-            user_id = user_info.get("user", {}).get("id") if user_info else None
+                reply, payload = registration_step(sender_number, incoming_msg, session)
+                if payload is not None:
+                    return finish_registration(sender_number, payload, register_user(payload, access_token))
+                if reply is not None:
+                    return reply
 
-            if user_id:
-                appointments = fetch_appointments(user_id, access_token)
-                personal_appointments = fetch_user_personal_appointments(user_id, access_token)
-
-            instruction = user_instructions.get(sender_number, default_instruction)
-            full_prompt = (
-                f"{instruction}\n\n"
-                f"User Info:\n{user_info}\n\n"
-                f"Group Info:\n{group_info}\n\n"
-                f"Professionals List:\n{professionals_list}\n\n"
-                f"Appointments:\n{appointments}\n\n"
-                f"Personal Appointments:\n{personal_appointments}\n\n"
-                f"User: {incoming_msg}"
-            )
-            gemini_response = model.generate_content(full_prompt)
-            reply_text = gemini_response.text.strip()
+            # Registered-user flow: context datasets are fetched in parallel
+            user_id = user_info.get("user", {}).get("id") if user_info else None
 
-            if reply_text.startswith("INFO:"):
-                endpoint = reply_text.split("INFO: ", 1)[1].strip()
-                reply_text = fetch_info(endpoint, access_token)
+            # Structured messages (bookings, slot requests, FAQ topics) skip Gemini
+            command = intent_router.route(incoming_msg, user_id=user_id)
+            if command:
+                logger.info("Fast path: %s", command)
+                return run_bot_command(command, access_token)
 
-         
+            group_info, professionals_list, appointments, personal_appointments = fetch_context(user_id, access_token)
 
-            appointment_match = re.match(
-                r"APPOINTMENT BOOK PROFESSIONAL ID (\d+) DATESTART (\d{4}-\d{2}-\d{2}) TIMESTART (\d{2}:\d{2}) USERID (\d+)",
-                reply_text
+            chat_model, full_prompt = build_gemini_request(
+                session, incoming_msg, user_info, group_info, professionals_list,
+                appointments, personal_appointments
             )
-            if appointment_match:
-                pid, ds, ts, uid = appointment_match.groups()
-                formatted_date, formatted_time = format_date_time(ds, ts)
-                details = {
-                    "groupId": group_id,
-                    "professionalId": 0,
-                    "userId": int(uid),
-                    "dateStart": formatted_date,
-                    "timeStart": formatted_time
-                }
-                success = book_appointment(details, access_token)
-                reply_text = (
-                    f"Your appointment has been successfully booked with Professional ID {pid} for {formatted_date} at {formatted_time}."
-                    if success else
-                    "The requested time slot is already occupied. Please choose another time."
+            with stage_timer("gemini"):
+                gemini_response = gemini_breaker.call(
+                    gemini_limiter.call, chat_model.generate_content, full_prompt,
+                    request_options={"timeout": GEMINI_TIMEOUT}
                 )
-            else:
-                slot_match = re.match(r"PROFESSIONAL SLOT NEEDED (\d+)", reply_text)
-                if slot_match:
-                    pid = slot_match.group(1)
-                    slots_url = f"https://bi.siissoft.com/secureappointment/api/v1/slots/{group_id}?professionalId={pid}"
-                    try:
-                        resp = requests.get(slots_url, headers={"Authorization": f"Bearer {access_token}"})
-                        resp.raise_for_status()
-                        slots_data = resp.json().get("slots", {})
-                        formatted = format_slots(slots_data)
-                        reply_text = (
-                            f"Here are the available slots for Professional ID {pid}:\n{formatted}"
-                            if formatted else
-                            "No available slots found for the selected professional."
-                        )
-                    except Exception as e:
-                        print(f"❌ Failed to fetch slots: {e}")
-                        reply_text = "Sorry, there was an error fetching available slots. Please try again later."
+            reply_text = run_bot_command(gemini_response.text.strip(), access_token)
+
+    except Overloaded:
+        reply_text = BUSY_REPLY_TEXT
+    except CircuitOpen:
+        reply_text = GEMINI_UNAVAILABLE_REPLY
+    except Exception:
+        logger.exception("Error handling message")
+        reply_text = ERROR_REPLY_TEXT
+
+    return reply_text
+
+def handle_burst(sender_number, messages):
+    """
+    Handle a batch of messages from one sender and return one reply.
+    Normally they are merged into a single turn. During registration every
+    message answers its own question, so they are handled one by one.
+    """
+    if len(messages) == 1:
+        return handle_message(sender_number, messages[0])
+
+    session = session_store.get(sender_number)
+    if session is not None and session.registration_state:
+        return "\n\n".join(handle_message(sender_number, msg) for msg in messages)
+
+    logger.info("Merged burst", extra={"messages": len(messages)})
+    return handle_message(sender_number, "\n".join(messages))
+
+def respond(sender_number, incoming_msg):
+    """
+    Handle a message in per-sender order. Returns the reply, or None when the
+    message was merged into a later one whose caller sends the reply.
+    """
+    reply_text, last = sender_queue.submit(sender_number, incoming_msg)
+    if not last:
+        return None
+    metrics.response_chars.observe(len(reply_text))
+    return reply_text
 
+def deliver_reply(sender_number, reply_text):
+    """Send the reply to a batch ending with a queued message (see process_queued_message)."""
+    metrics.response_chars.observe(len(reply_text))
+    try:
+        send_reply(sender_number, reply_text)
     except Exception as e:
-        print(f"⚠️ Error handling message: {e}")
-        reply_text = (
-            "Oops! Something went wrong. Try again in a moment. "
-            "Sorry, our system is facing trouble, but I'm here to help!"
-        )
+        logger.error("Failed to send WhatsApp message: %s", e)
+
+def process_queued_message(item, ack):
+    """
+    Queue worker entry point: hand one enqueued message to its sender's lane.
+    If the lane is busy the worker returns at once and the lane's drainer
+    handles the message; the batch reply goes out through deliver_reply.
+    The item is acked only once the lane is done with it.
+    """
+    sender_number = item["sender"]
+    metrics.trace_id.set(item.get("trace_id"))
+    log.set_context(sender=sender_number, message_sid=item.get("message_sid"), trace_id=item.get("trace_id"))
+    _, duplicate = message_dedup.run(
+        item.get("message_sid"), sender_queue.post, sender_number, item["body"], wait=0, done=ack
+    )
+    if duplicate:
+        # Already handled by the delivery that ran it
+        logger.info("Duplicate message skipped")
+        ack()
+
+def get_worker_pool():
+    """Start the queue backend and worker threads on first use (after gunicorn forks)."""
+    global worker_pool
+    if worker_pool is None:
+        with worker_pool_lock:
+            if worker_pool is None:
+                backend = create_queue_backend(QUEUE_BACKEND, maxsize=QUEUE_MAXSIZE, redis_url=REDIS_URL)
+                pool = WorkerPool(backend, process_queued_message, concurrency=QUEUE_WORKERS, manual_ack=True)
+                pool.start()
+                worker_pool = pool
+    return worker_pool
+
+def start_worker_pool():
+    """
+    Start the queue workers now instead of on the first webhook: a Redis queue
+    may still hold messages from before a restart (or from a crashed worker).
+    Called by the WSGI entry points (gunicorn.conf.py, __main__) only, not on
+    import, since asgi_app imports this module and runs its own workers.
+    """
+    if WEBHOOK_MODE == "queue" and QUEUE_BACKEND == "redis":
+        get_worker_pool()
+
+@app.route("/whatsapp", methods=["POST"])
+def whatsapp():
+    if webhook_recorder is not None:
+        webhook_recorder.record(request.values)
+    incoming_msg = request.values.get("Body", "").strip()
+    sender_number = request.values.get("From", "").replace("whatsapp:", "")
+    trace = metrics.new_trace_id()
+    log.set_context(sender=sender_number, message_sid=request.values.get("MessageSid"), trace_id=trace)
+    logger.info("Message received")
+
+    if not incoming_msg:
+        metrics.messages_total.inc(outcome="empty")
+        return "No message received", 400
+
+    # Queue mode: acknowledge Twilio right away and let a worker do the rest
+    if WEBHOOK_MODE == "queue":
+        item = {
+            "sender": sender_number,
+            "body": incoming_msg,
+            "message_sid": request.values.get("MessageSid"),
+            "trace_id": trace,
+        }
+        try:
+            get_worker_pool().submit(item)
+            metrics.messages_total.inc(outcome="queued")
+            return "Message queued", 200
+        except QueueFull:
+            logger.warning("Message queue full, rejecting message")
+            metrics.messages_total.inc(outcome="queue_full")
+            try:
+                send_reply(sender_number, BUSY_REPLY_TEXT)
+            except Exception as e:
+                logger.error("Failed to send WhatsApp message: %s", e)
+            return "Message queue full", 503
+
+    message_sid = request.values.get("MessageSid")
+    # Only a TwiML answer carries the reply, so only there does a retry wait for it
+    wait = None if REPLY_MODE in ("twiml", "twiml_first") else 0
+    reply_text, duplicate = message_dedup.run(message_sid, respond, sender_number, incoming_msg, wait=wait)
+    if duplicate:
+        logger.info("Duplicate webhook")
+
+    # Answer inline with TwiML instead of (or before) REST calls
+    if REPLY_MODE in ("twiml", "twiml_first"):
+        # A retry gets the stored reply again: Twilio never saw the first response
+        chunks = split_message(reply_text or "")
+        if REPLY_MODE == "twiml_first" and len(chunks) > 1:
+            if not duplicate:
+                reply_sender.send(sender_number, chunks[1:], delay=REPLY_OVERFLOW_DELAY)
+            chunks = chunks[:1]
+        metrics.messages_total.inc(outcome="duplicate" if duplicate else "twiml")
+        return Response(twiml_reply(chunks), mimetype="application/xml")
+
+    if duplicate:
+        # The first attempt sends the REST reply
+        metrics.messages_total.inc(outcome="duplicate")
+        return "Message already handled", 200
+    if reply_text is None:
+        metrics.messages_total.inc(outcome="merged")
+        return "Message merged", 200
 
     try:
         send_reply(sender_number, reply_text)
+        metrics.messages_total.inc(outcome="sent")
         return "Message sent", 200
     except Exception as e:
-        print(f"❌ Failed to send WhatsApp message: {e}")
+        logger.error("Failed to send WhatsApp message: %s", e)
+        metrics.messages_total.inc(outcome="send_failed")
         return "Failed to send message", 500
 
+@app.after_request
+def add_trace_header(response):
+    trace = metrics.trace_id.get()
+    if trace and request.endpoint == "whatsapp":
+        response.headers["X-Trace-Id"] = trace
+    return response
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    """Prometheus scrape endpoint (per process)."""
+    return Response(metrics.registry.render(), mimetype="text/plain; version=0.0.4")
+
+
+
+@timed("send_reply")
+def send_whatsapp_message(sender_number, body):
+    get_twilio_client().messages.create(
+        body=body,
+        from_=TWILIO_WHATSAPP_NUMBER,
+        to=f"whatsapp:{sender_number}"
+    )
 
 def send_reply(sender_number, reply_text):
     """
-    Send one or more WhatsApp messages, splitting reply_text into
-    1500-character chunks to avoid Twilio’s 1600-char limit.
-    """
-    max_len = 1599
-    # split into chunks of at most max_len characters
-    chunks = [reply_text[i : i + max_len] for i in range(0, len(reply_text), max_len)]
-    for chunk in chunks:
-        twilio_client.messages.create(
-            body=chunk,
-            from_=TWILIO_WHATSAPP_NUMBER,
-            to=f"whatsapp:{sender_number}"
-        )
+    Send one or more WhatsApp messages, splitting reply_text on line/word
+    boundaries to stay under Twilio’s 1600-char limit.
+    Chunks go out in order through the reply sender (with retries); this
+    waits for the first chunk and raises if it could not be sent.
+    """
+    futures = reply_sender.send(sender_number, split_message(reply_text))
+    if futures:
+        futures[0].result()
+
+def warm_up():
+    """Create the Gemini, Twilio and backend API clients ahead of the first message."""
+    try:
+        with startup.step("warm_up"):
+            get_genai()
+            get_twilio_client()
+            with startup.step("api client"):
+                api.session
+    except Exception as e:
+        logger.warning("Warm-up failed, clients will be created on first use: %s", e)
+
+if INFO_CACHE_PRELOAD:
+    threading.Thread(target=preload_info_cache, name="info-preload", daemon=True).start()
+
+# Clients are created in the background so the worker can serve right away;
+# a message arriving first simply waits for (or creates) the client it needs.
+if STARTUP_WARMUP:
+    threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+
+# asgi_app reports once it has finished importing
+if not startup.deferred:
+    startup.report()
 
 if __name__ == "__main__":
+    start_worker_pool()
     # Bind to 0.0.0.0 on the Railway-provided port (fallback to 5000 locally)
     app.run(
         host="0.0.0.0",
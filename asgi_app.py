@@ -0,0 +1,539 @@
+"""
+Async (ASGI) variant of the WhatsApp webhook.
+
+Serves the same /whatsapp endpoint as the Flask app in app.py, but the
+backend API, Gemini and Twilio calls are all awaited instead of blocking a
+worker, so one process can hold hundreds of conversations in flight.
+Config, caches, the session store, the token manager and the reply logic
+are shared with app.py; only the I/O differs.
+
+Run with:
+    uvicorn asgi_app:app --host 0.0.0.0 --port $PORT
+"""
+# First, so the startup profile (STARTUP_PROFILE) can time every import;
+# reported at the end of this module instead of at the end of app.py
+import startup
+startup.deferred = True
+import asyncio
+import logging
+import urllib.parse
+
+from starlette.applications import Starlette
+from starlette.background import BackgroundTask
+from starlette.responses import PlainTextResponse, Response
+from starlette.routing import Route
+
+import app as bot
+from admission import AsyncAdmissionController, Overloaded
+from api_client import AsyncApiClient
+from circuit_breaker import CircuitOpen
+import log
+import metrics
+from metrics import record_error, stage_timer, timed
+from messaging import is_transient, split_message, twiml_reply
+from sender_queue import create_async_sender_queue
+from slot_index import SlotIndex
+
+logger = logging.getLogger("asgi_app")
+
+# Shared async keep-alive client for the secureappointment API
+api = AsyncApiClient()
+api.token_manager = bot.token_manager
+api.breaker = bot.api_breaker
+
+# Gemini admission control (same limits as app.gemini_limiter, per event
+# loop). app.gemini_limiter stays the sync one; /metrics reports this one
+gemini_limiter = AsyncAdmissionController(**bot.GEMINI_ADMISSION)
+metrics.register_admission(gemini_limiter)
+
+# Queue mode runs on a bounded in-process queue drained by QUEUE_WORKERS
+# tasks (app.py's "memory" backend). A durable Redis queue needs the Flask
+# app's worker threads, so refuse it rather than silently dropping durability.
+if bot.WEBHOOK_MODE == "queue" and bot.QUEUE_BACKEND != "memory":
+    raise ValueError(f"QUEUE_BACKEND={bot.QUEUE_BACKEND} is not supported by the ASGI app; use memory")
+message_queue = None
+queue_workers = []
+
+# Twilio client on aiohttp, for messages.create_async. The aiohttp session
+# needs a running event loop, so it is created on first use (or at startup).
+twilio_client = None
+
+
+def get_twilio_client():
+    global twilio_client
+    if twilio_client is None:
+        with startup.step("twilio (async)"):
+            from twilio.http.async_http_client import AsyncTwilioHttpClient
+            from twilio.rest import Client
+
+            twilio_client = Client(
+                bot.TWILIO_ACCOUNT_SID, bot.TWILIO_AUTH_TOKEN, http_client=AsyncTwilioHttpClient()
+            )
+    return twilio_client
+
+
+async def authenticate_user(sender_number):
+    # The token is almost always cached; a renewal blocks, so run it in a thread
+    return await asyncio.to_thread(bot.authenticate_user, sender_number)
+
+@timed("user_info")
+async def fetch_user_info(user_number, access_token):
+    """Async fetch_user_info: same USER_NOT_FOUND handling as app.fetch_user_info."""
+    encoded_number = urllib.parse.quote(user_number)
+    path = bot.USER_INFO_API_TEMPLATE.format(encoded_number)
+
+    try:
+        response = await api.get(path, access_token=access_token)
+        # Handle explicit "USER NOT FOUND." message
+        if response.status_code == 404:
+            data = response.json()
+            if data.get("message") == "USER NOT FOUND.":
+                logger.info("User not found", extra={"user": user_number})
+                return {"error": "USER_NOT_FOUND"}
+
+        response.raise_for_status()
+        logger.debug("User info fetched", extra={"user": user_number})
+        return response.json()
+
+    except Exception as e:
+        logger.error("Failed to fetch user info: %s", e, extra={"user": user_number})
+        record_error("user_info")
+        return None
+
+@timed("register")
+async def register_user(user_data, access_token):
+    try:
+        resp = await api.post(bot.USERS_API_PATH, access_token=access_token, json=user_data)
+        resp.raise_for_status()
+        logger.info("User registered")
+        return resp.json()
+    except Exception as e:
+        logger.error("Registration failed: %s", e)
+        record_error("register")
+        return None
+
+async def load_info(endpoint, access_token):
+    response = await api.get(bot.INFO_API_TEMPLATE.format(endpoint), access_token=access_token)
+    response.raise_for_status()
+    data = response.json()
+
+    if data["status"] != 200:
+        raise bot.InfoUnavailable(f"status {data['status']}")
+    return data.get("message", "No message available.")
+
+@timed("info")
+async def fetch_info(endpoint, access_token):
+    try:
+        return await bot.info_cache.aget_or_load(endpoint, lambda: load_info(endpoint, access_token))
+    except bot.InfoUnavailable:
+        return "Sorry, I couldn't retrieve the information. Please try again later."
+    except Exception as e:
+        logger.error("Failed to fetch info: %s", e, extra={"endpoint": endpoint})
+        record_error("info")
+        return bot.info_cache.last_good(
+            endpoint, "There was an issue fetching the information. Please try again later."
+        )
+
+async def load_group_info(group_id, access_token):
+    response = await api.get(bot.GROUP_INFO_API_TEMPLATE.format(group_id), access_token=access_token)
+    response.raise_for_status()
+    return response.json()
+
+@timed("group_info")
+async def fetch_group_info(group_id, access_token):
+    try:
+        return await bot.group_info_cache.aget_or_load(
+            str(group_id), lambda: load_group_info(group_id, access_token)
+        )
+    except Exception as e:
+        logger.error("Failed to fetch group info: %s", e)
+        record_error("group_info")
+        return bot.group_info_cache.last_good(str(group_id))
+
+async def load_professionals(access_token):
+    payload = {
+        "groupId": int(bot.group_id),
+        "format": "whatsapp"
+    }
+    response = await api.get(bot.PROFESSIONALS_API_PATH, access_token=access_token, json=payload)
+    response.raise_for_status()
+    professionals = response.json().get("professionals", [])
+    logger.info("Professionals fetched", extra={"count": len(professionals)})
+    return professionals
+
+@timed("professionals")
+async def fetch_professionals(access_token):
+    try:
+        return await bot.professionals_cache.aget_or_load(
+            str(bot.group_id), lambda: load_professionals(access_token)
+        )
+    except Exception as e:
+        logger.error("Failed to fetch professionals: %s", e)
+        record_error("professionals")
+        return bot.professionals_cache.last_good(str(bot.group_id), [])
+
+@timed("appointments")
+async def fetch_appointments(user_id, access_token):
+    path = bot.APPOINTMENTS_API_TEMPLATE.format(user_id)
+    try:
+        response = await api.get(path, access_token=access_token, json={"groupId": bot.group_id})
+        response.raise_for_status()
+        appointments = response.json().get("appointments", [])
+        logger.debug("Appointments fetched", extra={"count": len(appointments)})
+        return appointments
+    except Exception as e:
+        logger.error("Failed to fetch appointments: %s", e)
+        record_error("appointments")
+        return []
+
+@timed("booking")
+async def book_appointment(appointment_details, access_token):
+    try:
+        response = await api.post(bot.APPOINTMENTS_API_PATH, access_token=access_token, json=appointment_details)
+        response.raise_for_status()
+        logger.info("Appointment booked: %s", response.text)
+        return True
+    except CircuitOpen:
+        raise
+    except Exception as e:
+        logger.error("Failed to book appointment: %s", e)
+        record_error("booking")
+        return False
+
+async def load_slots(pid, access_token):
+    resp = await api.get(
+        bot.SLOTS_API_TEMPLATE.format(bot.group_id),
+        access_token=access_token,
+        params={"professionalId": pid}
+    )
+    resp.raise_for_status()
+    return SlotIndex(resp.json().get("slots", {}))
+
+async def book_slot(pid, details, access_token):
+    """Async app.book_slot; the lock wait runs in a thread to keep the loop free."""
+    error = bot.check_booking(pid, details)
+    if error:
+        logger.info("Booking rejected locally: %s", error)
+        return error
+
+    key = bot.booking_lock_key(pid, details)
+    if not await asyncio.to_thread(bot.slot_locks.acquire, key):
+        return bot.BOOKING_BUSY_REPLY
+    try:
+        error = bot.check_booking(pid, details)
+        if error:
+            logger.info("Booking rejected locally: %s", error)
+            return error
+        try:
+            success = await book_appointment(details, access_token)
+        except CircuitOpen:
+            return bot.BOOKING_UNAVAILABLE_REPLY
+        bot.record_booking(pid, details, success)
+        return bot.booking_reply(pid, details, success)
+    finally:
+        await asyncio.to_thread(bot.slot_locks.release, key)
+
+@timed("slots")
+async def fetch_slots(pid, access_token):
+    return await bot.slots_cache.aget_or_load(str(pid), lambda: load_slots(pid, access_token))
+
+async def fetch_context(user_id, access_token):
+    """Async fetch_context: the datasets are gathered concurrently on the event loop."""
+    async def no_appointments():
+        return []
+
+    group_info, professionals_list, appointments = await asyncio.gather(
+        fetch_group_info(bot.group_id, access_token),
+        fetch_professionals(access_token),
+        fetch_appointments(user_id, access_token) if user_id else no_appointments(),
+    )
+    # Same endpoint for both appointment lists; requested once
+    return group_info, professionals_list, appointments, appointments
+
+async def run_bot_command(reply_text, access_token):
+    command = bot.parse_bot_command(reply_text)
+    if command is None:
+        return reply_text
+
+    if command[0] == "info":
+        return await fetch_info(command[1], access_token)
+
+    if command[0] == "book":
+        _, pid, details = command
+        return await book_slot(pid, details, access_token)
+
+    pid = command[1]
+    try:
+        return bot.slots_reply(pid, await fetch_slots(pid, access_token))
+    except Exception as e:
+        logger.error("Failed to fetch slots: %s", e)
+        return bot.SLOTS_ERROR_REPLY
+
+async def handle_message(sender_number, incoming_msg):
+    """Async app.handle_message: same flow and replies, non-blocking I/O."""
+    reply_text = "Sorry, I couldn't understand your request."
+
+    try:
+        access_token = await authenticate_user(sender_number)
+        if not access_token:
+            reply_text = "Authentication failed. Please try again."
+        else:
+            user_info = await fetch_user_info(sender_number, access_token)
+            # The session store may be Redis: keep its calls off the event loop
+            session = await asyncio.to_thread(bot.session_store.get, sender_number)
+
+            # Registration flow for unregistered users
+            if isinstance(user_info, dict) and user_info.get("error") == "USER_NOT_FOUND":
+                reply, payload = await asyncio.to_thread(bot.registration_step, sender_number, incoming_msg, session)
+                if payload is not None:
+                    result = await register_user(payload, access_token)
+                    return await asyncio.to_thread(bot.finish_registration, sender_number, payload, result)
+                if reply is not None:
+                    return reply
+
+            user_id = user_info.get("user", {}).get("id") if user_info else None
+
+            # Structured messages (bookings, slot requests, FAQ topics) skip Gemini
+            command = bot.intent_router.route(incoming_msg, user_id=user_id)
+            if command:
+                logger.info("Fast path: %s", command)
+                return await run_bot_command(command, access_token)
+
+            group_info, professionals_list, appointments, personal_appointments = await fetch_context(
+                user_id, access_token
+            )
+
+            chat_model, full_prompt = bot.build_gemini_request(
+                session, incoming_msg, user_info, group_info, professionals_list,
+                appointments, personal_appointments
+            )
+            with stage_timer("gemini"):
+                gemini_response = await bot.gemini_breaker.acall(
+                    gemini_limiter.call, chat_model.generate_content_async, full_prompt,
+                    request_options={"timeout": bot.GEMINI_TIMEOUT}
+                )
+            reply_text = await run_bot_command(gemini_response.text.strip(), access_token)
+
+    except Overloaded:
+        reply_text = bot.BUSY_REPLY_TEXT
+    except CircuitOpen:
+        reply_text = bot.GEMINI_UNAVAILABLE_REPLY
+    except Exception:
+        logger.exception("Error handling message")
+        reply_text = bot.ERROR_REPLY_TEXT
+
+    return reply_text
+
+async def handle_burst(sender_number, messages):
+    """Async app.handle_burst: merge a batch into one turn, except mid-registration."""
+    if len(messages) == 1:
+        return await handle_message(sender_number, messages[0])
+
+    session = await asyncio.to_thread(bot.session_store.get, sender_number)
+    if session is not None and session.registration_state:
+        return "\n\n".join([await handle_message(sender_number, msg) for msg in messages])
+
+    logger.info("Merged burst", extra={"messages": len(messages)})
+    return await handle_message(sender_number, "\n".join(messages))
+
+sender_queue = create_async_sender_queue(
+    bot.STATE_BACKEND, handle_burst, window=bot.SENDER_DEBOUNCE_WINDOW,
+    max_wait=bot.SENDER_DEBOUNCE_MAX_WAIT, max_batch=bot.SENDER_MAX_BATCH, client=bot.redis_client
+)
+
+async def respond(sender_number, incoming_msg):
+    """Async app.respond: None when the message was merged into a later one."""
+    reply_text, last = await sender_queue.submit(sender_number, incoming_msg)
+    if not last:
+        return None
+    metrics.response_chars.observe(len(reply_text))
+    return reply_text
+
+@timed("send_reply")
+async def send_whatsapp_message(sender_number, body):
+    """Send one message, retrying transient failures with exponential backoff."""
+    client = get_twilio_client()
+    for attempt in range(bot.REPLY_SEND_ATTEMPTS):
+        try:
+            await client.messages.create_async(
+                body=body,
+                from_=bot.TWILIO_WHATSAPP_NUMBER,
+                to=f"whatsapp:{sender_number}"
+            )
+            return
+        except Exception as e:
+            if attempt == bot.REPLY_SEND_ATTEMPTS - 1 or not is_transient(e):
+                raise
+            await asyncio.sleep(bot.REPLY_RETRY_BACKOFF * (2 ** attempt))
+
+async def send_reply(sender_number, reply_text):
+    """Send the reply split on line/word boundaries, chunks strictly in order."""
+    for chunk in split_message(reply_text):
+        await send_whatsapp_message(sender_number, chunk)
+
+# Overflow chunks scheduled but not sent yet (twiml_first), for /metrics
+overflow_pending = 0
+
+async def send_overflow(sender_number, chunks):
+    global overflow_pending
+    overflow_pending += len(chunks)
+    unsent = len(chunks)
+    try:
+        await asyncio.sleep(bot.REPLY_OVERFLOW_DELAY)
+        for chunk in chunks:
+            await send_whatsapp_message(sender_number, chunk)
+            unsent -= 1
+            overflow_pending -= 1
+    except Exception as e:
+        logger.error("Failed to send WhatsApp message: %s", e)
+    finally:
+        overflow_pending -= unsent
+
+# app.py's gauges read its own sender queue and reply sender; report ours instead
+metrics.registry.gauge(
+    "twolio_merged_messages_total", "Messages merged into a burst.",
+    lambda: sender_queue.stats()["merged"], kind="counter"
+)
+metrics.registry.gauge(
+    "twolio_reply_chunks_pending", "Reply chunks waiting to be sent.", lambda: overflow_pending
+)
+
+async def process_message(sender_number, incoming_msg, message_sid=None):
+    reply_text, duplicate = await bot.message_dedup.arun(
+        message_sid, respond, sender_number, incoming_msg, wait=0
+    )
+    if duplicate:
+        logger.info("Duplicate message skipped")
+        return
+    if reply_text is None:
+        return
+    try:
+        await send_reply(sender_number, reply_text)
+    except Exception as e:
+        logger.error("Failed to send WhatsApp message: %s", e)
+
+async def queue_worker():
+    while True:
+        sender_number, incoming_msg, message_sid, trace = await message_queue.get()
+        metrics.trace_id.set(trace)
+        log.set_context(sender=sender_number, message_sid=message_sid, trace_id=trace)
+        try:
+            await process_message(sender_number, incoming_msg, message_sid)
+        except Exception:
+            logger.exception("Error processing queued message")
+        finally:
+            message_queue.task_done()
+
+async def start_queue():
+    """Create the webhook queue and its workers on the server's event loop."""
+    global message_queue
+    if bot.WEBHOOK_MODE != "queue" or message_queue is not None:
+        return
+    message_queue = asyncio.Queue(maxsize=bot.QUEUE_MAXSIZE)
+    for i in range(bot.QUEUE_WORKERS):
+        queue_workers.append(asyncio.create_task(queue_worker(), name=f"message-worker-{i}"))
+
+metrics.registry.gauge(
+    "twolio_queue_depth", "Messages waiting in the webhook queue.",
+    lambda: message_queue.qsize() if message_queue is not None else 0
+)
+
+async def whatsapp(request):
+    form = await request.form()
+    if bot.webhook_recorder is not None:
+        bot.webhook_recorder.record(form)
+    incoming_msg = form.get("Body", "").strip()
+    sender_number = form.get("From", "").replace("whatsapp:", "")
+    trace = metrics.new_trace_id()
+    log.set_context(sender=sender_number, message_sid=form.get("MessageSid"), trace_id=trace)
+    logger.info("Message received")
+
+    def reply(response, outcome):
+        metrics.messages_total.inc(outcome=outcome)
+        if trace:
+            response.headers["X-Trace-Id"] = trace
+        return response
+
+    if not incoming_msg:
+        return reply(PlainTextResponse("No message received", status_code=400), "empty")
+
+    # Queue mode: acknowledge Twilio right away and let a worker do the rest
+    message_sid = form.get("MessageSid")
+    if bot.WEBHOOK_MODE == "queue":
+        try:
+            message_queue.put_nowait((sender_number, incoming_msg, message_sid, trace))
+            return reply(PlainTextResponse("Message queued"), "queued")
+        except asyncio.QueueFull:
+            logger.warning("Message queue full, rejecting message")
+            try:
+                await send_reply(sender_number, bot.BUSY_REPLY_TEXT)
+            except Exception as e:
+                logger.error("Failed to send WhatsApp message: %s", e)
+            return reply(PlainTextResponse("Message queue full", status_code=503), "queue_full")
+
+    # Only a TwiML answer carries the reply, so only there does a retry wait for it
+    wait = None if bot.REPLY_MODE in ("twiml", "twiml_first") else 0
+    reply_text, duplicate = await bot.message_dedup.arun(
+        message_sid, respond, sender_number, incoming_msg, wait=wait
+    )
+    if duplicate:
+        logger.info("Duplicate webhook")
+
+    # Answer inline with TwiML instead of (or before) REST calls
+    if bot.REPLY_MODE in ("twiml", "twiml_first"):
+        chunks = split_message(reply_text or "")
+        background = None
+        if bot.REPLY_MODE == "twiml_first" and len(chunks) > 1:
+            if not duplicate:
+                background = BackgroundTask(send_overflow, sender_number, chunks[1:])
+            chunks = chunks[:1]
+        return reply(
+            Response(twiml_reply(chunks), media_type="application/xml", background=background),
+            "duplicate" if duplicate else "twiml"
+        )
+
+    if duplicate:
+        return reply(PlainTextResponse("Message already handled"), "duplicate")
+    if reply_text is None:
+        return reply(PlainTextResponse("Message merged"), "merged")
+
+    try:
+        await send_reply(sender_number, reply_text)
+        return reply(PlainTextResponse("Message sent"), "sent")
+    except Exception as e:
+        logger.error("Failed to send WhatsApp message: %s", e)
+        return reply(PlainTextResponse("Failed to send message", status_code=500), "send_failed")
+
+async def metrics_endpoint(request):
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
+async def warm_up():
+    """Create the event-loop-bound clients once the server's loop is running (app.warm_up does the rest)."""
+    if not bot.STARTUP_WARMUP:
+        return
+    try:
+        with startup.step("warm_up (async)"):
+            get_twilio_client()
+            api.client
+    except Exception as e:
+        logger.warning("Warm-up failed, clients will be created on first use: %s", e)
+
+async def shutdown():
+    for task in queue_workers:
+        task.cancel()
+    await asyncio.gather(*queue_workers, return_exceptions=True)
+    await api.aclose()
+    if twilio_client is not None:
+        await twilio_client.http_client.close()
+
+
+app = Starlette(
+    routes=[
+        Route("/whatsapp", whatsapp, methods=["POST"]),
+        Route("/metrics", metrics_endpoint, methods=["GET"]),
+    ],
+    on_startup=[start_queue, warm_up],
+    on_shutdown=[shutdown],
+)
+
+startup.report()
@@ -0,0 +1,306 @@
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+# Free slots offered by the fake backend: every 10 minutes, 08:00-19:50, all of January 2030
+SLOT_DATES = [f"2030-01-{day:02d}" for day in range(1, 32)]
+SLOT_TIMES = [f"{hour:02d}:{minute:02d}" for hour in range(8, 20) for minute in range(0, 60, 10)]
+
+ID_SEGMENT = re.compile(r"/(?:%2B|\+)?\d+(?=/|$)|/[A-Z]{2}[0-9a-f]{32}(?=/|$)")
+
+
+class Fault:
+    """Latency and error injection for one fake service."""
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, error_status=500):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+
+    def apply(self):
+        """Sleep for the configured latency; returns an error status to send, or None."""
+        delay = self.latency + (random.uniform(-self.jitter, self.jitter) if self.jitter else 0.0)
+        if delay > 0:
+            time.sleep(delay)
+        if self.error_rate and random.random() < self.error_rate:
+            return self.error_status
+        return None
+
+
+class FakeService:
+    """
+    Threaded local HTTP server standing in for an external API. Subclasses
+    implement handle(method, path, query, body) -> (status, payload).
+    Every request is counted, so callers can work out calls per message.
+    """
+
+    name = "service"
+
+    def __init__(self, fault=None):
+        self.fault = fault or Fault()
+        self.calls = Counter()
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._server.server_port}"
+
+    def start(self):
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                service._dispatch(self, "GET")
+
+            def do_POST(self):
+                service._dispatch(self, "POST")
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name=f"fake-{self.name}", daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def reset_counts(self):
+        with self._lock:
+            self.calls.clear()
+
+    def total_calls(self):
+        with self._lock:
+            return sum(self.calls.values())
+
+    def handle(self, method, path, query, body):
+        raise NotImplementedError
+
+    def _dispatch(self, request, method):
+        parsed = urlparse(request.path)
+        length = int(request.headers.get("Content-Length") or 0)
+        raw = request.rfile.read(length) if length else b""
+        content_type = request.headers.get("Content-Type", "")
+        if "application/x-www-form-urlencoded" in content_type:
+            body = {k: v[0] for k, v in parse_qs(raw.decode()).items()}
+        else:
+            body = json.loads(raw) if raw else None
+
+        with self._lock:
+            self.calls[f"{method} {self.route_name(parsed.path)}"] += 1
+
+        status = self.fault.apply()
+        if status is not None:
+            payload = {"error": {"code": status, "message": f"injected {self.name} error"}}
+        else:
+            status, payload = self.handle(method, parsed.path, parse_qs(parsed.query), body)
+
+        data = json.dumps(payload).encode()
+        request.send_response(status)
+        request.send_header("Content-Type", "application/json")
+        request.send_header("Content-Length", str(len(data)))
+        request.end_headers()
+        request.wfile.write(data)
+
+    def route_name(self, path):
+        """Path with IDs (numbers, phone numbers, Twilio SIDs) collapsed, used as the call counter key."""
+        return ID_SEGMENT.sub("/{id}", path)
+
+
+class FakeBackend(FakeService):
+    """The secureappointment API: login, users, group, professionals, appointments, info, slots."""
+
+    name = "backend"
+    prefix = "/secureappointment/api/v1/"
+
+    def __init__(self, fault=None):
+        super().__init__(fault)
+        self.users = {}
+        self.booked = set()
+        self._next_id = 1000
+
+    @property
+    def base_url(self):
+        return self.url + self.prefix.rstrip("/")
+
+    def route_name(self, path):
+        return super().route_name(path[len(self.prefix):] if path.startswith(self.prefix) else path)
+
+    def add_user(self, phone_number, name="Bench", surname="User"):
+        with self._lock:
+            self._next_id += 1
+            self.users[phone_number] = {
+                "id": self._next_id, "name": name, "surname": surname,
+                "email": f"{phone_number.strip('+')}@example.com", "phone_number": phone_number,
+            }
+
+    def handle(self, method, path, query, body):
+        route = path[len(self.prefix):] if path.startswith(self.prefix) else path.lstrip("/")
+
+        if route == "auth/login":
+            return 200, {"auth": {"access_token": "bench-token", "refreshToken": "bench-refresh",
+                                  "expires_in": 3600}}
+        if route == "users" and method == "POST":
+            self.add_user(body.get("phone_number"), body.get("name"), body.get("surname"))
+            return 201, {"message": "User created"}
+        if route.startswith("users/"):
+            user = self.users.get(unquote(route[len("users/"):]))
+            if user is None:
+                return 404, {"message": "USER NOT FOUND."}
+            return 200, {"user": user}
+        if route.startswith("groups/"):
+            return 200, {"group": {"id": 3, "name": "Bench group", "frp": "Group information text."}}
+        if route == "professionals":
+            return 200, {"professionals": [
+                {"id": 13, "alias": "Dr. Rossi", "name": "Mario"},
+                {"id": 14, "alias": "Dr. Bianchi", "name": "Anna"},
+            ]}
+        if route == "appointments" and method == "POST":
+            with self._lock:
+                self.booked.add((str(body.get("professionalId")), body.get("dateStart"), body.get("timeStart")))
+            return 201, {"message": "Appointment created"}
+        if route.startswith("appointments/"):
+            return 200, {"appointments": [
+                {"id": 1, "professionalId": 13, "dateStart": "2030-01-01", "timeStart": "08:00"}
+            ]}
+        if route.startswith("info/"):
+            return 200, {"status": 200, "message": f"Information about {route[len('info/'):]}."}
+        if route.startswith("slots/"):
+            pid = route[len("slots/"):]
+            with self._lock:
+                booked = set(self.booked)
+            return 200, {"slots": {
+                date: [t for t in SLOT_TIMES if (pid, date, t) not in booked] for date in SLOT_DATES
+            }}
+        return 404, {"message": "Not found"}
+
+
+class FakeGemini(FakeService):
+    """
+    Gemini generateContent. Replies like the real bot instruction asks:
+    the command for slot, booking and INFO requests, plain text otherwise.
+    """
+
+    name = "gemini"
+
+    def handle(self, method, path, query, body):
+        prompt = " ".join(
+            part.get("text", "") for content in (body or {}).get("contents", []) for part in content.get("parts", [])
+        )
+        # The user's message is the last line of the prompt
+        message = prompt.strip().splitlines()[-1].lower() if prompt.strip() else ""
+        booking = re.search(r"professional\s*(\d+).*?(\d{4}-\d{2}-\d{2}).*?(\d{2}:\d{2})", message)
+        if booking:
+            text = "APPOINTMENT BOOK PROFESSIONAL ID {} DATESTART {} TIMESTART {} USERID 1".format(*booking.groups())
+        elif "slot" in message:
+            text = "PROFESSIONAL SLOT NEEDED 13"
+        elif "secur" in message:
+            text = "INFO: payments/security"
+        else:
+            text = "Hello! I can help you book an appointment or answer questions about the service."
+        return 200, {
+            "candidates": [{"content": {"role": "model", "parts": [{"text": text}]}, "finishReason": "STOP"}],
+            "usageMetadata": {"promptTokenCount": len(prompt) // 4, "candidatesTokenCount": len(text) // 4},
+        }
+
+
+class FakeTwilio(FakeService):
+    """Twilio Messages API. Keeps every sent message per recipient so callers can wait for replies."""
+
+    name = "twilio"
+
+    def __init__(self, fault=None):
+        super().__init__(fault)
+        self.inbox = defaultdict(list)
+        self._arrived = threading.Condition(self._lock)
+
+    def handle(self, method, path, query, body):
+        to = (body or {}).get("To", "").replace("whatsapp:", "")
+        with self._arrived:
+            self.inbox[to].append((time.perf_counter(), body.get("Body", "")))
+            self._arrived.notify_all()
+        sid = "SM%032x" % random.getrandbits(128)
+        return 201, {"sid": sid, "status": "queued", "to": body.get("To"), "from": body.get("From"),
+                     "body": body.get("Body"), "num_segments": "1"}
+
+    def received(self, phone_number):
+        with self._lock:
+            return len(self.inbox[phone_number])
+
+    def wait_for(self, phone_number, seen, timeout):
+        """Wait for the message after the first `seen` ones; returns (arrival time, body) or None."""
+        deadline = time.monotonic() + timeout
+        with self._arrived:
+            while len(self.inbox[phone_number]) <= seen:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._arrived.wait(remaining)
+            return self.inbox[phone_number][seen]
+
+
+class GeminiError(Exception):
+    """Error response from the Gemini stand-in; `code` is the HTTP status (429 counts as rate limiting)."""
+
+    def __init__(self, code, message):
+        super().__init__(f"{code} {message}")
+        self.code = code
+
+
+class _Response:
+    def __init__(self, payload):
+        self.text = payload["candidates"][0]["content"]["parts"][0]["text"]
+
+
+class HttpGeminiModel:
+    """
+    Drop-in for genai.GenerativeModel that calls the FakeGemini server over
+    HTTP (google-generativeai's async client only speaks gRPC, so it can't
+    be pointed at a local server). Installed via app.gemini_models.factory.
+    """
+
+    def __init__(self, url, model_name, system_instruction=None, timeout=30.0):
+        import httpx
+        import requests
+
+        self.endpoint = f"{url}/v1beta/models/{model_name}:generateContent"
+        self.system_instruction = system_instruction
+        self.timeout = timeout
+        self._session = requests.Session()
+        self._async_client = None
+        self._httpx = httpx
+
+    def _payload(self, prompt):
+        payload = {"contents": [{"role": "user", "parts": [{"text": prompt}]}]}
+        if self.system_instruction:
+            payload["systemInstruction"] = {"parts": [{"text": self.system_instruction}]}
+        return payload
+
+    def _result(self, status, payload):
+        if status >= 400:
+            raise GeminiError(status, payload.get("error", {}).get("message", ""))
+        return _Response(payload)
+
+    def generate_content(self, prompt, request_options=None):
+        timeout = (request_options or {}).get("timeout", self.timeout)
+        response = self._session.post(self.endpoint, json=self._payload(prompt), timeout=timeout)
+        return self._result(response.status_code, response.json())
+
+    async def generate_content_async(self, prompt, request_options=None):
+        if self._async_client is None:
+            self._async_client = self._httpx.AsyncClient()
+        timeout = (request_options or {}).get("timeout", self.timeout)
+        response = await self._async_client.post(self.endpoint, json=self._payload(prompt), timeout=timeout)
+        return self._result(response.status_code, response.json())
@@ -0,0 +1,155 @@
+"""
+Replay recorded webhook traffic against a running instance.
+
+Reads a JSONL file written by the webhook recorder (WEBHOOK_RECORD_PATH)
+and POSTs each entry to <url>/whatsapp at its original pacing, N times
+faster (--speed N), or as fast as possible (--speed 0). Senders keep their
+pseudonymous numbers, so conversations replay in order per sender.
+MessageSids get a per-run suffix: a Twilio retry in the recording is still
+a duplicate, but a second replay against the same instance is not.
+
+Reports webhook latency percentiles and a histogram, status codes,
+errors and how far sends lagged behind schedule. A large lag means the
+load generator, not the target, was the bottleneck; raise --max-in-flight.
+
+    python bench/replay.py traffic.jsonl --url http://localhost:5000
+    python bench/replay.py traffic.jsonl --url https://staging.example.com --speed 5 --json replay.json
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from run import BOT_NUMBER, percentile  # noqa: E402
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def load_entries(path, limit=None):
+    entries = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                entries.append(json.loads(line))
+    entries.sort(key=lambda entry: entry["ts"])
+    return entries[:limit] if limit else entries
+
+
+def histogram(latencies, width=40):
+    counts = [0] * (len(LATENCY_BUCKETS) + 1)
+    for value in latencies:
+        index = next((i for i, bound in enumerate(LATENCY_BUCKETS) if value < bound), len(LATENCY_BUCKETS))
+        counts[index] += 1
+    labels = [f"< {bound * 1000:.0f} ms" for bound in LATENCY_BUCKETS] + [f">= {LATENCY_BUCKETS[-1] * 1000:.0f} ms"]
+    peak = max(counts) or 1
+    return [
+        f"  {label:>11} {count:>7}  {'#' * round(width * count / peak)}"
+        for label, count in zip(labels, counts)
+    ]
+
+
+def replay(entries, url, speed=1.0, max_in_flight=256, timeout=30.0):
+    import requests
+
+    endpoint = url.rstrip("/") + "/whatsapp"
+    run_tag = uuid.uuid4().hex[:8]
+    local = threading.local()
+    lock = threading.Lock()
+    latencies = []
+    lags = []
+    statuses = Counter()
+    errors = Counter()
+
+    def send(entry, scheduled):
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        started = time.perf_counter()
+        data = {"Body": entry["body"], "From": f"whatsapp:{entry['from']}", "To": f"whatsapp:{BOT_NUMBER}"}
+        if entry.get("sid"):
+            data["MessageSid"] = f"{entry['sid']}{run_tag}"
+        try:
+            response = local.session.post(endpoint, data=data, timeout=timeout)
+        except Exception as e:
+            with lock:
+                errors[type(e).__name__] += 1
+                lags.append(started - scheduled)
+            return
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            lags.append(started - scheduled)
+            statuses[response.status_code] += 1
+
+    first_ts = entries[0]["ts"] if entries else 0.0
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="replay") as executor:
+        for entry in entries:
+            offset = (entry["ts"] - first_ts) / speed if speed > 0 else 0.0
+            scheduled = started + offset
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            executor.submit(send, entry, scheduled)
+    elapsed = time.perf_counter() - started
+
+    recorded_span = entries[-1]["ts"] - first_ts if entries else 0.0
+    return {
+        "requests": len(entries),
+        "elapsed": elapsed,
+        "recorded_span": recorded_span,
+        "rate": len(entries) / elapsed if elapsed else 0.0,
+        "latency": {f"p{p}": percentile(latencies, p) for p in (50, 90, 95, 99, 100)},
+        "lag": {f"p{p}": percentile(lags, p) for p in (50, 99, 100)},
+        "statuses": {str(code): count for code, count in sorted(statuses.items())},
+        "errors": dict(errors),
+        "histogram": histogram(latencies),
+    }
+
+
+def print_report(result, speed):
+    def ms(value):
+        return "-" if value is None else f"{value * 1000:.0f} ms"
+
+    pacing = "no pacing" if speed <= 0 else f"{speed:g}x speed"
+    print(f"Replayed {result['requests']} requests in {result['elapsed']:.1f}s "
+          f"({pacing}, recorded over {result['recorded_span']:.1f}s): {result['rate']:.1f} req/s")
+    print("Latency: " + "  ".join(f"{key}={ms(value)}" for key, value in result["latency"].items()))
+    for line in result["histogram"]:
+        print(line)
+    print("Status codes: " + (", ".join(f"{code}={n}" for code, n in result["statuses"].items()) or "-"))
+    if result["errors"]:
+        print("Errors: " + ", ".join(f"{name}={n}" for name, n in sorted(result["errors"].items())))
+    print("Send lag behind schedule: " + "  ".join(f"{key}={ms(value)}" for key, value in result["lag"].items()))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("path", help="JSONL file written by the webhook recorder")
+    parser.add_argument("--url", default="http://127.0.0.1:5000", help="base URL of the target instance")
+    parser.add_argument("--speed", type=float, default=1.0, help="pacing multiplier; 0 sends as fast as possible")
+    parser.add_argument("--max-in-flight", type=int, default=256, help="concurrent requests at most")
+    parser.add_argument("--limit", type=int, help="replay only the first N requests")
+    parser.add_argument("--timeout", type=float, default=30.0, help="seconds per request")
+    parser.add_argument("--json", dest="json_path", help="also write the results to this file")
+    args = parser.parse_args(argv)
+
+    entries = load_entries(args.path, args.limit)
+    if not entries:
+        sys.exit(f"No requests in {args.path}")
+    result = replay(entries, args.url, args.speed, args.max_in_flight, args.timeout)
+    print_report(result, args.speed)
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump({"args": vars(args), **result}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
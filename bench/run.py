@@ -0,0 +1,312 @@
+"""
+Offline end-to-end benchmark of the /whatsapp webhook.
+
+Starts the Flask app (or the ASGI variant) on a local port, with the
+secureappointment API, Gemini and the Twilio Messages API replaced by
+local fake servers (see fakes.py), each with configurable latency and
+error injection. Virtual users then drive each scenario at the given
+concurrency levels; every message waits for its reply to reach the fake
+Twilio before the user sends the next one.
+
+Reported per scenario and concurrency level: reply latency p50/p95/p99
+(webhook POST until the first reply chunk reaches Twilio, or the webhook
+response itself when it carries TwiML), webhook latency, throughput and
+calls per message to each fake service.
+
+Run from the repository root:
+    python bench/run.py
+    python bench/run.py --app asgi --concurrency 1,16,64 --messages 500
+    python bench/run.py --scenarios slots,booking --gemini-latency 1.5 --backend-errors 0.05
+
+App settings (REPLY_MODE, WEBHOOK_MODE, GEMINI_MAX_CONCURRENCY, ...) are
+read from the environment as usual. Caches stay warm across runs, as they
+would in a long-running worker.
+"""
+import argparse
+import itertools
+import json
+import logging
+import math
+import os
+import socket
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fakes import Fault, FakeBackend, FakeGemini, FakeTwilio, HttpGeminiModel  # noqa: E402
+
+BOT_NUMBER = "+14155238886"
+SCENARIOS = ("registered", "registration", "info", "slots", "booking")
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of an unsorted list (None if empty)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100.0 * len(ordered)))
+    return ordered[rank - 1]
+
+
+class Scenario:
+    """Hands out conversations: (phone number, list of messages)."""
+
+    def __init__(self, name, index, backend):
+        self.name = name
+        self.index = index
+        self.backend = backend
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def conversation(self):
+        with self._lock:
+            n = next(self._ids)
+        phone_number = f"+39{self.index}{n:08d}"
+        if self.name == "registration":
+            return phone_number, ["Hi", "Mario", "Rossi", f"mario.{n}@example.com"]
+
+        self.backend.add_user(phone_number)
+        if self.name == "registered":
+            return phone_number, ["Hello, what can you do for me?"]
+        if self.name == "info":
+            return phone_number, ["Is payment security guaranteed?"]
+        if self.name == "slots":
+            return phone_number, ["Show me the available slots for professional 13"]
+        # Every booking gets its own slot, so none are rejected as occupied
+        date = f"2030-01-{(n // 72) % 31 + 1:02d}"
+        time_start = f"{8 + (n % 72) // 6:02d}:{(n % 6) * 10:02d}"
+        return phone_number, [f"Book professional id 13 date {date} time {time_start}"]
+
+
+class Runner:
+    def __init__(self, url, twilio, reply_timeout):
+        self.url = url.rstrip("/") + "/whatsapp"
+        self.twilio = twilio
+        self.reply_timeout = reply_timeout
+
+    def run(self, scenario, concurrency, messages):
+        import requests
+
+        budget = itertools.count()
+        reply_latencies = []
+        webhook_latencies = []
+        errors = Counter()
+        lock = threading.Lock()
+
+        def send(session, phone_number, body):
+            seen = self.twilio.received(phone_number)
+            started = time.perf_counter()
+            try:
+                response = session.post(self.url, data={
+                    "Body": body, "From": f"whatsapp:{phone_number}", "To": f"whatsapp:{BOT_NUMBER}",
+                    "MessageSid": "SM" + uuid.uuid4().hex,
+                }, timeout=self.reply_timeout)
+            except Exception as e:
+                return None, None, type(e).__name__
+            webhook = time.perf_counter() - started
+            if response.status_code >= 400:
+                return None, webhook, f"http_{response.status_code}"
+            if "<Message>" in response.text:
+                return webhook, webhook, None
+            reply = self.twilio.wait_for(phone_number, seen, self.reply_timeout)
+            if reply is None:
+                return None, webhook, "reply_timeout"
+            return reply[0] - started, webhook, None
+
+        def user():
+            session = requests.Session()
+            while True:
+                phone_number, script = scenario.conversation()
+                for body in script:
+                    if next(budget) >= messages:
+                        return
+                    reply, webhook, error = send(session, phone_number, body)
+                    with lock:
+                        if webhook is not None:
+                            webhook_latencies.append(webhook)
+                        if error is None:
+                            reply_latencies.append(reply)
+                        else:
+                            errors[error] += 1
+                    if error is not None:
+                        # The conversation can't go on without its reply
+                        break
+
+        started = time.perf_counter()
+        threads = [threading.Thread(target=user, daemon=True) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        return {
+            "messages": messages,
+            "ok": len(reply_latencies),
+            "errors": dict(errors),
+            "elapsed": elapsed,
+            "throughput": len(reply_latencies) / elapsed if elapsed else 0.0,
+            "reply": {f"p{p}": percentile(reply_latencies, p) for p in (50, 95, 99)},
+            "webhook": {f"p{p}": percentile(webhook_latencies, p) for p in (50, 95, 99)},
+        }
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_flask(bot):
+    from werkzeug.serving import make_server
+
+    # werkzeug logs every request at INFO unless its logger has a level
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    server = make_server("127.0.0.1", 0, bot.app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="bench-flask", daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+def start_asgi(asgi_app):
+    import uvicorn
+
+    class Server(uvicorn.Server):
+        def install_signal_handlers(self):
+            pass
+
+    port = free_port()
+    server = Server(uvicorn.Config(asgi_app.app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, name="bench-uvicorn", daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}"
+
+
+def redirect_twilio(module, url):
+    """Point the Twilio client the module creates on first use at the fake."""
+    get_twilio_client = module.get_twilio_client
+
+    def get_local_twilio_client():
+        client = get_twilio_client()
+        client.api.base_url = url
+        return client
+
+    module.get_twilio_client = get_local_twilio_client
+
+
+def load_app(args, backend, gemini, twilio):
+    """Import the app pointed at the fakes; returns the URL it serves on."""
+    os.environ["API_BASE_URL"] = backend.base_url
+    os.environ["TWILIO_ACCOUNT_SID"] = "AC" + "0" * 32
+    os.environ["TWILIO_AUTH_TOKEN"] = "bench-auth-token"
+    os.environ["TWILIO_WHATSAPP_NUMBER"] = f"whatsapp:{BOT_NUMBER}"
+    os.environ["GOOGLE_API_KEY"] = "bench-api-key"
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+    import app as bot
+
+    bot.gemini_models.factory = lambda system_instruction: HttpGeminiModel(
+        gemini.url, bot.GEMINI_MODEL_NAME, system_instruction, timeout=bot.GEMINI_TIMEOUT
+    )
+    redirect_twilio(bot, twilio.url)
+    if args.app == "flask":
+        return start_flask(bot)
+
+    import asgi_app
+
+    redirect_twilio(asgi_app, twilio.url)
+    return start_asgi(asgi_app)
+
+
+def fmt_ms(value):
+    return "-" if value is None else f"{value * 1000:.0f}"
+
+
+def print_header():
+    print(f"{'scenario':<13}{'conc':>5}{'ok':>6}{'err':>5}{'msg/s':>8}"
+          f"{'p50':>7}{'p95':>7}{'p99':>7}{'hook p50':>10}{'hook p99':>10}"
+          f"{'api/msg':>9}{'gem/msg':>9}{'twl/msg':>9}")
+
+
+def print_row(name, concurrency, result):
+    calls = result["calls_per_message"]
+    errors = sum(result["errors"].values())
+    print(f"{name:<13}{concurrency:>5}{result['ok']:>6}{errors:>5}{result['throughput']:>8.1f}"
+          f"{fmt_ms(result['reply']['p50']):>7}{fmt_ms(result['reply']['p95']):>7}"
+          f"{fmt_ms(result['reply']['p99']):>7}{fmt_ms(result['webhook']['p50']):>10}"
+          f"{fmt_ms(result['webhook']['p99']):>10}"
+          f"{calls['backend']:>9.2f}{calls['gemini']:>9.2f}{calls['twilio']:>9.2f}")
+    if result["errors"]:
+        print(f"{'':<13}errors: " + ", ".join(f"{k}={v}" for k, v in sorted(result["errors"].items())))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--app", choices=("flask", "asgi"), default="flask")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help="comma-separated subset of: " + ", ".join(SCENARIOS))
+    parser.add_argument("--concurrency", default="1,8,32", help="comma-separated virtual user counts")
+    parser.add_argument("--messages", type=int, default=200, help="messages per scenario and level")
+    parser.add_argument("--reply-timeout", type=float, default=30.0)
+    parser.add_argument("--json", dest="json_path", help="also write the results to this file")
+    for service, latency in (("backend", 0.05), ("gemini", 0.8), ("twilio", 0.1)):
+        parser.add_argument(f"--{service}-latency", type=float, default=latency, help="seconds per call")
+        parser.add_argument(f"--{service}-jitter", type=float, default=latency / 5, help="+/- seconds")
+        parser.add_argument(f"--{service}-errors", type=float, default=0.0, help="error rate, 0-1")
+        parser.add_argument(f"--{service}-error-status", type=int, default=500)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        sys.exit(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+    levels = [int(level) for level in args.concurrency.split(",")]
+
+    def fault(service):
+        return Fault(getattr(args, f"{service}_latency"), getattr(args, f"{service}_jitter"),
+                     getattr(args, f"{service}_errors"), getattr(args, f"{service}_error_status"))
+
+    services = {
+        "backend": FakeBackend(fault("backend")).start(),
+        "gemini": FakeGemini(fault("gemini")).start(),
+        "twilio": FakeTwilio(fault("twilio")).start(),
+    }
+    url = load_app(args, services["backend"], services["gemini"], services["twilio"])
+    runner = Runner(url, services["twilio"], args.reply_timeout)
+
+    print(f"app={args.app} latency(s): backend={args.backend_latency} gemini={args.gemini_latency} "
+          f"twilio={args.twilio_latency}; reply/webhook latencies in ms")
+    print_header()
+    results = []
+    for index, name in enumerate(scenarios, start=1):
+        scenario = Scenario(name, index, services["backend"])
+        for concurrency in levels:
+            for service in services.values():
+                service.reset_counts()
+            result = runner.run(scenario, concurrency, args.messages)
+            sent = max(1, result["ok"] + sum(result["errors"].values()))
+            result["calls_per_message"] = {
+                key: service.total_calls() / sent for key, service in services.items()
+            }
+            result["calls"] = {key: dict(service.calls) for key, service in services.items()}
+            result.update(scenario=name, concurrency=concurrency)
+            results.append(result)
+            print_row(name, concurrency, result)
+
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump({"app": args.app, "args": vars(args), "results": results}, f, indent=2)
+
+    for service in services.values():
+        service.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from singleflight import AsyncSingleFlight, SingleFlight
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+class _Entry:
+    __slots__ = ("value", "stored_at")
+
+    def __init__(self, value, stored_at):
+        self.value = value
+        self.stored_at = stored_at
+
+
+class TTLCache:
+    """
+    Process-wide LRU cache with a TTL and stale-while-revalidate.
+
+    - Entries younger than `ttl` are served as-is.
+    - Entries older than `ttl` but younger than `ttl + stale_ttl` are served
+      immediately while one background refresh reloads them.
+    - Older entries (or misses) are loaded synchronously; concurrent misses
+      for the same key share a single load.
+    Loaders signal failure by raising; failures are never cached.
+    """
+
+    def __init__(self, maxsize=256, ttl=300, stale_ttl=0, name="cache"):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.name = name
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._loads = SingleFlight()
+        self._async_loads = AsyncSingleFlight()
+        self._refreshing = set()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None, fresh=False):
+        """Return the cached value without loading; stale ones only unless `fresh`."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or self._age(entry) > (self.ttl if fresh else self.ttl + self.stale_ttl):
+                return default
+            self._data.move_to_end(key)
+            return entry.value
+
+    def last_good(self, key, default=None):
+        """
+        Return the last successfully loaded value, however old (until the
+        LRU evicts it). Fallback for when the source is down.
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            return default if entry is None else entry.value
+
+    def get_or_load(self, key, loader, ttl=None):
+        now = time.monotonic()
+        ttl = self.ttl if ttl is None else ttl
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                age = now - entry.stored_at
+                if age <= ttl:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return entry.value
+                if age <= ttl + self.stale_ttl:
+                    self._data.move_to_end(key)
+                    self.stale_hits += 1
+                    self._refresh_in_background(key, loader)
+                    return entry.value
+            self.misses += 1
+
+        return self._loads.do(key, self._load, key, loader)
+
+    async def aget_or_load(self, key, loader, ttl=None):
+        """
+        asyncio version of get_or_load; `loader` is a coroutine function.
+        Stale entries are refreshed in a background task on the running loop.
+        """
+        now = time.monotonic()
+        ttl = self.ttl if ttl is None else ttl
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                age = now - entry.stored_at
+                if age <= ttl:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return entry.value
+                if age <= ttl + self.stale_ttl:
+                    self._data.move_to_end(key)
+                    self.stale_hits += 1
+                    if key not in self._refreshing:
+                        self._refreshing.add(key)
+                        asyncio.get_running_loop().create_task(self._refresh_async(key, loader))
+                    return entry.value
+            self.misses += 1
+
+        return await self._async_loads.do(key, self._aload, key, loader)
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = _Entry(value, time.monotonic())
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key=_MISSING):
+        """Drop one key, or everything when called without a key."""
+        with self._lock:
+            if key is _MISSING:
+                self._data.clear()
+            else:
+                self._data.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "name": self.name,
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "misses": self.misses,
+            }
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+    def _age(self, entry):
+        return time.monotonic() - entry.stored_at
+
+    def _load(self, key, loader):
+        value = loader()
+        self.set(key, value)
+        return value
+
+    async def _aload(self, key, loader):
+        value = await loader()
+        self.set(key, value)
+        return value
+
+    async def _refresh_async(self, key, loader):
+        try:
+            await self._async_loads.do(key, self._aload, key, loader)
+        except Exception as e:
+            logger.warning("Background refresh failed: %s", e, extra={"cache": self.name, "key": key})
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def _refresh_in_background(self, key, loader):
+        # Called with self._lock held
+        if key in self._refreshing:
+            return
+        self._refreshing.add(key)
+
+        def refresh():
+            try:
+                self._loads.do(key, self._load, key, loader)
+            except Exception as e:
+                logger.warning("Background refresh failed: %s", e, extra={"cache": self.name, "key": key})
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=refresh, name=f"{self.name}-refresh", daemon=True).start()
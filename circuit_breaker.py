@@ -0,0 +1,136 @@
+import logging
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpen(Exception):
+    """Raised instead of calling a dependency whose circuit is open."""
+
+
+class CircuitBreaker:
+    """
+    Per-dependency circuit breaker.
+
+    - closed: calls go through; the outcome of the last `window` calls is
+      tracked and the circuit opens once at least `min_calls` were made and
+      the failure rate reaches `failure_threshold`.
+    - open: calls fail immediately with CircuitOpen for `reset_timeout`s.
+    - half_open: up to `half_open_max` probe calls go through; a success
+      closes the circuit, a failure opens it again.
+
+    Exceptions listed in `ignore` (e.g. load shedding) count neither way.
+    """
+
+    def __init__(self, name, failure_threshold=0.5, min_calls=10, window=20,
+                 reset_timeout=30.0, half_open_max=1, ignore=()):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.min_calls = min_calls
+        self.reset_timeout = reset_timeout
+        self.half_open_max = half_open_max
+        self.ignore = tuple(ignore)
+
+        self._lock = threading.Lock()
+        self._outcomes = deque(maxlen=window)
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probes = 0
+        self.rejected = 0
+        self.opened = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state(time.monotonic())
+
+    def before_call(self):
+        """Admit a call or raise CircuitOpen. Every admitted call must be recorded."""
+        with self._lock:
+            state = self._current_state(time.monotonic())
+            if state == CLOSED:
+                return
+            if state == HALF_OPEN and self._probes < self.half_open_max:
+                self._state = HALF_OPEN
+                self._probes += 1
+                return
+            self.rejected += 1
+        raise CircuitOpen(f"{self.name} circuit is open")
+
+    def record(self, success):
+        """Record an admitted call: True/False, or None for no verdict."""
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._probes = max(0, self._probes - 1)
+                if success is True:
+                    logger.info("Circuit closed", extra={"dependency": self.name})
+                    self._state = CLOSED
+                    self._outcomes.clear()
+                elif success is False:
+                    self._trip()
+                return
+
+            if success is None:
+                return
+            self._outcomes.append(success)
+            if self._state == CLOSED and len(self._outcomes) >= self.min_calls:
+                failures = self._outcomes.count(False)
+                if failures / len(self._outcomes) >= self.failure_threshold:
+                    self._trip()
+
+    def call(self, fn, *args, **kwargs):
+        self.before_call()
+        try:
+            result = fn(*args, **kwargs)
+        except self.ignore:
+            self.record(None)
+            raise
+        except Exception:
+            self.record(False)
+            raise
+        self.record(True)
+        return result
+
+    async def acall(self, fn, *args, **kwargs):
+        """call() for a coroutine function."""
+        self.before_call()
+        try:
+            result = await fn(*args, **kwargs)
+        except self.ignore:
+            self.record(None)
+            raise
+        except Exception:
+            self.record(False)
+            raise
+        self.record(True)
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {
+                "name": self.name,
+                "state": self._current_state(time.monotonic()),
+                "recent_calls": len(self._outcomes),
+                "recent_failures": self._outcomes.count(False),
+                "rejected": self.rejected,
+                "opened": self.opened,
+            }
+
+    def _current_state(self, now):
+        # Called with self._lock held; open turns half-open once the timeout passes
+        if self._state == OPEN and now - self._opened_at >= self.reset_timeout:
+            return HALF_OPEN
+        return self._state
+
+    def _trip(self):
+        self._state = OPEN
+        self._opened_at = time.monotonic()
+        self._outcomes.clear()
+        self.opened += 1
+        logger.error("Circuit opened", extra={"dependency": self.name, "open_s": self.reset_timeout})
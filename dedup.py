@@ -0,0 +1,200 @@
+import asyncio
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+
+class MessageDeduplicator:
+    """
+    Run each Twilio message (keyed by MessageSid) at most once per `ttl`.
+
+    - The first delivery runs the handler.
+    - A retry that arrives while it is still running waits for the same
+      result (up to `wait` seconds) instead of running it again.
+    - A retry after completion gets the stored result immediately.
+    `run` returns (result, duplicate); result is None when a duplicate gave
+    up waiting. Callers that don't use a duplicate's result pass wait=0.
+    Failures are not stored, so a later retry runs again.
+    """
+
+    def __init__(self, ttl=600, maxsize=10000, wait=30.0):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.wait = wait
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> [Future, expires_at]
+        self.executed = 0
+        self.duplicates = 0
+
+    def run(self, key, fn, *args, wait=None, **kwargs):
+        if not key:
+            return fn(*args, **kwargs), False
+
+        future, owner = self._claim(key)
+        if not owner:
+            try:
+                return future.result(timeout=self.wait if wait is None else wait), True
+            except FutureTimeout:
+                return None, True
+
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            self._fail(key, future, e)
+            raise
+        self._finish(key, future, result)
+        return result, False
+
+    async def arun(self, key, fn, *args, wait=None, **kwargs):
+        """asyncio version of run; `fn` is a coroutine function."""
+        if not key:
+            return await fn(*args, **kwargs), False
+
+        future, owner = self._claim(key)
+        if not owner:
+            if future.done():
+                return future.result(), True
+            try:
+                # shield: timing out must not cancel the shared future
+                wait = self.wait if wait is None else wait
+                return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), wait), True
+            except asyncio.TimeoutError:
+                return None, True
+
+        try:
+            result = await fn(*args, **kwargs)
+        except BaseException as e:
+            self._fail(key, future, e)
+            raise
+        self._finish(key, future, result)
+        return result, False
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "executed": self.executed,
+                "duplicates": self.duplicates,
+            }
+
+    def _claim(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > now:
+                self.duplicates += 1
+                return entry[0], False
+
+            future = Future()
+            self._entries[key] = [future, now + self.ttl]
+            self._entries.move_to_end(key)
+            # Oldest first; evicting a running entry only loses its coalescing
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+            self.executed += 1
+            return future, True
+
+    def _finish(self, key, future, result):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] is future:
+                entry[1] = time.monotonic() + self.ttl
+        future.set_result(result)
+
+    def _fail(self, key, future, error):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] is future:
+                del self._entries[key]
+        future.set_exception(error)
+
+
+class RedisMessageDeduplicator:
+    """
+    MessageDeduplicator shared by every worker/process through Redis, so a
+    retry routed to another gunicorn worker is caught too. Duplicates poll
+    the stored result every `poll_interval` seconds. Results must be JSON.
+    """
+
+    RUNNING = "running"
+
+    def __init__(self, client, prefix="twolio:msg:", ttl=600, wait=30.0, poll_interval=0.2):
+        self.client = client
+        self.prefix = prefix
+        self.ttl = int(ttl)
+        self.wait = wait
+        self.poll_interval = poll_interval
+        self.executed = 0
+        self.duplicates = 0
+
+    def run(self, key, fn, *args, wait=None, **kwargs):
+        if not key:
+            return fn(*args, **kwargs), False
+
+        redis_key = f"{self.prefix}{key}"
+        if not self.client.set(redis_key, self.RUNNING, nx=True, ex=self.ttl):
+            self.duplicates += 1
+            deadline = time.monotonic() + (self.wait if wait is None else wait)
+            while True:
+                done, result = self._stored(redis_key)
+                if done or time.monotonic() >= deadline:
+                    return result, True
+                time.sleep(self.poll_interval)
+
+        self.executed += 1
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException:
+            self.client.delete(redis_key)
+            raise
+        self.client.set(redis_key, json.dumps({"result": result}), ex=self.ttl)
+        return result, False
+
+    async def arun(self, key, fn, *args, wait=None, **kwargs):
+        if not key:
+            return await fn(*args, **kwargs), False
+
+        redis_key = f"{self.prefix}{key}"
+        claimed = await asyncio.to_thread(self.client.set, redis_key, self.RUNNING, nx=True, ex=self.ttl)
+        if not claimed:
+            self.duplicates += 1
+            deadline = time.monotonic() + (self.wait if wait is None else wait)
+            while True:
+                done, result = await asyncio.to_thread(self._stored, redis_key)
+                if done or time.monotonic() >= deadline:
+                    return result, True
+                await asyncio.sleep(self.poll_interval)
+
+        self.executed += 1
+        try:
+            result = await fn(*args, **kwargs)
+        except BaseException:
+            await asyncio.to_thread(self.client.delete, redis_key)
+            raise
+        await asyncio.to_thread(self.client.set, redis_key, json.dumps({"result": result}), ex=self.ttl)
+        return result, False
+
+    def stats(self):
+        return {"executed": self.executed, "duplicates": self.duplicates}
+
+    def _stored(self, redis_key):
+        """(done, result): done once the first attempt stored or dropped its result."""
+        raw = self.client.get(redis_key)
+        if raw is None:
+            # Expired, or the first attempt failed and released the key
+            return True, None
+        if isinstance(raw, bytes):
+            raw = raw.decode()
+        if raw == self.RUNNING:
+            return False, None
+        return True, json.loads(raw)["result"]
+
+
+def create_deduplicator(name, ttl=600, maxsize=10000, wait=30.0, client=None):
+    if name == "memory":
+        return MessageDeduplicator(ttl=ttl, maxsize=maxsize, wait=wait)
+    if name == "redis":
+        return RedisMessageDeduplicator(client, ttl=ttl, wait=wait)
+    raise ValueError(f"Unknown dedup backend: {name}")
@@ -0,0 +1,71 @@
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+from prompt_builder import STATIC_SECTIONS, build_system_instruction, format_report
+
+logger = logging.getLogger(__name__)
+
+
+class GeminiModelCache:
+    """
+    One Gemini model instance per distinct system instruction.
+
+    The static part of the prompt (instruction, and optionally the group
+    info and professionals list) is set once as the model's system
+    instruction, so each request only sends the per-user part. The system
+    instruction text is rebuilt only when one of its inputs changes; group
+    info and professionals come from the context caches, so an unchanged
+    object means unchanged data.
+    """
+
+    def __init__(self, factory, maxsize=32):
+        # factory(system_instruction) -> model with generate_content()
+        self.factory = factory
+        self.maxsize = maxsize
+        self._models = OrderedDict()
+        self._inputs = OrderedDict()
+        self._lock = threading.Lock()
+        self.builds = 0
+
+    def get(self, instruction, group_info=None, professionals=None, include=STATIC_SECTIONS):
+        with self._lock:
+            memo = self._inputs.get(instruction)
+            if memo is not None:
+                memo_group, memo_professionals, memo_include, key = memo
+                model = self._models.get(key)
+                if (model is not None and memo_group is group_info
+                        and memo_professionals is professionals and memo_include == include):
+                    self._models.move_to_end(key)
+                    self._inputs.move_to_end(instruction)
+                    return model
+
+        system_instruction, report = build_system_instruction(
+            instruction, group_info, professionals, include=include
+        )
+        key = hashlib.sha1(system_instruction.encode("utf-8")).hexdigest()
+
+        with self._lock:
+            model = self._models.get(key)
+            if model is None:
+                model = self.factory(system_instruction)
+                self.builds += 1
+                self._models[key] = model
+                logger.info("Gemini system instruction built: %s", format_report(report))
+            self._models.move_to_end(key)
+            self._trim(self._models)
+
+            self._inputs[instruction] = (group_info, professionals, include, key)
+            self._inputs.move_to_end(instruction)
+            self._trim(self._inputs)
+        return model
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+            self._inputs.clear()
+
+    def _trim(self, entries):
+        while len(entries) > self.maxsize:
+            entries.popitem(last=False)
@@ -0,0 +1,10 @@
+# Loaded by gunicorn from the working directory (see Procfile).
+
+
+def post_worker_init(worker):
+    # Threads don't survive a fork, so queue workers start in each worker
+    # once it has loaded the app (this also covers --preload).
+    import app as bot
+
+    if getattr(worker, "wsgi", None) is bot.app:
+        bot.start_worker_pool()
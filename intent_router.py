@@ -0,0 +1,173 @@
+import re
+import threading
+from datetime import datetime
+
+INFO_ENDPOINT_PATTERN = re.compile(r"INFO:\s*([a-z0-9_]+/[a-z0-9_]+)")
+
+# Keyword rules for the INFO endpoints, checked in order. Only phrases that
+# unambiguously name one endpoint are listed; anything else goes to Gemini.
+INFO_RULES = (
+    (r"\btopupsure\b", "payments/topupsure"),
+    (r"\bpostepay\b", "payments/postepay"),
+    (r"\bpaypal\b", "payment_method/paypal"),
+    (r"\bphone credit\b", "payment_method/phone_credit"),
+    (r"\b(my|account) balance\b", "payments/my_balance"),
+    (r"\b(payment|payments) security\b|\bis (it|paying) safe\b", "payments/security"),
+    (r"\b899\b", "899/cant_call"),
+    (r"\b(read|see|show)\b.*\breviews?\b", "reviews/read"),
+    (r"\b(leave|write|make|add)\b.*\breview\b", "reviews/make"),
+    (r"\bcourses\b", "end_user/courses"),
+    (r"\bacademy\b", "end_user/send_messages_academy"),
+    (r"\b(is|are) (the )?(service|services) free\b", "end_user/is_service_free"),
+    (r"\b(can'?t|cannot|unable to) top ?up\b", "end_user/cant_topup"),
+)
+
+BOOKING_PATTERN = re.compile(
+    r"professional\s*id\s*[:#=-]?\s*(\d+)"
+    r"[\s,;]*date\s*(?:start)?\s*[:=-]?\s*([0-9]{1,4}[-/.][0-9]{1,2}[-/.][0-9]{1,4})"
+    r"[\s,;]*time\s*(?:start)?\s*[:=-]?\s*([0-9]{1,2}[:.][0-9]{2})",
+    re.IGNORECASE,
+)
+SLOTS_PATTERN = re.compile(
+    r"\b(?:slots?|availability|available\s+times?)\b.*?\bprofessional\s*(?:id)?\s*[:#]?\s*(\d+)"
+    r"|\bprofessional\s*(?:id)?\s*[:#]?\s*(\d+)\b.*?\b(?:slots?|availability)\b",
+    re.IGNORECASE | re.DOTALL,
+)
+COMMAND_PATTERN = re.compile(r"^(PROFESSIONAL SLOT NEEDED \d+|INFO: [\w/]+)$")
+# A pasted booking command is rebuilt for the sender; its USERID is never trusted
+PASTED_BOOKING_PATTERN = re.compile(
+    r"^APPOINTMENT BOOK PROFESSIONAL ID (\d+) DATESTART (\d{4}-\d{2}-\d{2}) TIMESTART (\d{2}:\d{2})(?: USERID \d+)?$"
+)
+
+# A booking is only routed when the words around its fields are just these
+BOOKING_FILLER = frozenset((
+    "a", "an", "appointment", "book", "booking", "can", "could", "for", "hello", "hi", "i", "id", "like",
+    "make", "me", "my", "new", "please", "reserve", "the", "to", "want", "with", "would", "you",
+))
+# A slot request is only routed when every word is one of these
+SLOTS_FILLER = BOOKING_FILLER | frozenset((
+    "any", "are", "availability", "available", "check", "do", "does", "free", "get", "give", "have", "is",
+    "list", "of", "open", "professional", "see", "show", "slot", "slots", "tell", "there", "time", "times",
+    "what", "when", "which",
+))
+# Cancelling or changing an appointment isn't a booking or a slot request
+BOOKING_EXCLUDE_PATTERN = re.compile(
+    r"\b(cancel\w*|reschedul\w*|change|modify|move|postpone|delete|remove|not|don'?t)\b", re.IGNORECASE
+)
+WORD_PATTERN = re.compile(r"[a-z']+", re.IGNORECASE)
+
+DATE_FORMATS = ("%Y-%m-%d", "%Y/%m/%d", "%d-%m-%Y", "%d/%m/%Y", "%d.%m.%Y", "%d-%m-%y", "%d/%m/%y")
+
+
+def parse_info_endpoints(text):
+    """List the `INFO: <endpoint>` entries of an instruction, in order."""
+    return list(dict.fromkeys(INFO_ENDPOINT_PATTERN.findall(text)))
+
+
+def normalize_date(value):
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).strftime("%Y-%m-%d")
+        except ValueError:
+            continue
+    return None
+
+
+def normalize_time(value):
+    try:
+        return datetime.strptime(value.replace(".", ":"), "%H:%M").strftime("%H:%M")
+    except ValueError:
+        return None
+
+
+def only_filler(text, filler):
+    return all(word.lower() in filler for word in WORD_PATTERN.findall(text))
+
+
+def is_plain_booking(message, booking):
+    """True if the message is just the booking fields, maybe wrapped in a polite request."""
+    if BOOKING_EXCLUDE_PATTERN.search(message):
+        return False
+    return only_filler(message[:booking.start()] + " " + message[booking.end():], BOOKING_FILLER)
+
+
+def is_plain_slots_request(message):
+    """True if the message only asks for one professional's slots."""
+    return not BOOKING_EXCLUDE_PATTERN.search(message) and only_filler(message, SLOTS_FILLER)
+
+
+class IntentRouter:
+    """
+    Local rule-based router run before Gemini.
+
+    Structured messages are translated straight into the same commands Gemini
+    is instructed to reply with (APPOINTMENT BOOK ..., PROFESSIONAL SLOT
+    NEEDED <id>, INFO: <endpoint>), so the handler can execute them without
+    an LLM round trip. Anything that doesn't clearly match returns None.
+    """
+
+    def __init__(self, info_endpoints=None):
+        self.info_endpoints = set(info_endpoints or [])
+        self.info_rules = [
+            (re.compile(pattern, re.IGNORECASE), endpoint)
+            for pattern, endpoint in INFO_RULES
+            if not self.info_endpoints or endpoint in self.info_endpoints
+        ]
+        self._lock = threading.Lock()
+        self.hits = {"book": 0, "slots": 0, "info": 0, "command": 0}
+        self.misses = 0
+
+    def route(self, message, user_id=None):
+        """Return a bot command for `message`, or None to fall back to Gemini."""
+        intent, command = self._match(message.strip(), user_id)
+        with self._lock:
+            if command is None:
+                self.misses += 1
+            else:
+                self.hits[intent] += 1
+        return command
+
+    def stats(self):
+        with self._lock:
+            return {"hits": dict(self.hits), "misses": self.misses}
+
+    def _match(self, message, user_id):
+        # Users occasionally paste a command verbatim
+        if COMMAND_PATTERN.match(message):
+            if not message.startswith("INFO:") or message.split("INFO: ", 1)[1] in self.info_endpoints:
+                return "command", message
+
+        pasted = PASTED_BOOKING_PATTERN.match(message)
+        if pasted:
+            if not user_id:
+                return None, None
+            return "command", "APPOINTMENT BOOK PROFESSIONAL ID {} DATESTART {} TIMESTART {} USERID {}".format(
+                *pasted.groups(), user_id
+            )
+
+        booking = BOOKING_PATTERN.search(message)
+        if booking:
+            if not user_id or not is_plain_booking(message, booking):
+                return None, None
+            professional_id, date_value, time_value = booking.groups()
+            date_start = normalize_date(date_value)
+            time_start = normalize_time(time_value)
+            if date_start and time_start:
+                return "book", (
+                    f"APPOINTMENT BOOK PROFESSIONAL ID {professional_id} "
+                    f"DATESTART {date_start} TIMESTART {time_start} USERID {user_id}"
+                )
+            return None, None
+
+        slots = SLOTS_PATTERN.search(message)
+        if slots:
+            if not is_plain_slots_request(message):
+                return None, None
+            professional_id = slots.group(1) or slots.group(2)
+            return "slots", f"PROFESSIONAL SLOT NEEDED {professional_id}"
+
+        for pattern, endpoint in self.info_rules:
+            if pattern.search(message):
+                return "info", f"INFO: {endpoint}"
+
+        return None, None
@@ -0,0 +1,140 @@
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import re
+import sys
+from datetime import datetime, timezone
+
+# Config
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()  # json | text
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+# Per-request fields (sender, message_sid, trace_id...) added to every record
+log_context = contextvars.ContextVar("log_context", default={})
+
+REDACTED = "[REDACTED]"
+REDACT_PATTERNS = (
+    (re.compile(r"(Bearer\s+)[A-Za-z0-9._~+/=-]+"), r"\1" + REDACTED),
+    # JWTs (the backend's access and refresh tokens)
+    (re.compile(r"eyJ[A-Za-z0-9_-]+\.[A-Za-z0-9_-]+\.[A-Za-z0-9_-]*"), REDACTED),
+    (
+        re.compile(r"""((?:(?:access_?|refresh_?|auth_?)?token|password|api_?key)["']?\s*[:=]\s*["']?)[^\s"',}]+""",
+                   re.IGNORECASE),
+        r"\1" + REDACTED,
+    ),
+)
+_secrets = set()
+
+# Attributes every LogRecord has; anything else was passed via `extra`
+_RECORD_ATTRS = set(logging.LogRecord("", 0, "", 0, "", (), None).__dict__) | {"message", "asctime", "taskName"}
+
+_listener = None
+queue_handler = None
+
+
+def register_secret(value):
+    """Redact this exact value (e.g. an API key read from the environment) wherever it is logged."""
+    if value and len(value) >= 6:
+        _secrets.add(value)
+
+
+def redact(text):
+    text = str(text)
+    for secret in _secrets:
+        if secret in text:
+            text = text.replace(secret, REDACTED)
+    for pattern, replacement in REDACT_PATTERNS:
+        text = pattern.sub(replacement, text)
+    return text
+
+
+def set_context(**fields):
+    """Start a fresh set of per-request fields for the current thread/task."""
+    log_context.set({k: v for k, v in fields.items() if v is not None})
+
+
+def bind(**fields):
+    """Add fields to the current per-request context."""
+    log_context.set({**log_context.get(), **{k: v for k, v in fields.items() if v is not None}})
+
+
+class ContextFilter(logging.Filter):
+    """Copies the per-request fields onto the record when it is logged (on the caller's thread)."""
+
+    def filter(self, record):
+        for key, value in log_context.get().items():
+            if not hasattr(record, key):
+                setattr(record, key, value)
+        return True
+
+
+def record_fields(record):
+    return {k: v for k, v in record.__dict__.items() if k not in _RECORD_ATTRS}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "message": redact(record.getMessage()),
+        }
+        for key, value in record_fields(record).items():
+            entry[key] = value if isinstance(value, (int, float, bool)) or value is None else redact(value)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        ts = datetime.fromtimestamp(record.created, timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+        fields = " ".join(f"{k}={v}" for k, v in record_fields(record).items())
+        line = f"{ts} {record.levelname:<7} {record.name}: {record.getMessage()}"
+        return redact(f"{line} {fields}" if fields else line)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that never blocks the caller: records are dropped when the queue is full."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging(level=LOG_LEVEL, fmt=LOG_FORMAT, queue_size=LOG_QUEUE_SIZE):
+    """
+    Route all logging through a bounded in-memory queue drained by one
+    background thread, so request threads never wait on stdout. The calling
+    thread still formats the message itself (QueueHandler.prepare merges the
+    arguments and renders any traceback); the JSON/text layout and redaction
+    happen on the listener thread. Safe to call more than once.
+    """
+    global _listener, queue_handler
+    if _listener is not None:
+        return queue_handler
+
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(TextFormatter() if fmt == "text" else JsonFormatter())
+
+    queue_handler = DroppingQueueHandler(queue.Queue(maxsize=queue_size))
+    queue_handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(queue_handler.queue, stream, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+    return queue_handler
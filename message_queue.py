@@ -0,0 +1,211 @@
+import functools
+import json
+import logging
+import os
+import queue
+import socket
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFull(Exception):
+    """Raised when a message can't be enqueued because the queue is at capacity."""
+
+
+class QueueBackend:
+    """
+    Interface for message queue backends.
+    `get` returns an item or None on timeout; `ack` is called once the item
+    has been processed so durable backends can forget it.
+    """
+
+    def put(self, item):
+        raise NotImplementedError
+
+    def get(self, timeout=1.0):
+        raise NotImplementedError
+
+    def ack(self, item):
+        pass
+
+    def size(self):
+        raise NotImplementedError
+
+    def requeue_unacked(self):
+        """Put back items a dead consumer took but never acked; returns how many."""
+        return 0
+
+
+class InMemoryQueueBackend(QueueBackend):
+    """Bounded in-process queue. Messages are lost if the process dies."""
+
+    def __init__(self, maxsize=1000):
+        self._queue = queue.Queue(maxsize=maxsize)
+
+    def put(self, item):
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            raise QueueFull()
+
+    def get(self, timeout=1.0):
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def size(self):
+        return self._queue.qsize()
+
+
+class RedisQueueBackend(QueueBackend):
+    """
+    Durable queue on a Redis list.
+    Items are moved atomically to this consumer's own processing list while
+    a worker handles them and removed on ack. Each consumer (process) keeps
+    a heartbeat key alive while it polls; `requeue_unacked` puts back the
+    items of every consumer whose heartbeat has expired, so messages survive
+    a worker crash or restart.
+    """
+
+    def __init__(self, client, key="twolio:messages", maxsize=1000, consumer=None, heartbeat_ttl=30):
+        self.client = client
+        self.key = key
+        self.consumer = consumer or f"{socket.gethostname()}:{os.getpid()}"
+        self.processing_key = f"{key}:processing:{self.consumer}"
+        self.maxsize = maxsize
+        self.heartbeat_ttl = heartbeat_ttl
+        self._heartbeat_at = 0.0
+        self._raw = {}
+        self._raw_lock = threading.Lock()
+
+    def put(self, item):
+        if self.maxsize and self.client.llen(self.key) >= self.maxsize:
+            raise QueueFull()
+        self.client.lpush(self.key, json.dumps(item))
+
+    def get(self, timeout=1.0):
+        self.heartbeat()
+        raw = self.client.blmove(self.key, self.processing_key, timeout, "RIGHT", "LEFT")
+        if raw is None:
+            return None
+        item = json.loads(raw)
+        with self._raw_lock:
+            self._raw[id(item)] = raw
+        return item
+
+    def ack(self, item):
+        with self._raw_lock:
+            raw = self._raw.pop(id(item), None)
+        if raw is not None:
+            self.client.lrem(self.processing_key, 1, raw)
+        self.heartbeat()
+
+    def size(self):
+        return self.client.llen(self.key)
+
+    def heartbeat(self):
+        """Mark this consumer alive (at most every third of `heartbeat_ttl`)."""
+        now = time.monotonic()
+        if now - self._heartbeat_at < self.heartbeat_ttl / 3:
+            return
+        self.client.set(self._heartbeat_key(self.consumer), 1, ex=self.heartbeat_ttl)
+        self._heartbeat_at = now
+
+    def requeue_unacked(self):
+        """Move items of consumers without a heartbeat back onto the queue, oldest first."""
+        self.heartbeat()
+        moved = 0
+        prefix = f"{self.key}:processing"
+        for raw_key in self.client.scan_iter(match=f"{prefix}*", count=100):
+            processing_key = raw_key.decode() if isinstance(raw_key, bytes) else raw_key
+            consumer = processing_key[len(prefix) + 1:]
+            if consumer and self.client.exists(self._heartbeat_key(consumer)):
+                continue
+            while self.client.lmove(processing_key, self.key, "RIGHT", "RIGHT") is not None:
+                moved += 1
+        return moved
+
+    def _heartbeat_key(self, consumer):
+        return f"{self.key}:consumer:{consumer}"
+
+
+def create_queue_backend(name, maxsize=1000, redis_url=None):
+    if name == "memory":
+        return InMemoryQueueBackend(maxsize=maxsize)
+    if name == "redis":
+        import redis
+        return RedisQueueBackend(redis.Redis.from_url(redis_url), maxsize=maxsize)
+    raise ValueError(f"Unknown queue backend: {name}")
+
+
+class WorkerPool:
+    """
+    Fixed number of daemon threads draining a queue backend into `handler`.
+    Items are acked once `handler(item)` returns. With `manual_ack` the
+    handler is called as `handler(item, ack)` and calls `ack()` itself when
+    the item is done with, possibly later and from another thread; if it
+    raises, the item is acked right away.
+    """
+
+    def __init__(self, backend, handler, concurrency=8, poll_timeout=1.0, manual_ack=False):
+        self.backend = backend
+        self.handler = handler
+        self.concurrency = concurrency
+        self.poll_timeout = poll_timeout
+        self.manual_ack = manual_ack
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        try:
+            recovered = self.backend.requeue_unacked()
+            if recovered:
+                logger.warning("Requeued unacked messages", extra={"messages": recovered})
+        except Exception as e:
+            logger.error("Failed to requeue unacked messages: %s", e)
+        for i in range(self.concurrency):
+            thread = threading.Thread(target=self._run, name=f"message-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, item):
+        self.backend.put(item)
+
+    def depth(self):
+        return self.backend.size()
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                item = self.backend.get(timeout=self.poll_timeout)
+            except Exception as e:
+                logger.error("Failed to read from message queue: %s", e)
+                self._stop.wait(self.poll_timeout)
+                continue
+            if item is None:
+                continue
+            ack = functools.partial(self._ack, item)
+            try:
+                if self.manual_ack:
+                    self.handler(item, ack)
+                else:
+                    self.handler(item)
+                    ack()
+            except Exception:
+                logger.exception("Error processing queued message")
+                ack()
+
+    def _ack(self, item):
+        try:
+            self.backend.ack(item)
+        except Exception as e:
+            logger.error("Failed to ack queued message: %s", e)
@@ -0,0 +1,160 @@
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Twilio rejects WhatsApp bodies of 1600+ characters
+MAX_MESSAGE_LENGTH = 1599
+
+# HTTP statuses worth retrying (rate limiting and server-side errors)
+TRANSIENT_STATUSES = {429, 500, 502, 503, 504}
+
+
+def split_message(text, max_len=MAX_MESSAGE_LENGTH):
+    """
+    Split text into chunks of at most max_len characters, preferring
+    paragraph breaks, then line breaks, then spaces. A break is only used if
+    it leaves at least half a chunk, so an early heading doesn't become a
+    message of its own. Only a single word longer than max_len is cut mid-word.
+    """
+    chunks = []
+    remaining = text.strip()
+    while len(remaining) > max_len:
+        window = remaining[:max_len + 1]
+        cut = -1
+        for separator in ("\n\n", "\n", " "):
+            found = window.rfind(separator)
+            if found >= max_len // 2:
+                cut = found
+                break
+            # No break in the second half: fall back to the latest one
+            cut = max(cut, found)
+        if cut <= 0:
+            cut = max_len
+        chunks.append(remaining[:cut].rstrip())
+        remaining = remaining[cut:].lstrip()
+    if remaining:
+        chunks.append(remaining)
+    return chunks
+
+
+def is_transient(error):
+    """Rate limits, 5xx responses and network errors are retried; anything else is not."""
+    status = getattr(error, "status", None) or getattr(error, "status_code", None)
+    if status is not None:
+        return status in TRANSIENT_STATUSES
+    return isinstance(error, (OSError, TimeoutError))
+
+
+def twiml_reply(chunks):
+    """TwiML document answering the webhook with one <Message> per chunk."""
+    from twilio.twiml.messaging_response import MessagingResponse
+
+    response = MessagingResponse()
+    for chunk in chunks:
+        response.message(chunk)
+    return str(response)
+
+
+class _Reply:
+    __slots__ = ("futures",)
+
+    def __init__(self):
+        self.futures = []
+
+
+class ReplySender:
+    """
+    Sends reply chunks through a thread pool.
+
+    Chunks for the same sender go out strictly in order, one at a time, while
+    different senders are served in parallel. Each chunk is retried with
+    exponential backoff on transient errors; if a chunk fails for good, the
+    rest of that reply is dropped so the user never gets a gap.
+    """
+
+    def __init__(self, send_fn, max_workers=8, attempts=3, backoff=0.5):
+        # send_fn(sender, body) sends one message
+        self.send_fn = send_fn
+        self.attempts = attempts
+        self.backoff = backoff
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="reply-sender")
+        self._pending = {}
+        self._lock = threading.Lock()
+        self.sent = 0
+        self.retries = 0
+        self.failures = 0
+
+    def send(self, sender, chunks, delay=0.0):
+        """
+        Queue the chunks of one reply. Returns one Future per chunk.
+        `delay` postpones the first chunk (e.g. to let an inline TwiML
+        message go out first).
+        """
+        reply = _Reply()
+        with self._lock:
+            queue = self._pending.get(sender)
+            start = queue is None
+            if start:
+                queue = self._pending[sender] = deque()
+            for i, chunk in enumerate(chunks):
+                future = Future()
+                reply.futures.append(future)
+                queue.append((chunk, future, reply, delay if i == 0 else 0.0))
+        if start and reply.futures:
+            self._executor.submit(self._drain, sender)
+        elif start:
+            with self._lock:
+                self._pending.pop(sender, None)
+        return reply.futures
+
+    def pending(self):
+        with self._lock:
+            return sum(len(q) for q in self._pending.values())
+
+    def _drain(self, sender):
+        while True:
+            with self._lock:
+                queue = self._pending[sender]
+                if not queue:
+                    del self._pending[sender]
+                    return
+                chunk, future, reply, delay = queue.popleft()
+
+            if future.done():
+                # An earlier chunk of this reply failed
+                continue
+            if delay:
+                # Don't hold a pool thread while waiting: put the chunk back
+                # and drain again once it's due. The sender stays in
+                # _pending, so later replies still queue up behind it.
+                with self._lock:
+                    self._pending[sender].appendleft((chunk, future, reply, 0.0))
+                timer = threading.Timer(delay, self._executor.submit, args=(self._drain, sender))
+                timer.daemon = True
+                timer.start()
+                return
+            try:
+                self._send_with_retry(sender, chunk)
+                future.set_result(True)
+            except Exception as e:
+                logger.error("Failed to send WhatsApp message: %s", e, extra={"sender": sender})
+                for pending in reply.futures:
+                    if not pending.done():
+                        pending.set_exception(e)
+
+    def _send_with_retry(self, sender, body):
+        for attempt in range(self.attempts):
+            try:
+                self.send_fn(sender, body)
+                self.sent += 1
+                return
+            except Exception as e:
+                if attempt == self.attempts - 1 or not is_transient(e):
+                    self.failures += 1
+                    raise
+                self.retries += 1
+                time.sleep(self.backoff * (2 ** attempt))
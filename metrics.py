@@ -0,0 +1,277 @@
+import bisect
+import contextvars
+import functools
+import inspect
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Config
+REQUEST_TRACING = os.getenv("REQUEST_TRACING", "false").lower() in ("1", "true", "yes")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (64, 256, 1024, 2048, 4096, 8192, 16384, 32768)
+
+# Trace ID of the message being handled, if tracing is on
+trace_id = contextvars.ContextVar("trace_id", default=None)
+
+
+def new_trace_id(value=None):
+    """Start a trace for the current request; returns the ID (None when tracing is off)."""
+    if not REQUEST_TRACING:
+        return None
+    value = value or uuid.uuid4().hex[:12]
+    trace_id.set(value)
+    return value
+
+
+def _label_key(labelnames, labels):
+    return tuple(str(labels.get(name, "")) for name in labelnames)
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ""
+    body = ",".join(f'{name}="{_escape(value)}"' for name, value in pairs)
+    return "{" + body + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._values = {}  # labels -> [bucket counts..., sum, count]
+
+    def observe(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            data = self._values.get(key)
+            if data is None:
+                data = self._values[key] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                data[index] += 1
+            data[-2] += value
+            data[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, data in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, data):
+                    cumulative += count
+                    labels = _format_labels(self.labelnames, key, [("le", _format_value(float(bound)))])
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _format_labels(self.labelnames, key, [("le", "+Inf")])
+                lines.append(f"{self.name}_bucket{labels} {data[-1]}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(float(data[-2]))}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {data[-1]}")
+        return lines
+
+
+class Gauge:
+    """Gauge read at scrape time: `fn` returns a number or a {label values tuple: number} dict."""
+
+    def __init__(self, name, help_text, fn, labelnames=(), kind="gauge"):
+        self.name = name
+        self.help = help_text
+        self.fn = fn
+        self.labelnames = tuple(labelnames)
+        self.kind = kind
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        try:
+            values = self.fn()
+        except Exception as e:
+            logger.warning("Failed to collect metric %s: %s", self.name, e)
+            return lines
+        if not isinstance(values, dict):
+            values = {(): values}
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class GaugeGroup:
+    """
+    Several gauges read from one `fn()` call per scrape. `fn` returns a
+    stats dict; each gauge is (name, help, field, kind) and shows no sample
+    when its field is missing.
+    """
+
+    def __init__(self, fn, gauges):
+        self.fn = fn
+        self.gauges = tuple(gauges)
+        self.name = tuple(name for name, _, _, _ in self.gauges)
+
+    def render(self):
+        try:
+            values = self.fn()
+        except Exception as e:
+            logger.warning("Failed to collect metrics %s: %s", ", ".join(self.name), e)
+            values = {}
+        lines = []
+        for name, help_text, field, kind in self.gauges:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            if field in values:
+                lines.append(f"{name} {_format_value(values[field])}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._add(Counter(name, help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(name, help_text, labelnames, buckets))
+
+    def gauge(self, name, help_text, fn, labelnames=(), kind="gauge"):
+        return self._add(Gauge(name, help_text, fn, labelnames, kind))
+
+    def gauge_group(self, fn, gauges):
+        return self._add(GaugeGroup(fn, gauges))
+
+    def render(self):
+        """Prometheus text exposition format."""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def _add(self, metric):
+        # Registering a name again replaces the earlier metric in place, so
+        # the ASGI app can point app.py's gauges at its own components
+        for i, existing in enumerate(self._metrics):
+            if existing.name == metric.name:
+                self._metrics[i] = metric
+                return metric
+        self._metrics.append(metric)
+        return metric
+
+
+registry = Registry()
+
+stage_latency = registry.histogram(
+    "twolio_stage_latency_seconds", "Latency of each message handling stage.", ("stage",)
+)
+stage_errors = registry.counter(
+    "twolio_stage_errors_total", "Failed calls per message handling stage.", ("stage",)
+)
+messages_total = registry.counter(
+    "twolio_messages_total", "Inbound WhatsApp messages by outcome.", ("outcome",)
+)
+prompt_tokens = registry.histogram(
+    "twolio_prompt_tokens", "Estimated tokens per Gemini prompt.", buckets=SIZE_BUCKETS
+)
+response_chars = registry.histogram(
+    "twolio_reply_chars", "Characters per reply sent to the user.", buckets=SIZE_BUCKETS
+)
+
+
+def record_error(stage):
+    stage_errors.inc(stage=stage)
+
+
+def _observe(stage, started):
+    elapsed = time.perf_counter() - started
+    stage_latency.observe(elapsed, stage=stage)
+    if REQUEST_TRACING:
+        logger.info("Stage timing", extra={"stage": stage, "ms": round(elapsed * 1000, 1)})
+
+
+@contextmanager
+def stage_timer(stage):
+    """Time a block as `stage`; an exception escaping it counts as an error."""
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        record_error(stage)
+        raise
+    finally:
+        _observe(stage, started)
+
+
+def timed(stage):
+    """Decorator version of stage_timer, for plain and coroutine functions."""
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with stage_timer(stage):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage_timer(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def register_caches(*caches):
+    """Expose the hit/miss counters of TTLCaches, labelled by cache name."""
+    for field in ("hits", "stale_hits", "misses"):
+        registry.gauge(
+            f"twolio_cache_{field}_total", f"Cache {field.replace('_', ' ')} per cache.",
+            lambda field=field: {(cache.name,): cache.stats()[field] for cache in caches},
+            ("cache",), kind="counter"
+        )
+
+
+def register_admission(limiter):
+    """Expose a Gemini AdmissionController (sync or async); registering again replaces it."""
+    registry.gauge_group(limiter.stats, (
+        ("twolio_gemini_in_flight", "Gemini calls running.", "in_flight", "gauge"),
+        ("twolio_gemini_queue_depth", "Gemini calls waiting for admission.", "queue_depth", "gauge"),
+        ("twolio_gemini_wait_seconds_avg", "Average wait for Gemini admission.", "wait_avg", "gauge"),
+        ("twolio_gemini_wait_seconds_max", "Longest wait for Gemini admission.", "wait_max", "gauge"),
+        ("twolio_gemini_shed_total", "Gemini calls shed by admission control.", "shed", "counter"),
+        ("twolio_gemini_rate_limited_total", "Gemini 429 responses.", "rate_limited", "counter"),
+    ))
@@ -0,0 +1,212 @@
+import json
+import os
+
+# Config
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "8000"))
+SYSTEM_INSTRUCTION_TOKEN_BUDGET = int(os.getenv("SYSTEM_INSTRUCTION_TOKEN_BUDGET", "16000"))
+
+# Fields kept for each dataset; everything else is left out of the prompt.
+USER_FIELDS = ("id", "name", "surname", "alias", "email", "phone_number", "groupId")
+PROFESSIONAL_FIELDS = ("id", "alias", "name", "surname", "specialization", "description", "status")
+APPOINTMENT_FIELDS = (
+    "id", "professionalId", "professional", "dateStart", "timeStart",
+    "dateEnd", "timeEnd", "status",
+)
+
+# Sections are filled in this order when the budget is tight; the ones at
+# the end are truncated first.
+SECTION_PRIORITY = ("user_info", "professionals", "appointments", "group_info")
+
+SECTION_TITLES = {
+    "user_info": "User Info",
+    "group_info": "Group Info",
+    "professionals": "Professionals List",
+    "appointments": "Appointments",
+}
+
+
+OMITTED_NOTE_TOKENS = 6
+
+
+def estimate_tokens(text):
+    """Rough token count (about 4 characters per token)."""
+    return (len(text) + 3) // 4
+
+
+def compact_value(value):
+    """Render a single value without quotes, Nones or whitespace padding."""
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "yes" if value else "no"
+    if isinstance(value, dict):
+        for key in ("alias", "name", "id"):
+            if value.get(key) not in (None, ""):
+                return compact_value(value[key])
+        return json.dumps(value, separators=(",", ":"), ensure_ascii=False)
+    if isinstance(value, (list, tuple)):
+        return ",".join(compact_value(v) for v in value if v not in (None, ""))
+    return " ".join(str(value).split())
+
+
+def unwrap(data, key):
+    """Return data[key] if data is a dict wrapping a single payload under `key`."""
+    if isinstance(data, dict) and isinstance(data.get(key), dict):
+        return data[key]
+    return data
+
+
+def record_rows(record, fields=None):
+    """One `key=value` row per kept field of a dict."""
+    if not isinstance(record, dict):
+        return [compact_value(record)] if record else []
+    keys = [f for f in fields if f in record] if fields else []
+    if not keys:
+        keys = list(record)
+    rows = []
+    for key in keys:
+        value = compact_value(record[key])
+        if value:
+            rows.append(f"{key}={value}")
+    return rows
+
+
+def table_rows(records, fields):
+    """
+    Render a list of dicts as a header line plus one `|`-separated row each.
+    Only whitelisted columns that have a value in at least one record are kept.
+    """
+    records = [r for r in (records or []) if isinstance(r, dict)]
+    if not records:
+        return None, []
+    columns = [f for f in fields if any(r.get(f) not in (None, "") for r in records)]
+    if not columns:
+        columns = [k for k in records[0] if not isinstance(records[0][k], (dict, list))]
+    header = "|".join(columns)
+    rows = ["|".join(compact_value(r.get(c)) for c in columns) for r in records]
+    return header, rows
+
+
+SECTION_ORDER = ("user_info", "group_info", "professionals", "appointments")
+STATIC_SECTIONS = ("group_info", "professionals")
+
+
+def _sections(user_info=None, group_info=None, professionals=None,
+              appointments=None, personal_appointments=None):
+    """Rows (and table header) for each data section."""
+    # Both appointment lists come from the same endpoint; send them once.
+    if personal_appointments and personal_appointments != appointments:
+        appointments = list(appointments or []) + [
+            a for a in personal_appointments if a not in (appointments or [])
+        ]
+
+    professionals_header, professionals_rows = table_rows(professionals, PROFESSIONAL_FIELDS)
+    appointments_header, appointments_rows = table_rows(appointments, APPOINTMENT_FIELDS)
+    return {
+        "user_info": (None, record_rows(unwrap(user_info, "user"), USER_FIELDS)),
+        "group_info": (None, record_rows(unwrap(group_info, "group"))),
+        "professionals": (professionals_header, professionals_rows),
+        "appointments": (appointments_header, appointments_rows),
+    }
+
+
+def _render(head, tail, sections, include, token_budget):
+    """
+    Assemble head + the included sections + tail within token_budget.
+    head and tail are always kept whole; sections are filled in
+    SECTION_PRIORITY order and rendered in SECTION_ORDER.
+    """
+    report = {}
+    remaining = token_budget
+    if head:
+        report["instruction"] = {"tokens": estimate_tokens(head), "rows": 1, "dropped": 0}
+        remaining -= report["instruction"]["tokens"]
+    if tail:
+        report["user_message"] = {"tokens": estimate_tokens(tail), "rows": 1, "dropped": 0}
+        remaining -= report["user_message"]["tokens"]
+
+    rendered = {}
+    for name in SECTION_PRIORITY:
+        if name not in include:
+            continue
+        header, rows = sections[name]
+        lines = [f"{SECTION_TITLES[name]}:"]
+        if header:
+            lines.append(header)
+        used = estimate_tokens("\n".join(lines) + "\n\n")
+        if not rows:
+            lines.append("none")
+            used += 1
+
+        kept = 0
+        for i, row in enumerate(rows):
+            cost = estimate_tokens(row + "\n")
+            # Keep room for the "(N more omitted)" line if rows remain after this one
+            reserve = OMITTED_NOTE_TOKENS if i < len(rows) - 1 else 0
+            if used + cost + reserve > remaining:
+                break
+            lines.append(row)
+            used += cost
+            kept += 1
+
+        dropped = len(rows) - kept
+        if dropped:
+            note = f"({dropped} more omitted)"
+            lines.append(note)
+            used += estimate_tokens(note + "\n")
+
+        remaining -= used
+        rendered[name] = "\n".join(lines)
+        report[name] = {"tokens": used, "rows": kept, "dropped": dropped}
+
+    parts = [head] if head else []
+    parts += [rendered[name] for name in SECTION_ORDER if name in rendered]
+    if tail:
+        parts.append(tail)
+    text = "\n\n".join(parts)
+    report["total"] = {
+        "tokens": estimate_tokens(text),
+        "rows": sum(r["rows"] for r in report.values()),
+        "dropped": sum(r["dropped"] for r in report.values()),
+    }
+    return text, report
+
+
+def build_prompt(instruction, user_message, user_info=None, group_info=None,
+                 professionals=None, appointments=None, personal_appointments=None,
+                 token_budget=PROMPT_TOKEN_BUDGET, include=SECTION_ORDER):
+    """
+    Build the Gemini prompt from the context datasets in a compact line format.
+
+    The instruction and the user message are always kept whole. The data
+    sections listed in `include` are then filled in SECTION_PRIORITY order
+    until the token budget is used up; rows that don't fit are dropped from
+    the end of the section and replaced with a "(N more omitted)" line, so
+    truncation is deterministic for the same input. Section titles are always
+    kept, so a fully truncated prompt can exceed the budget by a few tokens.
+    Pass an empty instruction when it is sent as a system instruction instead.
+
+    Returns (prompt, report) where report maps each section to its token
+    count, kept rows and dropped rows, plus a "total" entry.
+    """
+    sections = _sections(user_info, group_info, professionals, appointments, personal_appointments)
+    return _render(instruction, f"User: {user_message}", sections, include, token_budget)
+
+
+def build_system_instruction(instruction, group_info=None, professionals=None,
+                             token_budget=SYSTEM_INSTRUCTION_TOKEN_BUDGET, include=STATIC_SECTIONS):
+    """
+    Build the static part of the prompt (instruction plus, optionally, the
+    group info and professionals list) to be sent as a system instruction.
+    Pass include=() to send the instruction alone.
+    """
+    sections = _sections(group_info=group_info, professionals=professionals)
+    return _render(instruction, None, sections, include, token_budget)
+
+
+def format_report(report):
+    """One-line summary of a build_prompt / build_system_instruction report, e.g. for logs."""
+    return ", ".join(
+        f"{name}={r['tokens']}t" + (f"(-{r['dropped']})" if r["dropped"] else "")
+        for name, r in report.items()
+    )
@@ -0,0 +1,72 @@
+import hashlib
+import hmac
+import json
+import logging
+import os
+import re
+import secrets
+import time
+
+logger = logging.getLogger(__name__)
+
+# Message text that identifies a person is replaced before it is written
+BODY_REDACTIONS = (
+    (re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+"), "user@example.com"),
+    # Phone numbers, card and account numbers (dates and times have fewer digits in a row)
+    (re.compile(r"\+?\d[\d ]{7,}\d"), lambda m: "0" * len(m.group(0))),
+)
+
+
+def redact_body(body):
+    for pattern, replacement in BODY_REDACTIONS:
+        body = pattern.sub(replacement, body)
+    return body
+
+
+class WebhookRecorder:
+    """
+    Appends inbound webhook payloads to a JSONL file for replay (see
+    bench/replay.py), one compact line per request:
+
+        {"ts":1760000000.123,"from":"+999123456789","sid":"SM…","body":"…"}
+
+    Senders and MessageSids are replaced by keyed hashes, so a conversation
+    (and a Twilio retry of the same message) still replays as one, but the
+    real numbers can't be recovered. E-mail addresses and long digit runs in
+    the body are masked. Use the same `salt` on every worker so a sender maps
+    to the same pseudonym everywhere; without one, each process picks its own.
+
+    Each line is one O_APPEND write, so several workers can share a file.
+    """
+
+    def __init__(self, path, salt=None):
+        self.path = path
+        self._key = (salt or secrets.token_hex(16)).encode()
+        self._fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        self.recorded = 0
+        self.failures = 0
+        logger.info("Recording webhook traffic", extra={"path": path, "salted": salt is not None})
+
+    def pseudonym(self, value, digits=12):
+        digest = hmac.new(self._key, value.encode(), hashlib.sha256).hexdigest()
+        return str(int(digest, 16))[:digits]
+
+    def record(self, form):
+        """Record one webhook request. Never raises: a failed write only loses that line."""
+        try:
+            sender = form.get("From", "").replace("whatsapp:", "")
+            message_sid = form.get("MessageSid")
+            entry = {
+                "ts": round(time.time(), 3),
+                "from": "+999" + self.pseudonym(sender, 9),
+                "sid": "SM" + self.pseudonym(message_sid, 32) if message_sid else None,
+                "body": redact_body(form.get("Body", "")),
+            }
+            os.write(self._fd, (json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8"))
+            self.recorded += 1
+        except Exception as e:
+            self.failures += 1
+            logger.warning("Failed to record webhook: %s", e)
+
+    def close(self):
+        os.close(self._fd)
@@ -0,0 +1,465 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+
+class _Lane:
+    __slots__ = ("pending", "active", "waiting", "last_arrival", "cond")
+
+    def __init__(self, cond):
+        self.pending = []  # [(message, future, waited)] in arrival order
+        self.active = False
+        self.waiting = 0  # callers blocked in submit
+        self.last_arrival = 0.0
+        self.cond = cond
+
+
+class SenderQueue:
+    """
+    Handles the messages of each sender one batch at a time, in arrival order.
+
+    `submit` blocks the calling thread (webhook request) until its message
+    has been handled. The first caller of an idle sender drains that
+    sender's lane; messages that arrive meanwhile wait and are handled
+    together as the next batch, so a burst becomes one turn. With a
+    `window`, the drainer also waits until the sender has been quiet that
+    long (at most `max_wait`) before taking a batch. Different senders never
+    wait for each other.
+
+    `post` is the non-blocking form for queue workers: the message is handed
+    to the active drainer (or drained right away if the lane is idle) and
+    the reply of a batch ending with it goes to `deliver(sender, reply)`.
+    Its `done()` callback runs once the message's batch has been handled
+    and delivered (or has failed), so a durable queue can ack it then.
+
+    `handler(sender, messages)` returns the reply for the whole batch.
+    `submit` returns (reply, last): only the caller holding the batch's last
+    message has last=True and should send the reply.
+    """
+
+    def __init__(self, handler, window=0.0, max_wait=5.0, max_batch=10, deliver=None):
+        self.handler = handler
+        self.deliver = deliver
+        self.window = window
+        self.max_wait = max_wait
+        self.max_batch = max_batch
+        self._lock = threading.Lock()
+        self._lanes = {}
+        self.batches = 0
+        self.merged = 0
+
+    def submit(self, sender, message):
+        return self._enqueue(sender, message, True).result()
+
+    def post(self, sender, message, done=None):
+        self._enqueue(sender, message, False, done)
+
+    def stats(self):
+        with self._lock:
+            return {"senders": len(self._lanes), "batches": self.batches, "merged": self.merged}
+
+    def _enqueue(self, sender, message, waited, done=None):
+        future = Future()
+        if done is not None:
+            future.add_done_callback(lambda _: done())
+        with self._lock:
+            lane = self._lanes.get(sender)
+            if lane is None:
+                lane = self._lanes[sender] = _Lane(threading.Condition(self._lock))
+            lane.pending.append((message, future, waited))
+            lane.last_arrival = time.monotonic()
+            lane.cond.notify_all()
+            if waited:
+                # Wait until our message is handled, or the lane is free to drain
+                lane.waiting += 1
+                while not future.done() and lane.active:
+                    lane.cond.wait()
+                lane.waiting -= 1
+                if future.done():
+                    return future
+            elif lane.active:
+                # The active drainer takes it with its next batch
+                return future
+            lane.active = True
+
+        try:
+            while True:
+                with self._lock:
+                    # Once our own message is done, a blocked caller takes over;
+                    # posted messages have nobody waiting, so they are drained here
+                    if not lane.pending or (future.done() and lane.waiting):
+                        break
+                self._handle_next_batch(sender, lane)
+        finally:
+            with self._lock:
+                lane.active = False
+                if not lane.pending:
+                    self._lanes.pop(sender, None)
+                lane.cond.notify_all()
+        return future
+
+    def _handle_next_batch(self, sender, lane):
+        with self._lock:
+            if self.window > 0:
+                started = time.monotonic()
+                while True:
+                    now = time.monotonic()
+                    remaining = min(self.window - (now - lane.last_arrival), self.max_wait - (now - started))
+                    if remaining <= 0:
+                        break
+                    lane.cond.wait(remaining)
+            batch = lane.pending[:self.max_batch]
+            del lane.pending[:self.max_batch]
+            self.batches += 1
+            self.merged += len(batch) - 1
+
+        try:
+            reply = self.handler(sender, [message for message, _, _ in batch])
+        except Exception as e:
+            for _, future, _ in batch:
+                future.set_exception(e)
+            if not batch[-1][2]:
+                logger.exception("Error handling queued messages")
+        else:
+            try:
+                if not batch[-1][2] and self.deliver is not None:
+                    self.deliver(sender, reply)
+            finally:
+                # After delivery, so a posted message is only done once its reply went out
+                for i, (_, future, _) in enumerate(batch):
+                    future.set_result((reply, i == len(batch) - 1))
+
+        with self._lock:
+            lane.cond.notify_all()
+
+
+class AsyncSenderQueue:
+    """asyncio version of SenderQueue; `handler` is a coroutine function."""
+
+    def __init__(self, handler, window=0.0, max_wait=5.0, max_batch=10):
+        self.handler = handler
+        self.window = window
+        self.max_wait = max_wait
+        self.max_batch = max_batch
+        self._lanes = {}
+        self.batches = 0
+        self.merged = 0
+
+    async def submit(self, sender, message):
+        future = asyncio.get_running_loop().create_future()
+        lane = self._lanes.get(sender)
+        if lane is None:
+            lane = self._lanes[sender] = _Lane(asyncio.Condition())
+        async with lane.cond:
+            lane.pending.append((message, future, True))
+            lane.last_arrival = time.monotonic()
+            lane.cond.notify_all()
+            await lane.cond.wait_for(lambda: future.done() or not lane.active)
+            if future.done():
+                return future.result()
+            lane.active = True
+
+        try:
+            while not future.done():
+                await self._handle_next_batch(sender, lane)
+        finally:
+            async with lane.cond:
+                lane.active = False
+                if not lane.pending:
+                    self._lanes.pop(sender, None)
+                lane.cond.notify_all()
+        return future.result()
+
+    def stats(self):
+        return {"senders": len(self._lanes), "batches": self.batches, "merged": self.merged}
+
+    async def _handle_next_batch(self, sender, lane):
+        async with lane.cond:
+            if self.window > 0:
+                started = time.monotonic()
+                while True:
+                    now = time.monotonic()
+                    remaining = min(self.window - (now - lane.last_arrival), self.max_wait - (now - started))
+                    if remaining <= 0:
+                        break
+                    try:
+                        await asyncio.wait_for(lane.cond.wait(), remaining)
+                    except asyncio.TimeoutError:
+                        pass
+            batch = lane.pending[:self.max_batch]
+            del lane.pending[:self.max_batch]
+            self.batches += 1
+            self.merged += len(batch) - 1
+
+        try:
+            reply = await self.handler(sender, [message for message, _, _ in batch])
+        except Exception as e:
+            for _, future, _ in batch:
+                future.set_exception(e)
+        else:
+            for i, (_, future, _) in enumerate(batch):
+                future.set_result((reply, i == len(batch) - 1))
+
+        async with lane.cond:
+            lane.cond.notify_all()
+
+
+class RedisSenderQueue:
+    """
+    SenderQueue shared by every worker/process through Redis, so a sender's
+    messages never run in parallel (nor out of order) even when they reach
+    different gunicorn workers, and a burst split across them still merges.
+
+    Each sender's lane is a Redis list. Whoever holds the sender's lock
+    drains it batch by batch and pushes every waiting caller its result;
+    once its own message is answered it hands the lock to the caller of the
+    next one. Waiting callers also retry the lock every `poll_interval`
+    seconds, in case the drainer died. The lock expires after `lock_ttl`,
+    which must exceed the longest batch. Messages and replies must be JSON.
+    A posted message is `done()` once it is in the lane: from then on it is
+    kept in Redis like the webhook queue itself.
+    """
+
+    def __init__(self, handler, client, prefix="twolio:lane:", window=0.0, max_wait=5.0, max_batch=10,
+                 deliver=None, ttl=3600, lock_ttl=120, poll_interval=0.2):
+        self.handler = handler
+        self.client = client
+        self.prefix = prefix
+        self.window = window
+        self.max_wait = max_wait
+        self.max_batch = max_batch
+        self.deliver = deliver
+        self.ttl = ttl
+        self.lock_ttl = lock_ttl
+        self.poll_interval = poll_interval
+        self.batches = 0
+        self.merged = 0
+
+    def submit(self, sender, message):
+        item_id = self._push(sender, message, True)
+        while True:
+            answered = self._drain(sender, item_id)
+            result = self._result(item_id, self.poll_interval)
+            if result is None and answered is False:
+                raise RuntimeError("Message was lost from the sender lane")
+            if result is not None and "drain" not in result:
+                return self._unpack(result)
+
+    def post(self, sender, message, done=None):
+        self._push(sender, message, False)
+        if done is not None:
+            done()
+        self._drain(sender)
+
+    def stats(self):
+        return {"batches": self.batches, "merged": self.merged}
+
+    def _drain(self, sender, until=None):
+        """
+        Drain the lane if its lock is free. Returns None if another caller
+        holds it, else whether the message `until` was in a drained batch.
+        """
+        answered = None
+        while True:
+            lock = self._acquire(sender)
+            if lock is None:
+                return answered
+            handoff = None
+            try:
+                answered = bool(answered)
+                while self.client.llen(self._key(sender)):
+                    self._wait_quiet(sender)
+                    batch = self._take(sender)
+                    self._finish(sender, batch, self._call(sender, batch))
+                    answered = answered or any(item["id"] == until for item in batch)
+                    if answered:
+                        # Posted messages have nobody waiting, so they are drained here
+                        handoff = self._next_waiting(sender)
+                        if handoff is not None:
+                            break
+            finally:
+                self._release(lock)
+            if handoff is not None:
+                self._wake(handoff)
+                return answered
+            # Catch a message pushed just before the lock was released
+            if not self.client.llen(self._key(sender)):
+                return answered
+
+    def _call(self, sender, batch):
+        try:
+            return True, self.handler(sender, [item["message"] for item in batch])
+        except Exception as e:
+            return False, e
+
+    # Redis operations, shared with AsyncRedisSenderQueue
+
+    def _key(self, sender):
+        return f"{self.prefix}{sender}"
+
+    def _result_key(self, item_id):
+        return f"{self.prefix}result:{item_id}"
+
+    def _push(self, sender, message, waited):
+        item_id = uuid.uuid4().hex
+        key = self._key(sender)
+        pipe = self.client.pipeline(transaction=True)
+        pipe.rpush(key, json.dumps({"id": item_id, "message": message, "waited": waited}))
+        pipe.expire(key, self.ttl)
+        pipe.set(f"{key}:arrival", time.time(), ex=self.ttl)
+        pipe.execute()
+        return item_id
+
+    def _acquire(self, sender):
+        lock = self.client.lock(f"{self._key(sender)}:lock", timeout=self.lock_ttl, thread_local=False)
+        return lock if lock.acquire(blocking=False) else None
+
+    def _release(self, lock):
+        try:
+            lock.release()
+        except Exception as e:
+            # Expired after `lock_ttl`; nothing left to release
+            logger.warning("Sender lane lock already released: %s", e)
+
+    def _quiet_remaining(self, sender, started):
+        """Seconds the drainer should still wait for the sender to go quiet."""
+        if self.window <= 0:
+            return 0
+        arrival = float(self.client.get(f"{self._key(sender)}:arrival") or 0)
+        return min(self.window - (time.time() - arrival), self.max_wait - (time.monotonic() - started))
+
+    def _wait_quiet(self, sender):
+        started = time.monotonic()
+        while True:
+            remaining = self._quiet_remaining(sender, started)
+            if remaining <= 0:
+                return
+            time.sleep(min(remaining, self.poll_interval))
+
+    def _take(self, sender):
+        pipe = self.client.pipeline(transaction=True)
+        pipe.lrange(self._key(sender), 0, self.max_batch - 1)
+        pipe.ltrim(self._key(sender), self.max_batch, -1)
+        return [json.loads(raw) for raw in pipe.execute()[0]]
+
+    def _next_waiting(self, sender):
+        raw = self.client.lindex(self._key(sender), 0)
+        if raw is None:
+            return None
+        item = json.loads(raw)
+        return item["id"] if item["waited"] else None
+
+    def _finish(self, sender, batch, outcome):
+        """Push each waiting caller its result; the reply of a posted last message goes to `deliver`."""
+        ok, value = outcome
+        self.batches += 1
+        self.merged += len(batch) - 1
+        pipe = self.client.pipeline(transaction=False)
+        for i, item in enumerate(batch):
+            if item["waited"]:
+                result = {"reply": value, "last": i == len(batch) - 1} if ok else {"error": str(value)}
+                pipe.rpush(self._result_key(item["id"]), json.dumps(result))
+                pipe.expire(self._result_key(item["id"]), self.ttl)
+        pipe.execute()
+        if batch[-1]["waited"]:
+            return
+        if not ok:
+            logger.error("Error handling queued messages: %s", value)
+        elif self.deliver is not None:
+            self.deliver(sender, value)
+
+    def _wake(self, item_id):
+        """Hand the lane to the caller waiting for `item_id`."""
+        self.client.rpush(self._result_key(item_id), json.dumps({"drain": True}))
+        self.client.expire(self._result_key(item_id), self.ttl)
+
+    def _result(self, item_id, timeout):
+        if timeout:
+            raw = self.client.blpop(self._result_key(item_id), timeout=timeout)
+            raw = raw[1] if raw is not None else None
+        else:
+            raw = self.client.lpop(self._result_key(item_id))
+        return json.loads(raw) if raw is not None else None
+
+    @staticmethod
+    def _unpack(result):
+        if "error" in result:
+            raise RuntimeError(result["error"])
+        return result["reply"], result["last"]
+
+
+class AsyncRedisSenderQueue(RedisSenderQueue):
+    """asyncio version of RedisSenderQueue; `handler` is a coroutine function. Results are polled."""
+
+    async def submit(self, sender, message):
+        item_id = await asyncio.to_thread(self._push, sender, message, True)
+        while True:
+            answered = await self._drain(sender, item_id)
+            result = await asyncio.to_thread(self._result, item_id, 0)
+            if result is None:
+                if answered is False:
+                    raise RuntimeError("Message was lost from the sender lane")
+                await asyncio.sleep(self.poll_interval)
+            elif "drain" not in result:
+                return self._unpack(result)
+
+    async def _drain(self, sender, until=None):
+        answered = None
+        while True:
+            lock = await asyncio.to_thread(self._acquire, sender)
+            if lock is None:
+                return answered
+            handoff = None
+            try:
+                answered = bool(answered)
+                while await asyncio.to_thread(self.client.llen, self._key(sender)):
+                    started = time.monotonic()
+                    while True:
+                        remaining = await asyncio.to_thread(self._quiet_remaining, sender, started)
+                        if remaining <= 0:
+                            break
+                        await asyncio.sleep(min(remaining, self.poll_interval))
+                    batch = await asyncio.to_thread(self._take, sender)
+                    await asyncio.to_thread(self._finish, sender, batch, await self._call(sender, batch))
+                    answered = answered or any(item["id"] == until for item in batch)
+                    if answered:
+                        handoff = await asyncio.to_thread(self._next_waiting, sender)
+                        if handoff is not None:
+                            break
+            finally:
+                await asyncio.to_thread(self._release, lock)
+            if handoff is not None:
+                await asyncio.to_thread(self._wake, handoff)
+                return answered
+            if not await asyncio.to_thread(self.client.llen, self._key(sender)):
+                return answered
+
+    async def _call(self, sender, batch):
+        try:
+            return True, await self.handler(sender, [item["message"] for item in batch])
+        except Exception as e:
+            return False, e
+
+
+def create_sender_queue(name, handler, window=0.0, max_wait=5.0, max_batch=10, deliver=None, client=None):
+    if name == "memory":
+        return SenderQueue(handler, window=window, max_wait=max_wait, max_batch=max_batch, deliver=deliver)
+    if name == "redis":
+        return RedisSenderQueue(
+            handler, client, window=window, max_wait=max_wait, max_batch=max_batch, deliver=deliver
+        )
+    raise ValueError(f"Unknown sender queue backend: {name}")
+
+
+def create_async_sender_queue(name, handler, window=0.0, max_wait=5.0, max_batch=10, client=None):
+    if name == "memory":
+        return AsyncSenderQueue(handler, window=window, max_wait=max_wait, max_batch=max_batch)
+    if name == "redis":
+        return AsyncRedisSenderQueue(handler, client, window=window, max_wait=max_wait, max_batch=max_batch)
+    raise ValueError(f"Unknown sender queue backend: {name}")
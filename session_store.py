@@ -0,0 +1,257 @@
+import json
+import math
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+# Config
+SESSION_TTL = 30 * 24 * 3600
+SESSION_MAX_ENTRIES = 10000
+
+
+class SenderSession:
+    """Everything the bot remembers about one sender."""
+
+    __slots__ = ("instruction", "registration_state", "registration_data", "expires_at")
+    FIELDS = ("instruction", "registration_state", "registration_data")
+
+    def __init__(self, instruction=None, registration_state=None, registration_data=None, expires_at=0.0):
+        self.instruction = instruction
+        self.registration_state = registration_state
+        self.registration_data = registration_data
+        self.expires_at = expires_at
+
+    def is_empty(self):
+        return all(getattr(self, field) is None for field in self.FIELDS)
+
+    def copy(self):
+        return SenderSession(
+            self.instruction,
+            self.registration_state,
+            dict(self.registration_data) if self.registration_data is not None else None,
+            self.expires_at,
+        )
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+    def size_bytes(self):
+        size = sys.getsizeof(self)
+        for field in self.FIELDS:
+            value = getattr(self, field)
+            if value is not None:
+                size += sys.getsizeof(value)
+                if isinstance(value, dict):
+                    size += sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in value.items())
+        return size
+
+    def __repr__(self):
+        return f"SenderSession({self.to_dict()!r})"
+
+
+class SessionStore:
+    """
+    Interface for per-sender session storage.
+    `update` changes only the given fields and renews the entry's TTL, never
+    shortening it: a short-lived update (e.g. a registration step) doesn't
+    cut the life of the rest of the session. Setting every field to None
+    removes the entry.
+    `merge_registration_data` updates single keys of registration_data in
+    the same atomic step, so concurrent writers don't drop each other's keys.
+    """
+
+    def get(self, sender):
+        raise NotImplementedError
+
+    def update(self, sender, ttl=None, **fields):
+        raise NotImplementedError
+
+    def merge_registration_data(self, sender, values, ttl=None, **fields):
+        raise NotImplementedError
+
+    def delete(self, sender):
+        raise NotImplementedError
+
+    def stats(self):
+        return {}
+
+
+class InMemorySessionStore(SessionStore):
+    """Process-local store with per-entry TTL and an LRU size cap."""
+
+    def __init__(self, maxsize=SESSION_MAX_ENTRIES, ttl=SESSION_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, sender):
+        """Return a copy of the sender's session, or None."""
+        with self._lock:
+            session = self._live(sender, time.time())
+            if session is None:
+                return None
+            self._data.move_to_end(sender)
+            return session.copy()
+
+    def update(self, sender, ttl=None, **fields):
+        return self._update(sender, ttl, None, fields)
+
+    def merge_registration_data(self, sender, values, ttl=None, **fields):
+        return self._update(sender, ttl, values, fields)
+
+    def _update(self, sender, ttl, merge, fields):
+        unknown = set(fields) - set(SenderSession.FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown session fields: {', '.join(sorted(unknown))}")
+
+        now = time.time()
+        with self._lock:
+            session = self._live(sender, now) or SenderSession()
+            if merge is not None:
+                session.registration_data = dict(session.registration_data or {}, **merge)
+            for field, value in fields.items():
+                setattr(session, field, value)
+            if session.is_empty():
+                self._data.pop(sender, None)
+                return None
+
+            session.expires_at = max(session.expires_at, now + (self.ttl if ttl is None else ttl))
+            self._data[sender] = session
+            self._data.move_to_end(sender)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+            return session.copy()
+
+    def delete(self, sender):
+        with self._lock:
+            self._data.pop(sender, None)
+
+    def purge_expired(self):
+        """Remove every expired entry; returns how many were removed."""
+        now = time.time()
+        with self._lock:
+            expired = [sender for sender, session in self._data.items() if session.expires_at <= now]
+            for sender in expired:
+                del self._data[sender]
+            self.expirations += len(expired)
+            return len(expired)
+
+    def stats(self):
+        self.purge_expired()
+        with self._lock:
+            return {
+                "backend": "memory",
+                "entries": len(self._data),
+                "maxsize": self.maxsize,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "approx_bytes": sys.getsizeof(self._data) + sum(
+                    sys.getsizeof(sender) + session.size_bytes() for sender, session in self._data.items()
+                ),
+            }
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+    def _live(self, sender, now):
+        # Called with self._lock held
+        session = self._data.get(sender)
+        if session is not None and session.expires_at <= now:
+            del self._data[sender]
+            self.expirations += 1
+            return None
+        return session
+
+
+class RedisSessionStore(SessionStore):
+    """
+    Session store shared by every worker and instance.
+
+    Each sender is one Redis hash (JSON-encoded fields) with a key TTL.
+    Updates run as one MULTI/EXEC transaction, so concurrent updates for the
+    same sender never interleave; merges into registration_data WATCH the key
+    and retry if another writer got in between. A hash whose fields are all
+    cleared simply disappears. Works with any redis-py compatible client
+    (e.g. fakeredis).
+    """
+
+    def __init__(self, client, prefix="twolio:session:", ttl=SESSION_TTL):
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+
+    def get(self, sender):
+        return self._decode(self.client.hgetall(self._key(sender)))
+
+    def update(self, sender, ttl=None, **fields):
+        unknown = set(fields) - set(SenderSession.FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown session fields: {', '.join(sorted(unknown))}")
+
+        key = self._key(sender)
+        pipe = self.client.pipeline(transaction=True)
+        self._write(pipe, key, ttl, fields)
+        return self._decode(pipe.execute()[-1])
+
+    def merge_registration_data(self, sender, values, ttl=None, **fields):
+        unknown = set(fields) - set(SenderSession.FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown session fields: {', '.join(sorted(unknown))}")
+
+        key = self._key(sender)
+
+        def merge(pipe):
+            raw = pipe.hget(key, "registration_data")
+            data = dict(json.loads(raw) if raw else {}, **values)
+            pipe.multi()
+            self._write(pipe, key, ttl, dict(fields, registration_data=data))
+
+        return self._decode(self.client.transaction(merge, key)[-1])
+
+    def delete(self, sender):
+        self.client.delete(self._key(sender))
+
+    def stats(self):
+        # Counting entries would mean a full SCAN of the keyspace on every call
+        return {"backend": "redis"}
+
+    def _key(self, sender):
+        return f"{self.prefix}{sender}"
+
+    def _write(self, pipe, key, ttl, fields):
+        to_set = {field: json.dumps(value) for field, value in fields.items() if value is not None}
+        to_delete = [field for field, value in fields.items() if value is None]
+        if to_set:
+            pipe.hset(key, mapping=to_set)
+        if to_delete:
+            pipe.hdel(key, *to_delete)
+        seconds = max(1, math.ceil(self.ttl if ttl is None else ttl))
+        # Set a TTL on a new key, otherwise only ever extend it (Redis >= 7.0)
+        pipe.expire(key, seconds, nx=True)
+        pipe.expire(key, seconds, gt=True)
+        pipe.hgetall(key)
+
+    @staticmethod
+    def _decode(raw):
+        if not raw:
+            return None
+        fields = {}
+        for field, value in raw.items():
+            field = field.decode() if isinstance(field, bytes) else field
+            if field in SenderSession.FIELDS:
+                fields[field] = json.loads(value)
+        return SenderSession(**fields)
+
+
+def create_session_store(name, maxsize=SESSION_MAX_ENTRIES, ttl=SESSION_TTL, client=None):
+    if name == "memory":
+        return InMemorySessionStore(maxsize=maxsize, ttl=ttl)
+    if name == "redis":
+        return RedisSessionStore(client, ttl=ttl)
+    raise ValueError(f"Unknown session store backend: {name}")
@@ -0,0 +1,159 @@
+import bisect
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+def slot_key(time_str):
+    """Normalise a slot time ("10:00", "10:00:00") to the HH:MM used for bookings."""
+    return str(time_str).strip()[:5]
+
+
+class SlotIndex:
+    """
+    Available slots of one professional, indexed as date -> sorted times.
+
+    Built once from the raw /slots JSON ({date: [times]}) so listing the
+    slots doesn't re-sort anything, checking a single slot is a dict and
+    set lookup, and a successful booking can remove its slot in place
+    instead of refetching the whole availability.
+    """
+
+    def __init__(self, slots_data=None):
+        self._lock = threading.Lock()
+        self._times = {}  # date -> sorted list of times as returned by the API
+        self._keys = {}   # date -> set of HH:MM keys, for is_free
+        # Every date the API answered for, including fully booked ones
+        self._known = set((slots_data or {}).keys())
+        for date, times in (slots_data or {}).items():
+            unique = sorted(set(times or []))
+            if unique:
+                self._times[date] = unique
+                self._keys[date] = {slot_key(t) for t in unique}
+        self._dates = sorted(self._times)
+
+    def is_free(self, date, time_str):
+        """True/False, or None for a date the API didn't return (e.g. outside its range)."""
+        with self._lock:
+            if date not in self._known:
+                return None
+            return slot_key(time_str) in self._keys.get(date, ())
+
+    def remove(self, date, time_str):
+        """Mark a slot as taken. Returns True if it was listed as free."""
+        key = slot_key(time_str)
+        with self._lock:
+            if key not in self._keys.get(date, ()):
+                return False
+            self._keys[date].discard(key)
+            self._times[date] = [t for t in self._times[date] if slot_key(t) != key]
+            if not self._times[date]:
+                del self._times[date]
+                del self._keys[date]
+                self._dates.pop(bisect.bisect_left(self._dates, date))
+            return True
+
+    def times(self, date):
+        with self._lock:
+            return list(self._times.get(date, ()))
+
+    def items(self):
+        """(date, sorted times) pairs in date order."""
+        with self._lock:
+            return [(date, list(self._times[date])) for date in self._dates]
+
+    def to_dict(self):
+        return dict(self.items())
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(times) for times in self._times.values())
+
+    def __bool__(self):
+        with self._lock:
+            return bool(self._dates)
+
+
+class SlotLocks:
+    """
+    Short per-slot locks held around a booking POST, so two senders in this
+    process can't race for the same slot. `acquire` waits up to `wait`
+    seconds; a waiter that gets the lock should re-check the slot first.
+    """
+
+    def __init__(self, wait=5.0):
+        self.wait = wait
+        self._lock = threading.Lock()
+        self._locks = {}  # key -> [Lock, number of holders + waiters]
+        self.contended = 0
+
+    def acquire(self, key, wait=None):
+        with self._lock:
+            entry = self._locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        if entry[0].acquire(blocking=False):
+            return True
+        self.contended += 1
+        if entry[0].acquire(timeout=self.wait if wait is None else wait):
+            return True
+        self._unref(key, entry)
+        return False
+
+    def release(self, key):
+        with self._lock:
+            entry = self._locks[key]
+        entry[0].release()
+        self._unref(key, entry)
+
+    def _unref(self, key, entry):
+        with self._lock:
+            entry[1] -= 1
+            if entry[1] == 0:
+                self._locks.pop(key, None)
+
+
+class RedisSlotLocks:
+    """SlotLocks shared by every worker/process through Redis locks."""
+
+    def __init__(self, client, prefix="twolio:slot_lock:", ttl=30, wait=5.0):
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+        self.wait = wait
+        self._held = {}
+        self.contended = 0
+
+    def acquire(self, key, wait=None):
+        lock = self.client.lock(
+            f"{self.prefix}{key}", timeout=self.ttl,
+            blocking_timeout=self.wait if wait is None else wait,
+            # The async app releases from a different worker thread
+            thread_local=False
+        )
+        if lock.acquire(blocking=False):
+            self._held[key] = lock
+            return True
+        self.contended += 1
+        if lock.acquire():
+            self._held[key] = lock
+            return True
+        return False
+
+    def release(self, key):
+        lock = self._held.pop(key, None)
+        if lock is None:
+            return
+        try:
+            lock.release()
+        except Exception as e:
+            # Expired after `ttl`; nothing left to release
+            logger.warning("Slot lock %s already released: %s", key, e)
+
+
+def create_slot_locks(name, wait=5.0, ttl=30, client=None):
+    if name == "memory":
+        return SlotLocks(wait=wait)
+    if name == "redis":
+        return RedisSlotLocks(client, ttl=ttl, wait=wait)
+    raise ValueError(f"Unknown slot lock backend: {name}")
@@ -0,0 +1,84 @@
+import builtins
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Config
+STARTUP_PROFILE = os.getenv("STARTUP_PROFILE", "false").lower() in ("1", "true", "yes")
+
+_started = time.perf_counter()
+_lock = threading.Lock()
+_original_import = builtins.__import__
+# Import nesting per thread: only outermost imports are timed
+_depth = threading.local()
+_reported = False
+# Set by an entry module that imports app.py and calls report() itself
+deferred = False
+
+# (component, seconds) for each timed import and init step, in completion order
+timings = []
+
+
+def record(component, seconds):
+    if not STARTUP_PROFILE:
+        return
+    with _lock:
+        timings.append((component, seconds))
+        late = _reported
+    if late:
+        # Lazy initialization after startup: log it as it happens
+        logger.info("Initialized %s", component, extra={"component": component, "ms": round(seconds * 1000, 1)})
+
+
+@contextmanager
+def step(component):
+    """Time an initialization step; imports made inside it count towards the step."""
+    started = time.perf_counter()
+    depth = getattr(_depth, "value", 0)
+    _depth.value = depth + 1
+    try:
+        yield
+    finally:
+        _depth.value = depth
+        record(component, time.perf_counter() - started)
+
+
+def _timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+    depth = getattr(_depth, "value", 0)
+    if depth or level or name in sys.modules:
+        return _original_import(name, globals, locals, fromlist, level)
+    _depth.value = 1
+    started = time.perf_counter()
+    try:
+        return _original_import(name, globals, locals, fromlist, level)
+    finally:
+        _depth.value = 0
+        record(f"import {name}", time.perf_counter() - started)
+
+
+def report():
+    """
+    Log the startup profile: every top-level import and init step, slowest
+    first, and the total since this module was imported. Steps finishing
+    later (lazy clients, warm-up) are logged one by one as they happen.
+    """
+    global _reported
+    if not STARTUP_PROFILE or _reported:
+        return
+    builtins.__import__ = _original_import
+    total = time.perf_counter() - _started
+    with _lock:
+        _reported = True
+        steps = sorted(timings, key=lambda item: item[1], reverse=True)
+    for component, seconds in steps:
+        logger.info("Startup step %s", component, extra={"component": component, "ms": round(seconds * 1000, 1)})
+    logger.info("Startup finished", extra={"ms": round(total * 1000, 1), "steps": len(steps)})
+
+
+if STARTUP_PROFILE:
+    builtins.__import__ = _timed_import
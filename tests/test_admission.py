@@ -0,0 +1,98 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from admission import AdmissionController, AsyncAdmissionController, Overloaded
+
+
+class RateLimited(Exception):
+    code = 429
+
+
+def hold(controller, release, started):
+    def run():
+        started.release()
+        release.wait(5)
+    return threading.Thread(target=controller.call, args=(run,), daemon=True)
+
+
+def test_calls_beyond_the_queue_are_shed():
+    controller = AdmissionController(max_concurrency=1, max_queue=1, max_wait=5)
+    release = threading.Event()
+    started = threading.Semaphore(0)
+    running = hold(controller, release, started)
+    running.start()
+    started.acquire()
+    waiting = hold(controller, release, started)
+    waiting.start()
+    while controller.stats()["queue_depth"] < 1:
+        time.sleep(0.01)
+
+    with pytest.raises(Overloaded):
+        controller.call(lambda: None)
+    release.set()
+    running.join(5)
+    waiting.join(5)
+
+    stats = controller.stats()
+    assert (stats["admitted"], stats["shed"], stats["in_flight"]) == (2, 1, 0)
+
+
+def test_waiters_are_shed_after_max_wait():
+    controller = AdmissionController(max_concurrency=1, max_queue=4, max_wait=0.1)
+    release = threading.Event()
+    started = threading.Semaphore(0)
+    running = hold(controller, release, started)
+    running.start()
+    started.acquire()
+
+    began = time.monotonic()
+    with pytest.raises(Overloaded):
+        controller.call(lambda: None)
+    assert time.monotonic() - began < 1
+    release.set()
+    running.join(5)
+
+
+def test_rate_limits_pause_and_retry():
+    controller = AdmissionController(max_concurrency=2, retries=2, backoff=0.05, max_wait=5)
+    attempts = []
+
+    def flaky():
+        attempts.append(time.monotonic())
+        if len(attempts) < 3:
+            raise RateLimited()
+        return "ok"
+
+    assert controller.call(flaky) == "ok"
+    assert controller.stats()["rate_limited"] == 2
+    # Backoff doubles: 0.05s, then 0.1s
+    assert attempts[2] - attempts[1] >= 0.09
+
+
+def test_rate_limit_retries_are_bounded():
+    controller = AdmissionController(retries=1, backoff=0.01)
+
+    def always_limited():
+        raise RateLimited()
+
+    with pytest.raises(RateLimited):
+        controller.call(always_limited)
+    assert controller.stats()["rate_limited"] == 1
+
+
+def test_async_calls_beyond_the_queue_are_shed():
+    controller = AsyncAdmissionController(max_concurrency=1, max_queue=1, max_wait=5)
+
+    async def work():
+        await asyncio.sleep(0.1)
+        return "ok"
+
+    async def scenario():
+        return await asyncio.gather(*[controller.call(work) for _ in range(3)], return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    assert results[:2] == ["ok", "ok"]
+    assert isinstance(results[2], Overloaded)
@@ -0,0 +1,26 @@
+import time
+
+from cache import TTLCache
+
+
+def test_get_serves_stale_entries_unless_fresh_is_asked():
+    cache = TTLCache(ttl=0.05, stale_ttl=10)
+    cache.set("k", "v")
+    assert cache.get("k", fresh=True) == "v"
+    time.sleep(0.06)
+    assert cache.get("k") == "v"
+    assert cache.get("k", fresh=True) is None
+
+
+def test_failures_are_not_cached():
+    cache = TTLCache(ttl=10)
+
+    def fail():
+        raise ValueError("down")
+
+    try:
+        cache.get_or_load("k", fail)
+    except ValueError:
+        pass
+    assert cache.get_or_load("k", lambda: "v") == "v"
+    assert cache.get_or_load("k", fail) == "v"
@@ -0,0 +1,87 @@
+import asyncio
+import time
+
+import pytest
+
+from circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpen
+
+
+class Shed(Exception):
+    pass
+
+
+def fail():
+    raise ValueError("down")
+
+
+def trip(breaker, calls):
+    for _ in range(calls):
+        with pytest.raises(ValueError):
+            breaker.call(fail)
+
+
+def test_opens_once_the_failure_rate_is_reached():
+    breaker = CircuitBreaker("api", failure_threshold=0.5, min_calls=4, window=4, reset_timeout=60)
+    breaker.call(lambda: None)
+    breaker.call(lambda: None)
+    trip(breaker, 1)
+    assert breaker.state == CLOSED
+    trip(breaker, 1)
+    assert breaker.state == OPEN
+
+    with pytest.raises(CircuitOpen):
+        breaker.call(lambda: None)
+    assert breaker.stats()["rejected"] == 1
+
+
+def test_half_open_probe_closes_on_success():
+    breaker = CircuitBreaker("api", min_calls=2, window=2, reset_timeout=0.05, half_open_max=1)
+    trip(breaker, 2)
+    time.sleep(0.06)
+    assert breaker.state == HALF_OPEN
+
+    assert breaker.call(lambda: "ok") == "ok"
+    assert breaker.state == CLOSED
+
+
+def test_half_open_allows_limited_probes_and_reopens_on_failure():
+    breaker = CircuitBreaker("api", min_calls=2, window=2, reset_timeout=0.05, half_open_max=1)
+    trip(breaker, 2)
+    time.sleep(0.06)
+
+    breaker.before_call()  # the one probe
+    with pytest.raises(CircuitOpen):
+        breaker.before_call()
+    breaker.record(False)
+    assert breaker.state == OPEN
+    assert breaker.stats()["opened"] == 2
+
+
+def test_ignored_errors_count_neither_way():
+    breaker = CircuitBreaker("gemini", min_calls=2, window=2, ignore=(Shed,))
+
+    def shed():
+        raise Shed()
+
+    for _ in range(5):
+        with pytest.raises(Shed):
+            breaker.call(shed)
+    assert breaker.state == CLOSED
+    assert breaker.stats()["recent_calls"] == 0
+
+
+def test_async_calls_are_recorded():
+    breaker = CircuitBreaker("gemini", min_calls=2, window=2, reset_timeout=60)
+
+    async def afail():
+        raise ValueError("down")
+
+    async def scenario():
+        for _ in range(2):
+            with pytest.raises(ValueError):
+                await breaker.acall(afail)
+        with pytest.raises(CircuitOpen):
+            await breaker.acall(afail)
+
+    asyncio.run(scenario())
+    assert breaker.state == OPEN
@@ -0,0 +1,97 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from dedup import MessageDeduplicator, RedisMessageDeduplicator
+
+
+def slow_double(value, delay=0.2):
+    time.sleep(delay)
+    return value * 2
+
+
+def run_concurrently(fn, count):
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(fn())) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    return results
+
+
+@pytest.fixture(params=["memory", "redis"])
+def dedup(request):
+    if request.param == "memory":
+        return MessageDeduplicator(ttl=60, wait=5)
+    fakeredis = pytest.importorskip("fakeredis")
+    return RedisMessageDeduplicator(fakeredis.FakeRedis(), ttl=60, wait=5, poll_interval=0.02)
+
+
+def test_concurrent_deliveries_run_once(dedup):
+    calls = []
+
+    def handler():
+        calls.append(1)
+        return slow_double(2)
+
+    results = run_concurrently(lambda: dedup.run("SM1", handler), 3)
+
+    assert len(calls) == 1
+    assert sorted(results, key=lambda r: r[1]) == [(4, False), (4, True), (4, True)]
+    # A retry after completion gets the stored result at once
+    assert dedup.run("SM1", slow_double, 5) == (4, True)
+    assert dedup.stats()["duplicates"] == 3
+
+
+def test_duplicate_does_not_wait_with_wait_zero(dedup):
+    started = threading.Event()
+
+    def handler():
+        started.set()
+        return slow_double(1, delay=0.5)
+
+    owner = threading.Thread(target=dedup.run, args=("SM2", handler))
+    owner.start()
+    started.wait(5)
+    began = time.monotonic()
+    assert dedup.run("SM2", handler, wait=0) == (None, True)
+    assert time.monotonic() - began < 0.2
+    owner.join(5)
+
+
+def test_failures_are_not_stored(dedup):
+    def fail():
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        dedup.run("SM3", fail)
+    assert dedup.run("SM3", slow_double, 3, delay=0) == (6, False)
+
+
+def test_messages_without_sid_always_run(dedup):
+    assert dedup.run(None, slow_double, 1, delay=0) == (2, False)
+    assert dedup.run(None, slow_double, 1, delay=0) == (2, False)
+
+
+def test_entries_expire_after_ttl():
+    dedup = MessageDeduplicator(ttl=0.05)
+    assert dedup.run("SM4", slow_double, 1, delay=0) == (2, False)
+    time.sleep(0.1)
+    assert dedup.run("SM4", slow_double, 2, delay=0) == (4, False)
+
+
+def test_async_duplicates_share_the_result(dedup):
+    async def handler(value):
+        await asyncio.sleep(0.1)
+        return value
+
+    async def scenario():
+        results = await asyncio.gather(*[dedup.arun("SM5", handler, 1) for _ in range(3)])
+        return results, await dedup.arun("SM5", handler, 9, wait=0)
+
+    results, retry = asyncio.run(scenario())
+    assert sorted(results, key=lambda r: r[1]) == [(1, False), (1, True), (1, True)]
+    assert retry == (1, True)
@@ -0,0 +1,91 @@
+import pytest
+
+from intent_router import IntentRouter
+
+ENDPOINTS = ["payments/statement_info", "end_user/courses", "payments/security", "payments/paypal"]
+
+
+@pytest.fixture
+def router():
+    return IntentRouter(ENDPOINTS)
+
+
+def test_booking_is_rebuilt_for_the_sender(router):
+    command = router.route("Book professional id 13 date 2030-01-05 time 10:00", user_id=7)
+    assert command == "APPOINTMENT BOOK PROFESSIONAL ID 13 DATESTART 2030-01-05 TIMESTART 10:00 USERID 7"
+
+
+def test_booking_with_polite_wording(router):
+    command = router.route("Hi, I would like to book: Professional ID 13, Date start 05/01/2030, Time start 9.30 please", user_id=7)
+    assert command == "APPOINTMENT BOOK PROFESSIONAL ID 13 DATESTART 2030-01-05 TIMESTART 09:30 USERID 7"
+
+
+@pytest.mark.parametrize("message", [
+    "Please cancel my appointment: Professional ID 13, Date start 2030-01-05, Time start 10:00",
+    "Reschedule Professional ID 13 Date 2030-01-05 Time 10:00",
+    "Can you change Professional ID 13 Date 2030-01-05 Time 10:00 to the afternoon?",
+    "I don't want Professional ID 13 Date 2030-01-05 Time 10:00 anymore",
+])
+def test_booking_fields_in_other_requests_go_to_gemini(router, message):
+    assert router.route(message, user_id=7) is None
+
+
+def test_booking_needs_a_user(router):
+    assert router.route("Book professional id 13 date 2030-01-05 time 10:00", user_id=None) is None
+
+
+def test_pasted_booking_uses_the_senders_user_id(router):
+    message = "APPOINTMENT BOOK PROFESSIONAL ID 13 DATESTART 2030-01-05 TIMESTART 10:00 USERID 4242"
+    assert router.route(message, user_id=7) == (
+        "APPOINTMENT BOOK PROFESSIONAL ID 13 DATESTART 2030-01-05 TIMESTART 10:00 USERID 7"
+    )
+    assert router.route(message, user_id=None) is None
+
+
+def test_pasted_commands(router):
+    assert router.route("PROFESSIONAL SLOT NEEDED 13") == "PROFESSIONAL SLOT NEEDED 13"
+    assert router.route("INFO: payments/security") == "INFO: payments/security"
+    assert router.route("INFO: payments/unknown") is None
+
+
+def test_slots(router):
+    assert router.route("Show me the available slots for professional 13") == "PROFESSIONAL SLOT NEEDED 13"
+
+
+@pytest.mark.parametrize("message", [
+    "Yes of course",
+    "Of course, thanks!",
+    "I got my bank statement today",
+    "Can you send me a statement?",
+])
+def test_ambiguous_words_go_to_gemini(router, message):
+    assert router.route(message, user_id=7) is None
+
+
+def test_info_rules(router):
+    assert router.route("Which courses do you offer?") == "INFO: end_user/courses"
+    assert router.route("Tell me about payment security") == "INFO: payments/security"
+
+
+def test_stats(router):
+    router.route("Yes of course")
+    router.route("PROFESSIONAL SLOT NEEDED 13")
+    assert router.stats() == {"hits": {"book": 0, "slots": 0, "info": 0, "command": 1}, "misses": 1}
+
+
+@pytest.mark.parametrize("message", [
+    "Which slots are available for professional 13?",
+    "Hi, what availability does professional id 13 have?",
+    "professional 13 slots please",
+])
+def test_plain_slot_requests(router, message):
+    assert router.route(message, user_id=7) == "PROFESSIONAL SLOT NEEDED 13"
+
+
+@pytest.mark.parametrize("message", [
+    "I booked a slot with professional 13 yesterday, can I cancel it?",
+    "professional 13 slot on tuesday please, or is another professional available?",
+    "Can I move my slot with professional 13?",
+])
+def test_slot_mentions_that_are_not_requests_go_to_gemini(router, message):
+    assert router.route(message, user_id=7) is None
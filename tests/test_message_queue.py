@@ -0,0 +1,103 @@
+import threading
+
+import pytest
+
+from message_queue import InMemoryQueueBackend, QueueFull, WorkerPool
+
+
+@pytest.fixture
+def redis_client():
+    fakeredis = pytest.importorskip("fakeredis")
+    return fakeredis.FakeRedis()
+
+
+def redis_backend(client, consumer):
+    from message_queue import RedisQueueBackend
+    return RedisQueueBackend(client, consumer=consumer, maxsize=10)
+
+
+def test_memory_queue_is_bounded():
+    backend = InMemoryQueueBackend(maxsize=1)
+    backend.put({"n": 1})
+    with pytest.raises(QueueFull):
+        backend.put({"n": 2})
+    assert backend.get(timeout=0.01) == {"n": 1}
+    assert backend.get(timeout=0.01) is None
+
+
+def test_worker_pool_handles_every_item():
+    handled = []
+    done = threading.Event()
+
+    def handler(item):
+        handled.append(item["n"])
+        if len(handled) == 5:
+            done.set()
+
+    pool = WorkerPool(InMemoryQueueBackend(), handler, concurrency=2, poll_timeout=0.05)
+    pool.start()
+    for n in range(5):
+        pool.submit({"n": n})
+    assert done.wait(5)
+    pool.stop()
+    assert sorted(handled) == list(range(5))
+
+
+def test_manual_ack_waits_for_the_handler(redis_client):
+    backend = redis_backend(redis_client, "worker-a")
+    handed_over = []
+    received = threading.Event()
+
+    def handler(item, ack):
+        handed_over.append(ack)
+        received.set()
+
+    pool = WorkerPool(backend, handler, concurrency=1, poll_timeout=0.05, manual_ack=True)
+    pool.start()
+    pool.submit({"n": 1})
+    assert received.wait(5)
+    pool.stop()
+    assert redis_client.llen("twolio:messages:processing:worker-a") == 1
+    handed_over[0]()
+    assert redis_client.llen("twolio:messages:processing:worker-a") == 0
+
+
+def test_redis_items_are_acked_from_the_consumers_processing_list(redis_client):
+    backend = redis_backend(redis_client, "worker-a")
+    backend.put({"n": 1})
+    item = backend.get(timeout=0.1)
+    assert item == {"n": 1}
+    assert redis_client.llen("twolio:messages:processing:worker-a") == 1
+    backend.ack(item)
+    assert redis_client.llen("twolio:messages:processing:worker-a") == 0
+
+
+def test_redis_recovery_skips_live_consumers(redis_client):
+    crashed = redis_backend(redis_client, "worker-a")
+    crashed.put({"n": 1})
+    crashed.put({"n": 2})
+    assert crashed.get(timeout=0.1) == {"n": 1}
+
+    restarted = redis_backend(redis_client, "worker-b")
+    # worker-a's heartbeat is still fresh: its item may still be in progress
+    assert restarted.requeue_unacked() == 0
+
+    redis_client.delete("twolio:messages:consumer:worker-a")
+    assert restarted.requeue_unacked() == 1
+    # The recovered item is handed out again before newer ones
+    assert restarted.get(timeout=0.1) == {"n": 1}
+    assert restarted.get(timeout=0.1) == {"n": 2}
+
+
+def test_worker_pool_requeues_at_start(redis_client):
+    crashed = redis_backend(redis_client, "worker-a")
+    crashed.put({"n": 1})
+    crashed.get(timeout=0.1)
+    redis_client.delete("twolio:messages:consumer:worker-a")
+
+    handled = threading.Event()
+    pool = WorkerPool(redis_backend(redis_client, "worker-b"), lambda item: handled.set(), concurrency=1,
+                      poll_timeout=0.05)
+    pool.start()
+    assert handled.wait(5)
+    pool.stop()
@@ -0,0 +1,46 @@
+import time
+
+from messaging import ReplySender, split_message
+
+
+def test_delayed_reply_does_not_hold_a_worker():
+    sent = []
+    sender = ReplySender(lambda to, body: sent.append((to, body, time.monotonic())), max_workers=1)
+    started = time.monotonic()
+    delayed = sender.send("+1", ["later", "after"], delay=0.3)
+    # The only worker is free while "+1" waits
+    assert sender.send("+2", ["now"])[0].result(1)
+    assert sent[0][:2] == ("+2", "now")
+    assert sent[0][2] - started < 0.25
+
+    assert all(future.result(2) for future in delayed)
+    assert [(to, body) for to, body, _ in sent[1:]] == [("+1", "later"), ("+1", "after")]
+    assert sent[1][2] - started >= 0.3
+    assert sender.pending() == 0
+
+
+def test_reply_queued_during_delay_goes_out_after_it():
+    sent = []
+    sender = ReplySender(lambda to, body: sent.append(body), max_workers=2)
+    first = sender.send("+1", ["first"], delay=0.2)
+    second = sender.send("+1", ["second"])
+    assert second[0].result(2) and first[0].result(2)
+    assert sent == ["first", "second"]
+
+
+def test_split_prefers_paragraphs_lines_then_spaces():
+    text = "a" * 60 + "\n\n" + "b " * 10 + "\n" + "c" * 30
+    assert split_message(text, max_len=100) == ["a" * 60, "b " * 10 + "\n" + "c" * 30]
+
+
+def test_split_ignores_an_early_break():
+    text = "Here are your options:\n\n" + "word " * 400
+    chunks = split_message(text)
+    assert len(chunks) == 2
+    assert chunks[0].startswith("Here are your options:")
+    assert all(len(chunk) <= 1600 for chunk in chunks)
+
+
+def test_split_cuts_only_words_longer_than_a_chunk():
+    assert split_message("x" * 250, max_len=100) == ["x" * 100, "x" * 100, "x" * 50]
+    assert split_message("hi " + "x" * 150, max_len=100) == ["hi", "x" * 100, "x" * 50]
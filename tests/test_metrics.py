@@ -0,0 +1,31 @@
+from metrics import Registry
+
+
+def test_gauge_group_reads_its_stats_once_per_render():
+    calls = []
+
+    def stats():
+        calls.append(1)
+        return {"entries": 3, "evictions": 1}
+
+    registry = Registry()
+    registry.gauge_group(stats, (
+        ("sessions", "Sessions.", "entries", "gauge"),
+        ("evictions_total", "Evictions.", "evictions", "counter"),
+        ("bytes", "Bytes.", "approx_bytes", "gauge"),
+    ))
+    lines = registry.render().splitlines()
+    assert len(calls) == 1
+    assert "sessions 3" in lines
+    assert "# TYPE evictions_total counter" in lines
+    assert "evictions_total 1" in lines
+    # A field the stats don't have renders no sample
+    assert "# TYPE bytes gauge" in lines
+    assert not any(line.startswith("bytes ") for line in lines)
+
+
+def test_registering_a_name_again_replaces_it():
+    registry = Registry()
+    registry.gauge("depth", "Depth.", lambda: 1)
+    registry.gauge("depth", "Depth.", lambda: 2)
+    assert registry.render() == "# HELP depth Depth.\n# TYPE depth gauge\ndepth 2\n"
@@ -0,0 +1,191 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from sender_queue import AsyncSenderQueue, RedisSenderQueue, SenderQueue
+
+
+class BlockingHandler:
+    """Records each batch; the first batch blocks until `release` is set."""
+
+    def __init__(self):
+        self.batches = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.running = 0
+        self.max_running = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, sender, messages):
+        with self._lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        self.started.set()
+        self.release.wait(5)
+        with self._lock:
+            self.batches.append(list(messages))
+            self.running -= 1
+        return "+".join(messages)
+
+
+def start(target, *args):
+    results = []
+    thread = threading.Thread(target=lambda: results.append(target(*args)), daemon=True)
+    thread.start()
+    return thread, results
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_burst_is_merged_and_only_the_last_caller_replies():
+    handler = BlockingHandler()
+    queue = SenderQueue(handler)
+
+    first, first_result = start(queue.submit, "+1", "a")
+    assert handler.started.wait(5)
+    second, second_result = start(queue.submit, "+1", "b")
+    wait_until(lambda: len(queue._lanes["+1"].pending) == 1)
+    third, third_result = start(queue.submit, "+1", "c")
+    wait_until(lambda: len(queue._lanes["+1"].pending) == 2)
+    handler.release.set()
+    for thread in (first, second, third):
+        thread.join(5)
+
+    assert handler.batches == [["a"], ["b", "c"]]
+    assert first_result == [("a", True)]
+    assert second_result == [("b+c", False)]
+    assert third_result == [("b+c", True)]
+    assert queue.stats() == {"senders": 0, "batches": 2, "merged": 1}
+
+
+def test_senders_do_not_wait_for_each_other():
+    handler = BlockingHandler()
+    queue = SenderQueue(handler)
+    blocked, _ = start(queue.submit, "+1", "a")
+    assert handler.started.wait(5)
+
+    other = SenderQueue(lambda sender, messages: "ok")
+    assert other.submit("+2", "b") == ("ok", True)
+    handler.release.set()
+    blocked.join(5)
+
+
+def test_post_hands_off_to_the_active_drainer():
+    handler = BlockingHandler()
+    delivered = []
+    queue = SenderQueue(handler, deliver=lambda sender, reply: delivered.append((sender, reply)))
+
+    first, _ = start(queue.post, "+1", "a")
+    assert handler.started.wait(5)
+    queue.post("+1", "b")  # returns while "a" is still being handled
+    queue.post("+1", "c")
+    handler.release.set()
+    first.join(5)
+
+    assert handler.batches == [["a"], ["b", "c"]]
+    assert delivered == [("+1", "a"), ("+1", "b+c")]
+
+
+
+def test_posted_message_is_done_only_after_its_reply_is_delivered():
+    handler = BlockingHandler()
+    events = []
+    queue = SenderQueue(handler, deliver=lambda sender, reply: events.append(("delivered", reply)))
+
+    first, _ = start(queue.post, "+1", "a", lambda: events.append(("done", "a")))
+    assert handler.started.wait(5)
+    queue.post("+1", "b", lambda: events.append(("done", "b")))
+    # Handed to the drainer, not handled yet
+    assert ("done", "b") not in events
+    handler.release.set()
+    first.join(5)
+
+    assert events == [("delivered", "a"), ("done", "a"), ("delivered", "b"), ("done", "b")]
+
+def test_handler_errors_reach_every_caller_of_the_batch():
+    def handler(sender, messages):
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        SenderQueue(handler).submit("+1", "a")
+
+
+def test_async_burst_is_merged():
+    async def scenario():
+        release = asyncio.Event()
+        batches = []
+
+        async def handler(sender, messages):
+            await release.wait()
+            batches.append(list(messages))
+            return "+".join(messages)
+
+        queue = AsyncSenderQueue(handler)
+        tasks = [asyncio.create_task(queue.submit("+1", message)) for message in "abc"]
+        await asyncio.sleep(0.01)
+        release.set()
+        return batches, await asyncio.gather(*tasks)
+
+    batches, results = asyncio.run(scenario())
+    assert batches == [["a"], ["b", "c"]]
+    assert results == [("a", True), ("b+c", False), ("b+c", True)]
+
+
+@pytest.fixture
+def redis_server():
+    fakeredis = pytest.importorskip("fakeredis")
+    # Redis locks run Lua scripts: fakeredis needs the [lua] extra
+    pytest.importorskip("lupa")
+    return fakeredis.FakeServer()
+
+
+def redis_queue(redis_server, handler, **kwargs):
+    import fakeredis
+    return RedisSenderQueue(handler, fakeredis.FakeRedis(server=redis_server), poll_interval=0.05, **kwargs)
+
+
+def test_redis_lane_is_shared_by_workers(redis_server):
+    handler = BlockingHandler()
+    # Two workers with their own clients, like two gunicorn processes
+    worker_a = redis_queue(redis_server, handler)
+    worker_b = redis_queue(redis_server, handler)
+
+    first, first_result = start(worker_a.submit, "+1", "a")
+    assert handler.started.wait(5)
+    second, second_result = start(worker_b.submit, "+1", "b")
+    wait_until(lambda: worker_a.client.llen("twolio:lane:+1") == 1)
+    third, third_result = start(worker_a.submit, "+1", "c")
+    wait_until(lambda: worker_a.client.llen("twolio:lane:+1") == 2)
+    handler.release.set()
+    for thread in (first, second, third):
+        thread.join(5)
+
+    assert handler.max_running == 1
+    assert handler.batches == [["a"], ["b", "c"]]
+    assert first_result == [("a", True)]
+    assert second_result == [("b+c", False)]
+    assert third_result == [("b+c", True)]
+
+
+def test_redis_post_hands_off_and_delivers(redis_server):
+    handler = BlockingHandler()
+    delivered = []
+    deliver = lambda sender, reply: delivered.append(reply)  # noqa: E731
+    worker_a = redis_queue(redis_server, handler, deliver=deliver)
+    worker_b = redis_queue(redis_server, handler, deliver=deliver)
+
+    first, _ = start(worker_a.post, "+1", "a")
+    assert handler.started.wait(5)
+    worker_b.post("+1", "b")  # returns at once: worker_a is draining
+    handler.release.set()
+    first.join(5)
+
+    assert handler.batches == [["a"], ["b"]]
+    assert delivered == ["a", "b"]
@@ -0,0 +1,80 @@
+import threading
+import time
+
+import pytest
+
+from session_store import InMemorySessionStore, RedisSessionStore
+
+
+@pytest.fixture(params=["memory", "redis"])
+def store(request):
+    if request.param == "memory":
+        return InMemorySessionStore(ttl=60)
+    fakeredis = pytest.importorskip("fakeredis")
+    return RedisSessionStore(fakeredis.FakeRedis(), ttl=60)
+
+
+def test_update_changes_only_the_given_fields(store):
+    store.update("+1", instruction="info")
+    session = store.update("+1", registration_state="ask_name")
+    assert session.instruction == "info"
+    assert session.registration_state == "ask_name"
+    assert store.get("+1").to_dict() == session.to_dict()
+
+
+def test_clearing_every_field_removes_the_session(store):
+    store.update("+1", instruction="info", registration_state="ask_name")
+    assert store.update("+1", instruction=None, registration_state=None) is None
+    assert store.get("+1") is None
+
+
+def test_unknown_fields_are_rejected(store):
+    with pytest.raises(ValueError):
+        store.update("+1", colour="blue")
+    with pytest.raises(ValueError):
+        store.merge_registration_data("+1", {"name": "Mario"}, colour="blue")
+
+
+def test_merge_keeps_the_other_registration_keys(store):
+    store.merge_registration_data("+1", {"name": "Mario"}, registration_state="ask_surname")
+    session = store.merge_registration_data("+1", {"surname": "Rossi"}, registration_state="ask_email")
+    assert session.registration_state == "ask_email"
+    assert session.registration_data == {"name": "Mario", "surname": "Rossi"}
+
+
+def test_concurrent_merges_lose_no_keys(store):
+    keys = [f"field{i}" for i in range(8)]
+    threads = [
+        threading.Thread(target=store.merge_registration_data, args=("+1", {key: key}))
+        for key in keys
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert store.get("+1").registration_data == {key: key for key in keys}
+
+
+def test_memory_store_evicts_least_recently_used():
+    store = InMemorySessionStore(maxsize=2, ttl=60)
+    store.update("+1", instruction="a")
+    store.update("+2", instruction="b")
+    store.get("+1")
+    store.update("+3", instruction="c")
+    assert store.get("+2") is None
+    assert store.get("+1").instruction == "a"
+    assert store.stats()["evictions"] == 1
+
+
+def remaining_ttl(store, sender):
+    if isinstance(store, RedisSessionStore):
+        return store.client.ttl(store._key(sender))
+    return store._data[sender].expires_at - time.time()
+
+
+def test_shorter_ttl_does_not_cut_the_session_short(store):
+    store.update("+1", instruction="info")
+    store.update("+1", ttl=1, registration_state="ask_name")
+    assert remaining_ttl(store, "+1") > 30
+    store.update("+1", ttl=120, registration_state="ask_surname")
+    assert remaining_ttl(store, "+1") > 60
@@ -0,0 +1,81 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from singleflight import AsyncSingleFlight, SingleFlight
+
+
+def test_concurrent_calls_are_coalesced():
+    flight = SingleFlight()
+    calls = []
+    results = []
+
+    def load(key):
+        calls.append(key)
+        time.sleep(0.2)
+        return f"value:{key}"
+
+    threads = [threading.Thread(target=lambda: results.append(flight.do("k", load, "k"))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+
+    assert calls == ["k"]
+    assert results == ["value:k"] * 4
+    assert (flight.executed, flight.shared, flight.in_flight()) == (1, 3, 0)
+
+
+def test_failures_are_shared_but_not_cached():
+    flight = SingleFlight()
+    started = threading.Event()
+    errors = []
+
+    def fail():
+        started.set()
+        time.sleep(0.2)
+        raise ValueError("boom")
+
+    def follower():
+        started.wait(5)
+        try:
+            flight.do("k", fail)
+        except ValueError as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=follower)
+    thread.start()
+    with pytest.raises(ValueError):
+        flight.do("k", fail)
+    thread.join(5)
+
+    assert len(errors) == 1
+    # The next call runs again instead of replaying the error
+    assert flight.do("k", lambda: "ok") == "ok"
+
+
+def test_async_calls_are_coalesced_and_failures_not_cached():
+    flight = AsyncSingleFlight()
+    calls = []
+
+    async def load():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "value"
+
+    async def fail():
+        raise ValueError("boom")
+
+    async def scenario():
+        results = await asyncio.gather(*[flight.do("k", load) for _ in range(3)])
+        with pytest.raises(ValueError):
+            await flight.do("f", fail)
+        return results, await flight.do("f", load)
+
+    results, retried = asyncio.run(scenario())
+    assert results == ["value"] * 3
+    assert retried == "value"
+    assert len(calls) == 2
+    assert flight.in_flight() == 0
@@ -0,0 +1,55 @@
+import pytest
+
+from slot_index import RedisSlotLocks, SlotIndex, SlotLocks
+
+
+def test_is_free_only_knows_the_dates_the_api_returned():
+    index = SlotIndex({"2030-01-02": ["10:00:00", "09:30"], "2030-01-03": []})
+    assert index.is_free("2030-01-02", "10:00") is True
+    assert index.is_free("2030-01-02", "11:00") is False
+    # Returned without free times: fully booked
+    assert index.is_free("2030-01-03", "10:00") is False
+    # Not returned at all (e.g. beyond the API's range): unknown
+    assert index.is_free("2031-01-01", "10:00") is None
+
+
+def test_remove_keeps_the_date_known():
+    index = SlotIndex({"2030-01-02": ["10:00"]})
+    assert index.remove("2030-01-02", "10:00") is True
+    assert index.remove("2030-01-02", "10:00") is False
+    assert index.is_free("2030-01-02", "10:00") is False
+    assert not index
+
+
+def test_items_are_sorted():
+    index = SlotIndex({"2030-01-03": ["10:00"], "2030-01-02": ["11:00", "09:00"]})
+    assert index.items() == [("2030-01-02", ["09:00", "11:00"]), ("2030-01-03", ["10:00"])]
+    assert len(index) == 3
+
+
+def test_slot_locks_time_out_and_are_released():
+    locks = SlotLocks(wait=0.05)
+    assert locks.acquire("slot")
+    assert not locks.acquire("slot")
+    assert locks.contended == 1
+    locks.release("slot")
+    assert locks.acquire("slot")
+    locks.release("slot")
+    assert locks._locks == {}
+
+
+def test_redis_slot_locks_are_shared_between_instances():
+    fakeredis = pytest.importorskip("fakeredis")
+    # Redis locks run Lua scripts: fakeredis needs the [lua] extra
+    pytest.importorskip("lupa")
+    client = fakeredis.FakeRedis()
+    first = RedisSlotLocks(client, ttl=5, wait=0.05)
+    second = RedisSlotLocks(client, ttl=5, wait=0.05)
+    assert first.acquire("slot")
+    assert not second.acquire("slot")
+    assert second.contended == 1
+    first.release("slot")
+    assert second.acquire("slot")
+    second.release("slot")
+    # Releasing a lock that isn't held is a no-op
+    second.release("slot")
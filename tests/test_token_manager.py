@@ -0,0 +1,62 @@
+import time
+
+import pytest
+
+from token_manager import RedisTokenStore, TokenManager
+
+
+class FakeResponse:
+    def __init__(self, payload):
+        self.payload = payload
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.payload
+
+
+class FakeApi:
+    def __init__(self):
+        self.calls = []
+
+    def post(self, path, json):
+        self.calls.append(path)
+        n = len(self.calls)
+        return FakeResponse({"auth": {"access_token": f"token{n}", "refreshToken": f"refresh{n}", "expires_in": 900}})
+
+
+@pytest.fixture
+def redis_store():
+    fakeredis = pytest.importorskip("fakeredis")
+    # The store's Redis lock runs Lua scripts: fakeredis needs the [lua] extra
+    pytest.importorskip("lupa")
+    return RedisTokenStore(fakeredis.FakeRedis(), lock_timeout=5)
+
+
+def test_store_round_trip_sets_a_ttl(redis_store):
+    expires_at = time.time() + 120
+    redis_store.save("access", "refresh", expires_at)
+    assert redis_store.load() == {"access_token": "access", "refresh_token": "refresh", "expires_at": expires_at}
+    assert 0 < redis_store.client.ttl(redis_store.key) <= 120
+
+
+def test_workers_share_one_login(redis_store):
+    api = FakeApi()
+    first = TokenManager(api, "user", "secret", store=redis_store)
+    second = TokenManager(api, "user", "secret", store=redis_store)
+    assert first.get_token() == "token1"
+    assert second.get_token() == "token1"
+    assert api.calls == ["auth/login"]
+
+
+def test_rejected_shared_token_is_renewed(redis_store):
+    api = FakeApi()
+    first = TokenManager(api, "user", "secret", store=redis_store)
+    second = TokenManager(api, "user", "secret", store=redis_store)
+    assert first.get_token() == second.get_token() == "token1"
+    assert second.invalidate("token1") == "token2"
+    assert api.calls == ["auth/login", "auth/refresh"]
+    assert redis_store.load()["access_token"] == "token2"
+    assert first.invalidate("token1") == "token2"
+    assert len(api.calls) == 2
@@ -0,0 +1,205 @@
+import base64
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Config
+AUTH_REFRESH_PATH = os.getenv("AUTH_REFRESH_PATH", "auth/refresh")
+TOKEN_REFRESH_MARGIN = float(os.getenv("TOKEN_REFRESH_MARGIN", "60"))
+TOKEN_DEFAULT_TTL = float(os.getenv("TOKEN_DEFAULT_TTL", "900"))
+
+
+def token_expiry(auth_info, access_token, now=None):
+    """
+    Work out when an access token expires (epoch seconds).
+    Uses expires_in from the auth payload, then the JWT `exp` claim, and
+    finally falls back to TOKEN_DEFAULT_TTL.
+    """
+    now = time.time() if now is None else now
+    expires_in = auth_info.get("expires_in") or auth_info.get("expiresIn")
+    if expires_in:
+        try:
+            return now + float(expires_in)
+        except (TypeError, ValueError):
+            pass
+
+    try:
+        payload = access_token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        claims = json.loads(base64.urlsafe_b64decode(payload))
+        if "exp" in claims:
+            return float(claims["exp"])
+    except Exception:
+        pass
+
+    return now + TOKEN_DEFAULT_TTL
+
+
+class TokenManager:
+    """
+    One service token for the whole process.
+
+    The bot logs in with a single set of service credentials, so the token is
+    shared by every sender. It is refreshed ahead of expiry with the refresh
+    token (falling back to a full login), and a lock makes sure concurrent
+    callers never trigger more than one login/refresh at a time.
+    """
+
+    def __init__(self, api, username, password, login_path="auth/login",
+                 refresh_path=AUTH_REFRESH_PATH, refresh_margin=TOKEN_REFRESH_MARGIN, store=None):
+        self.api = api
+        self.username = username
+        self.password = password
+        self.login_path = login_path
+        self.refresh_path = refresh_path
+        self.refresh_margin = refresh_margin
+        # Optional shared store (e.g. RedisTokenStore) so all workers use one token
+        self.store = store
+        self._lock = threading.Lock()
+        self._access_token = None
+        self._refresh_token = None
+        self._expires_at = 0.0
+        self.logins = 0
+        self.refreshes = 0
+
+    def get_token(self):
+        """Return a valid access token, or None if authentication failed."""
+        token, expires_at = self._access_token, self._expires_at
+        now = time.time()
+
+        if token and now < expires_at - self.refresh_margin:
+            return token
+
+        if token and now < expires_at:
+            # Still valid but close to expiry: one caller refreshes, the
+            # others keep using the current token instead of waiting.
+            if self._lock.acquire(blocking=False):
+                try:
+                    self._renew()
+                finally:
+                    self._lock.release()
+            return self._access_token or token
+
+        with self._lock:
+            if self._access_token and time.time() < self._expires_at - self.refresh_margin:
+                return self._access_token
+            self._renew()
+            return self._access_token
+
+    def invalidate(self, access_token):
+        """
+        Mark `access_token` as rejected (e.g. after a 401) and return a fresh
+        token. If another thread already replaced it, the new one is returned
+        without renewing again.
+        """
+        with self._lock:
+            if self._access_token == access_token:
+                self._access_token = None
+                self._expires_at = 0.0
+                self._renew(rejected=access_token)
+            return self._access_token
+
+    def _renew(self, rejected=None):
+        # Called with self._lock held
+        if self.store is None:
+            self._renew_token()
+            return
+
+        lock = self.store.lock()
+        try:
+            acquired = lock.acquire()
+        except Exception as e:
+            logger.warning("Shared token lock unavailable: %s", e)
+            acquired = False
+
+        try:
+            # Another worker may already have renewed the token
+            shared = self._load_shared()
+            if (shared and shared["access_token"] != rejected
+                    and time.time() < shared["expires_at"] - self.refresh_margin):
+                self._access_token = shared["access_token"]
+                self._refresh_token = shared.get("refresh_token")
+                self._expires_at = shared["expires_at"]
+                return
+
+            self._renew_token()
+            if self._access_token:
+                try:
+                    self.store.save(self._access_token, self._refresh_token, self._expires_at)
+                except Exception as e:
+                    logger.warning("Failed to share service token: %s", e)
+        finally:
+            if acquired:
+                try:
+                    lock.release()
+                except Exception as e:
+                    logger.warning("Failed to release shared token lock: %s", e)
+
+    def _load_shared(self):
+        try:
+            return self.store.load()
+        except Exception as e:
+            logger.warning("Shared token store unavailable: %s", e)
+            return None
+
+    def _renew_token(self):
+        if self._refresh_token:
+            try:
+                self._store(self._post(self.refresh_path, {"refreshToken": self._refresh_token}))
+                self.refreshes += 1
+                return
+            except Exception as e:
+                logger.warning("Token refresh failed, logging in again: %s", e)
+
+        try:
+            self._store(self._post(self.login_path, {"username": self.username, "password": self.password}))
+            self.logins += 1
+            logger.info("Service token obtained")
+        except Exception as e:
+            logger.error("Failed to authenticate: %s", e)
+            self._access_token = None
+            self._refresh_token = None
+            self._expires_at = 0.0
+
+    def _post(self, path, payload):
+        response = self.api.post(path, json=payload)
+        response.raise_for_status()
+        return response.json().get("auth", {})
+
+    def _store(self, auth_info):
+        access_token = auth_info.get("access_token")
+        refresh_token = auth_info.get("refreshToken")
+        if not access_token:
+            raise ValueError("no access_token in auth response")
+
+        self._access_token = access_token
+        self._refresh_token = refresh_token or self._refresh_token
+        self._expires_at = token_expiry(auth_info, access_token)
+
+
+class RedisTokenStore:
+    """
+    Keeps the service token in Redis so every gunicorn worker and instance
+    shares it, with a Redis lock so only one of them renews it at a time.
+    """
+
+    def __init__(self, client, key="twolio:service_token", lock_timeout=30):
+        self.client = client
+        self.key = key
+        self.lock_timeout = lock_timeout
+
+    def load(self):
+        raw = self.client.get(self.key)
+        return json.loads(raw) if raw else None
+
+    def save(self, access_token, refresh_token, expires_at):
+        ttl = max(1, int(expires_at - time.time()))
+        payload = {"access_token": access_token, "refresh_token": refresh_token, "expires_at": expires_at}
+        self.client.set(self.key, json.dumps(payload), ex=ttl)
+
+    def lock(self):
+        return self.client.lock(f"{self.key}:lock", timeout=self.lock_timeout, blocking_timeout=self.lock_timeout)